@@ -0,0 +1,283 @@
+"""
+Control de admisión para análisis y reportes
+Límite global y por negocio de ejecuciones simultáneas con una cola acotada (429/503 con
+Retry-After cuando se llena) y token buckets para las llamadas a la IA
+"""
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+from config import (
+    ADMISSION_MAX_CONCURRENT,
+    ADMISSION_MAX_PER_BUSINESS,
+    ADMISSION_QUEUE_SIZE,
+    ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    LLM_CALLS_PER_MINUTE,
+    LLM_BURST,
+    LLM_CALLS_PER_BUSINESS_PER_MINUTE,
+    LLM_BUSINESS_BURST
+)
+
+
+# Negocio de la petición en curso: las llamadas a la IA lo usan para su token bucket
+current_business: ContextVar = ContextVar('current_business', default=None)
+
+# Segundos que una llamada a la IA puede esperar cupo; > 0 en procesos sin usuario esperando
+llm_quota_wait: ContextVar = ContextVar('llm_quota_wait', default=0.0)
+
+
+class AdmissionRejected(Exception):
+    """La petición no se admite: 429 (el negocio excede su cupo) o 503 (servicio saturado)"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Lease:
+    """
+    Lugar admitido para una respuesta en streaming. release() es idempotente: lo llaman el
+    generador al terminar y la respuesta al cerrarse, aunque el cuerpo nunca se haya iterado.
+    """
+
+    def __init__(self, controller, business_id, started: float):
+        self.controller = controller
+        self.business_id = business_id
+        self.started = started
+        self._lock = threading.Lock()
+        self._released = False
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.controller.release(self.business_id, self.started)
+
+
+class AdmissionController:
+    """
+    Semáforo con cola acotada. Un negocio puede tener a lo sumo `max_per_business`
+    peticiones entre ejecutándose y en cola (si no, 429); si hay `max_concurrent`
+    ejecutándose se espera en la cola hasta `queue_timeout` segundos (cola llena o
+    plazo vencido: 503). Retry-After se estima con la duración media de las ejecuciones.
+    """
+
+    def __init__(self, max_concurrent: int, max_per_business: int, queue_size: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_per_business = max_per_business
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        self._load = Counter()  # negocio -> peticiones ejecutándose + en cola
+        self._avg_seconds = 1.0
+        self._stats = Counter()
+
+    def _retry_after(self, ahead: int = 0) -> int:
+        return max(1, math.ceil(self._avg_seconds * (ahead + 1) / self.max_concurrent))
+
+    def acquire(self, business_id=None) -> float:
+        """Ocupa un lugar o lanza AdmissionRejected; retorna el instante de inicio para release()"""
+        with self._cond:
+            if business_id is not None and self._load[business_id] >= self.max_per_business:
+                self._stats['rechazadas_negocio'] += 1
+                raise AdmissionRejected(
+                    429, "Demasiadas peticiones simultáneas para este negocio",
+                    max(1, math.ceil(self._avg_seconds))
+                )
+            if self._running >= self.max_concurrent or self._waiting:
+                if self._waiting >= self.queue_size:
+                    self._stats['rechazadas_cola_llena'] += 1
+                    raise AdmissionRejected(503, "Servicio saturado, intenta nuevamente", self._retry_after(self._waiting))
+                self._waiting += 1
+                self._load[business_id] += 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self._running >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._load[business_id] -= 1
+                            if self._load[business_id] <= 0:
+                                del self._load[business_id]
+                            self._stats['rechazadas_espera'] += 1
+                            raise AdmissionRejected(503, "Tiempo de espera agotado en la cola", self._retry_after(self._waiting))
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                self._stats['encoladas'] += 1
+            else:
+                self._load[business_id] += 1
+            self._running += 1
+            self._stats['admitidas'] += 1
+            return time.monotonic()
+
+    def release(self, business_id, started: float):
+        with self._cond:
+            self._running -= 1
+            self._load[business_id] -= 1
+            if self._load[business_id] <= 0:
+                del self._load[business_id]
+            # Media móvil exponencial de la duración, base del Retry-After
+            self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.monotonic() - started)
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self, business_id=None):
+        """Ejecuta el bloque dentro de un lugar admitido, con el negocio como contexto de la IA"""
+        started = self.acquire(business_id)
+        token = current_business.set(business_id)
+        try:
+            yield
+        finally:
+            current_business.reset(token)
+            self.release(business_id, started)
+
+    def lease(self, business_id=None) -> Lease:
+        """Ocupa un lugar (o lanza AdmissionRejected) para liberarlo después con Lease.release()"""
+        return Lease(self, business_id, self.acquire(business_id))
+
+    def stream(self, lease: Lease, iterator):
+        """
+        Itera una respuesta en streaming con un lugar ya admitido (lease) y lo libera al
+        terminar o si el cliente se desconecta a mitad. Si el cuerpo nunca se itera, el
+        generador no llega a su finally: la respuesta debe llamar también a lease.release().
+        Cada paso corre en un contexto con el negocio, porque el servidor avanza el
+        generador desde hilos distintos.
+        """
+        context = copy_context()
+        context.run(current_business.set, lease.business_id)
+        try:
+            while True:
+                try:
+                    item = context.run(next, iterator)
+                except StopIteration:
+                    return
+                yield item
+        finally:
+            iterator.close()
+            lease.release()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'en_ejecucion': self._running,
+                'en_cola': self._waiting,
+                'max_simultaneas': self.max_concurrent,
+                'max_por_negocio': self.max_per_business,
+                'duracion_media_segundos': round(self._avg_seconds, 2),
+                **self._stats
+            }
+
+
+class TokenBucket:
+    """Token bucket clásico: `rate` tokens por segundo hasta `burst` acumulados"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self, now: float) -> bool:
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def refund(self):
+        self._tokens = min(self.burst, self._tokens + 1)
+
+    def seconds_until_token(self, now: float) -> float:
+        self._refill(now)
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+
+class LLMRateLimiter:
+    """
+    Cupo de llamadas a la IA: un bucket global (cuota del proveedor) y uno por negocio
+    (ningún negocio agota la cuota de los demás). Sin cupo, el análisis usa el modo básico.
+    """
+
+    MAX_TRACKED_BUSINESSES = 10000
+
+    def __init__(self, per_minute: float, burst: float, per_business_per_minute: float, business_burst: float):
+        self._lock = threading.Lock()
+        self._global = TokenBucket(per_minute / 60, burst)
+        self._business_rate = per_business_per_minute / 60
+        self._business_burst = business_burst
+        self._buckets = OrderedDict()
+        self._stats = Counter()
+
+    def _business_bucket(self, business_id) -> TokenBucket:
+        bucket = self._buckets.get(business_id)
+        if bucket is None:
+            bucket = self._buckets[business_id] = TokenBucket(self._business_rate, self._business_burst)
+            if len(self._buckets) > self.MAX_TRACKED_BUSINESSES:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(business_id)
+        return bucket
+
+    def _try_acquire(self, business_id) -> float:
+        """0 si se concedió la llamada; si no, segundos hasta que haya cupo"""
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._business_bucket(business_id) if business_id is not None else None
+            if bucket is not None and not bucket.try_take(now):
+                self._stats['rechazadas_negocio'] += 1
+                return bucket.seconds_until_token(now)
+            if not self._global.try_take(now):
+                if bucket is not None:
+                    bucket.refund()
+                self._stats['rechazadas_global'] += 1
+                return self._global.seconds_until_token(now)
+            self._stats['concedidas'] += 1
+            return 0.0
+
+    def acquire(self, business_id=None, wait: float = 0) -> bool:
+        """
+        Consume un token del negocio (si hay uno en contexto) y del bucket global.
+        Con `wait` > 0 (procesos por lote) espera hasta ese plazo a que haya cupo.
+        """
+        deadline = time.monotonic() + wait
+        while True:
+            delay = self._try_acquire(business_id)
+            if delay == 0:
+                return True
+            if time.monotonic() + delay > deadline:
+                return False
+            time.sleep(delay)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'negocios_con_cupo': len(self._buckets), **self._stats}
+
+
+ADMISSION = {
+    'analysis': AdmissionController(
+        ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_PER_BUSINESS, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT_SECONDS
+    ),
+    'reports': AdmissionController(
+        ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_PER_BUSINESS, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT_SECONDS
+    )
+}
+
+LLM_LIMITER = LLMRateLimiter(LLM_CALLS_PER_MINUTE, LLM_BURST, LLM_CALLS_PER_BUSINESS_PER_MINUTE, LLM_BUSINESS_BURST)
+
+
+def admission_stats() -> dict:
+    return {
+        **{name: controller.stats() for name, controller in ADMISSION.items()},
+        'ia': LLM_LIMITER.stats()
+    }
@@ -4,10 +4,42 @@ Genera insights y recomendaciones para el negocio
 """
 import os
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from typing import Optional
 import pandas as pd
-from config import DIGITALOCEAN_API_KEY, DIGITALOCEAN_MODEL, OPENAI_API_KEY
+from config import (
+    DIGITALOCEAN_API_KEY,
+    DIGITALOCEAN_MODEL,
+    OPENAI_API_KEY,
+    AI_BATCH_SIZE,
+    AI_BATCH_CONCURRENCY,
+    AI_BATCH_MAX_TOKENS,
+    PROMPT_MAX_MONTHS,
+    PROMPT_MAX_TOKENS,
+    AI_JSON_MODE,
+    AI_TIMEOUT_SECONDS,
+    AI_DEADLINE_SECONDS,
+    AI_MAX_RETRIES,
+    AI_RETRY_BASE_DELAY,
+    AI_BREAKER_FAILURES,
+    AI_BREAKER_RESET_SECONDS
+)
+from prompt_serializer import (
+    build_bounded_prompt,
+    compact_json,
+    estimate_tokens,
+    monthly_series,
+    strip_indentation,
+    table_to_csv
+)
+from resilience import CircuitBreaker, call_with_retry, is_transient_error
+from admission import LLM_LIMITER, current_business, llm_quota_wait
+from response_parser import extract_json, partial_list_items
+from forecast import forecast_sales, monthly_totals
+from tax_calendar import build_calendar
 
 
 def get_ai_client():
@@ -18,7 +50,9 @@ def get_ai_client():
         # DigitalOcean GenAI usa endpoint compatible con OpenAI
         client = OpenAI(
             api_key=DIGITALOCEAN_API_KEY,
-            base_url="https://cloud.digitalocean.com/gen-ai"
+            base_url="https://cloud.digitalocean.com/gen-ai",
+            timeout=AI_TIMEOUT_SECONDS,
+            max_retries=0
         )
         return {
             'type': 'digitalocean',
@@ -31,73 +65,226 @@ def get_ai_client():
         from openai import OpenAI
         return {
             'type': 'openai',
-            'client': OpenAI(api_key=OPENAI_API_KEY),
+            'client': OpenAI(api_key=OPENAI_API_KEY, timeout=AI_TIMEOUT_SECONDS, max_retries=0),
             'model': 'gpt-3.5-turbo'
         }
     
     return None
 
 
-def chat_completion(ai_config: dict, messages: list, max_tokens: int = 1000) -> str:
-    """Realiza una llamada de chat completion independiente del proveedor"""
+class AIUnavailableError(Exception):
+    """El proveedor de IA falló o el circuito está abierto"""
+
+
+# Circuit breaker compartido por todas las llamadas al proveedor de IA
+AI_BREAKER = CircuitBreaker(failure_threshold=AI_BREAKER_FAILURES, reset_timeout=AI_BREAKER_RESET_SECONDS)
+
+# Métricas de llamadas pagadas vs. respuestas utilizables
+AI_STATS = {'llamadas': 0, 'respuestas_utiles': 0, 'respuestas_invalidas': 0}
+_stats_lock = threading.Lock()
+
+# Proveedores que rechazaron response_format (se recuerda para no repetir el intento)
+_json_mode_unsupported = set()
+
+
+def _record_stat(key: str):
+    with _stats_lock:
+        AI_STATS[key] += 1
+
+
+def _completion_kwargs(ai_config: dict, messages: list, max_tokens: int, json_mode: bool) -> dict:
+    kwargs = {
+        'model': ai_config['model'],
+        'messages': messages,
+        'max_tokens': max_tokens,
+        'temperature': 0.7
+    }
+    if json_mode and AI_JSON_MODE and ai_config['type'] not in _json_mode_unsupported:
+        kwargs['response_format'] = {'type': 'json_object'}
+    return kwargs
+
+
+def _rejects_json_mode(error: Exception) -> bool:
+    """Si el 400 del proveedor es por el modo JSON (y no por el largo del contexto u otro parámetro)"""
+    if getattr(error, 'status_code', None) != 400:
+        return False
+    detail = f"{error} {getattr(error, 'body', '') or ''}".lower()
+    return any(marker in detail for marker in ('response_format', 'json_object', 'json mode', 'json_mode'))
+
+
+def _create_completion(ai_config: dict, kwargs: dict):
+    """Crea la completion; si el proveedor no acepta el modo JSON, lo desactiva y usa texto libre"""
+    try:
+        return ai_config['client'].chat.completions.create(**kwargs)
+    except Exception as e:
+        if 'response_format' not in kwargs or not _rejects_json_mode(e):
+            raise
+        print(f"Modo JSON no soportado por {ai_config['type']}, usando texto libre: {e}")
+        _json_mode_unsupported.add(ai_config['type'])
+        kwargs = {k: v for k, v in kwargs.items() if k != 'response_format'}
+        return ai_config['client'].chat.completions.create(**kwargs)
+
+
+def _resilient_completion(ai_config: dict, kwargs: dict, quota_wait: float = 0):
+    """
+    Llamada al proveedor con plazo máximo, reintentos con backoff para errores
+    transitorios y circuit breaker. Solo los transitorios cuentan como fallo del circuito;
+    los permanentes se propagan tal cual. Si el circuito está abierto falla al instante, sin
+    consumir cupo. Si no, consume cupo del token bucket (global y del negocio en curso); sin
+    cupo falla igual que con el circuito abierto, salvo que `quota_wait` (o llm_quota_wait) permita esperar.
+    """
+    if not AI_BREAKER.allow():
+        raise AIUnavailableError("Servicio de IA no disponible (circuito abierto)")
+    if not LLM_LIMITER.acquire(current_business.get(), wait=max(quota_wait, llm_quota_wait.get())):
+        AI_BREAKER.release()
+        raise AIUnavailableError("Límite de llamadas a la IA alcanzado")
+    
+    def attempt(timeout: float):
+        _record_stat('llamadas')
+        return _create_completion(ai_config, {**kwargs, 'timeout': timeout})
+    
     try:
-        response = ai_config['client'].chat.completions.create(
-            model=ai_config['model'],
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=0.7
+        response = call_with_retry(
+            attempt,
+            deadline=AI_DEADLINE_SECONDS,
+            max_retries=AI_MAX_RETRIES,
+            attempt_timeout=AI_TIMEOUT_SECONDS,
+            base_delay=AI_RETRY_BASE_DELAY
         )
-        return response.choices[0].message.content
     except Exception as e:
-        print(f"Error en chat completion: {e}")
-        return ""
+        if not is_transient_error(e):
+            # Error de esta petición (contexto, parámetros, credenciales): no abre el circuito
+            AI_BREAKER.release()
+            raise
+        AI_BREAKER.record_failure()
+        raise AIUnavailableError(f"Error del proveedor de IA: {e}") from e
+    AI_BREAKER.record_success()
+    return response
 
 
-def analyze_sales_trends(sales_data: pd.DataFrame, business_name: str) -> dict:
+def chat_completion(ai_config: dict, messages: list, max_tokens: int = 1000, json_mode: bool = False,
+                    quota_wait: float = 0) -> str:
     """
-    Analiza tendencias de ventas y genera insights con IA
+    Realiza una llamada de chat completion independiente del proveedor.
+    Lanza AIUnavailableError si el proveedor falla, el circuito está abierto o no hay cupo.
     """
-    ai_config = get_ai_client()
+    response = _resilient_completion(
+        ai_config, _completion_kwargs(ai_config, messages, max_tokens, json_mode), quota_wait
+    )
+    return response.choices[0].message.content or ""
+
+
+def stream_chat_completion(ai_config: dict, messages: list, max_tokens: int = 1000, json_mode: bool = False):
+    """Igual que chat_completion pero genera los fragmentos de texto a medida que llegan"""
+    kwargs = _completion_kwargs(ai_config, messages, max_tokens, json_mode)
+    stream = _resilient_completion(ai_config, {**kwargs, 'stream': True})
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        if not is_transient_error(e):
+            # Error de esta petición (contexto, parámetros, credenciales): no abre el circuito
+            AI_BREAKER.release()
+            raise
+        AI_BREAKER.record_failure()
+        raise AIUnavailableError(f"Error del proveedor de IA: {e}") from e
+
+
+def parse_ai_response(text: str) -> dict:
+    """Extrae el JSON de la respuesta registrando si la llamada produjo un resultado utilizable"""
+    try:
+        data = extract_json(text)
+    except ValueError:
+        _record_stat('respuestas_invalidas')
+        raise
+    _record_stat('respuestas_utiles')
+    return data
+
+
+def build_sales_summary(sales_data: pd.DataFrame, forecast: dict = None) -> dict:
+    """
+    Calcula las métricas principales a partir del resumen mensual.
+    La tendencia y la proyección salen del pronóstico estadístico sobre los totales
+    mensuales (`forecast` si ya se calculó en lote, si no se calcula aquí).
+    """
+    monthly = monthly_totals(sales_data)
+    if forecast is None and not sales_data.empty:
+        forecast = forecast_sales({0: sales_data}).get(0)
     
-    # Preparar datos para el análisis
     summary = {
         'total_ventas': float(sales_data['total'].sum()) if not sales_data.empty else 0,
-        'promedio_mensual': float(sales_data['total'].mean()) if not sales_data.empty else 0,
+        'promedio_mensual': float(monthly.mean()) if not monthly.empty else 0,
         'total_documentos': int(sales_data['cantidad_documentos'].sum()) if not sales_data.empty else 0,
         'igv_total': float(sales_data['igv'].sum()) if not sales_data.empty else 0,
     }
     
-    # Calcular tendencia
-    if len(sales_data) >= 2:
-        recent = sales_data.head(3)['total'].mean()
-        older = sales_data.tail(3)['total'].mean()
-        if older > 0:
-            trend_pct = ((recent - older) / older) * 100
-            summary['tendencia'] = f"{'+' if trend_pct > 0 else ''}{trend_pct:.1f}%"
-        else:
-            summary['tendencia'] = "N/A"
-    else:
+    # Tendencia: últimos 3 meses completos frente a los 3 anteriores
+    if forecast is None or forecast['meses_historia'] < 6:
         summary['tendencia'] = "Datos insuficientes"
+    elif forecast['tendencia_pct'] is None:
+        summary['tendencia'] = "N/A"
+    else:
+        trend_pct = forecast['tendencia_pct']
+        summary['tendencia'] = f"{'+' if trend_pct > 0 else ''}{trend_pct:.1f}%"
     
-    # Si no hay API key, retornar análisis básico
-    if not ai_config:
-        return {
-            'resumen': summary,
-            'insights': [
-                "⚠️ Configura tu API key de DigitalOcean GenAI para obtener análisis avanzados con IA",
-                f"📊 Total de ventas: S/ {summary['total_ventas']:,.2f}",
-                f"📈 Promedio mensual: S/ {summary['promedio_mensual']:,.2f}",
-                f"📄 Total documentos emitidos: {summary['total_documentos']}"
-            ],
-            'recomendaciones': [
-                "Configura DIGITALOCEAN_API_KEY en el archivo .env para obtener recomendaciones personalizadas"
-            ],
-            'ai_powered': False
-        }
-    
-    # Análisis con IA
-    try:
-        prompt = f"""
+    summary['proyeccion_trimestre'] = forecast['total_trimestre'] if forecast else None
+    summary['pronostico'] = forecast
+    return summary
+
+
+def forecast_text(summary: dict) -> str:
+    """Proyección del próximo trimestre en texto, a partir del pronóstico local"""
+    forecast = summary.get('pronostico')
+    if not forecast:
+        return "Sin historia suficiente para proyectar"
+    months = ', '.join(f"{m['periodo']}: S/ {m['total']:,.2f}" for m in forecast['meses'])
+    method = 'estacional' if forecast['metodo'] == 'estacional' else 'suavizado exponencial'
+    return f"S/ {forecast['total_trimestre']:,.2f} en el próximo trimestre ({months}; método {method})"
+
+
+AI_UNAVAILABLE_NOTICE = "⚠️ El servicio de IA no está disponible en este momento, mostrando análisis básico"
+
+
+def basic_sales_analysis(summary: dict, notice: str = None, alerts: list = None) -> dict:
+    """Análisis básico sin IA a partir de las métricas calculadas y las alertas locales"""
+    return {
+        'resumen': summary,
+        'insights': [
+            notice or "⚠️ Configura tu API key de DigitalOcean GenAI para obtener análisis avanzados con IA",
+            f"📊 Total de ventas: S/ {summary['total_ventas']:,.2f}",
+            f"📈 Promedio mensual: S/ {summary['promedio_mensual']:,.2f}",
+            f"📄 Total documentos emitidos: {summary['total_documentos']}",
+            f"🔮 Proyección: {forecast_text(summary)}"
+        ],
+        'recomendaciones': [
+            "Configura DIGITALOCEAN_API_KEY en el archivo .env para obtener recomendaciones personalizadas"
+        ] if notice is None else [],
+        'alertas_sunat': list(alerts or []),
+        'proyeccion': forecast_text(summary),
+        'ai_powered': False
+    }
+
+
+# Caracteres del nombre del negocio que van al prompt
+PROMPT_MAX_NAME_CHARS = 120
+
+
+def _alerts_text(alerts: list, total: int) -> str:
+    """Alertas del prompt; las que no entraron en el presupuesto de tokens se cuentan al final"""
+    if not total:
+        return '- Ninguna'
+    lines = [f"- {alert}" for alert in alerts]
+    if total > len(alerts):
+        lines.append(f"- ({total - len(alerts)} alertas más omitidas por espacio)")
+    return '\n'.join(lines)
+
+
+def _build_sales_prompt(summary: dict, sales_data: pd.DataFrame, business_name: str, alerts: list = None) -> str:
+    alerts = list(alerts or [])
+    business_name = (business_name or '')[:PROMPT_MAX_NAME_CHARS]
+    return build_bounded_prompt(
+        lambda months, kept_alerts: f"""
         Eres un contador y asesor financiero experto para MYPES peruanas. 
         Analiza los siguientes datos de ventas del negocio "{business_name}" y proporciona:
         
@@ -107,16 +294,20 @@ def analyze_sales_trends(sales_data: pd.DataFrame, business_name: str) -> dict:
         - Total documentos: {summary['total_documentos']}
         - IGV acumulado: S/ {summary['igv_total']:,.2f}
         - Tendencia: {summary['tendencia']}
+        - Pronóstico estadístico: {forecast_text(summary)}
+        
+        DATOS MENSUALES (JSON columnar, S/):
+        {compact_json(monthly_series(sales_data, months)) if not sales_data.empty else 'Sin datos'}
         
-        DATOS MENSUALES:
-        {sales_data.to_string() if not sales_data.empty else 'Sin datos'}
+        ALERTAS DETECTADAS (correlativos y controles locales):
+        {_alerts_text(kept_alerts, len(alerts))}
         
         Proporciona tu respuesta en el siguiente formato JSON:
         {{
             "insights": ["insight1", "insight2", "insight3"],
             "recomendaciones": ["recomendacion1", "recomendacion2", "recomendacion3"],
             "alertas_sunat": ["alerta1 si aplica"],
-            "proyeccion_trimestre": "texto de proyección"
+            "proyeccion_trimestre": "comentario sobre el pronóstico estadístico del próximo trimestre"
         }}
         
         Considera:
@@ -124,62 +315,283 @@ def analyze_sales_trends(sales_data: pd.DataFrame, business_name: str) -> dict:
         - Oportunidades de ahorro fiscal
         - Patrones estacionales
         - Recomendaciones prácticas para mejorar flujo de caja
-        """
-        
-        messages = [{"role": "user", "content": prompt}]
-        ai_response_text = chat_completion(ai_config, messages, max_tokens=1000)
-        ai_response = json.loads(ai_response_text)
+        """,
+        max_months=PROMPT_MAX_MONTHS,
+        max_tokens=PROMPT_MAX_TOKENS,
+        items=alerts
+    )
+
+
+def _ai_sales_analysis(summary: dict, ai_response: dict, alerts: list = None) -> dict:
+    return {
+        'resumen': summary,
+        'insights': ai_response.get('insights', []),
+        'recomendaciones': ai_response.get('recomendaciones', []),
+        'alertas_sunat': list(alerts or []) + ai_response.get('alertas_sunat', []),
+        'proyeccion': ai_response.get('proyeccion_trimestre') or forecast_text(summary),
+        'ai_powered': True
+    }
+
+
+def analyze_sales_trends(sales_data: pd.DataFrame, business_name: str, alerts: list = None) -> dict:
+    """
+    Analiza tendencias de ventas y genera insights con IA.
+    `alerts`: alertas calculadas localmente (integridad de correlativos, anomalías de ventas)
+    que se pasan a la IA y se incluyen en 'alertas_sunat'.
+    """
+    ai_config = get_ai_client()
+    
+    # Preparar datos para el análisis
+    summary = build_sales_summary(sales_data)
+    
+    # Si no hay API key, retornar análisis básico
+    if not ai_config:
+        return basic_sales_analysis(summary, alerts=alerts)
+    if AI_BREAKER.is_open:
+        return basic_sales_analysis(summary, AI_UNAVAILABLE_NOTICE, alerts)
+    
+    # Análisis con IA
+    try:
+        messages = [{"role": "user", "content": _build_sales_prompt(summary, sales_data, business_name, alerts)}]
+        ai_response_text = chat_completion(ai_config, messages, max_tokens=1000, json_mode=True)
+        return _ai_sales_analysis(summary, parse_ai_response(ai_response_text), alerts)
         
+    except AIUnavailableError as e:
+        print(e)
+        return basic_sales_analysis(summary, AI_UNAVAILABLE_NOTICE, alerts)
+    except Exception as e:
         return {
             'resumen': summary,
-            'insights': ai_response.get('insights', []),
-            'recomendaciones': ai_response.get('recomendaciones', []),
-            'alertas_sunat': ai_response.get('alertas_sunat', []),
-            'proyeccion': ai_response.get('proyeccion_trimestre', ''),
-            'ai_powered': True
+            'insights': [f"Error en análisis AI: {str(e)}"],
+            'recomendaciones': [],
+            'alertas_sunat': list(alerts or []),
+            'proyeccion': forecast_text(summary),
+            'ai_powered': False
         }
-        
+
+
+def stream_sales_analysis(sales_data: pd.DataFrame, business_name: str, alerts: list = None):
+    """
+    Versión streaming de analyze_sales_trends. Genera eventos (tipo, datos):
+    'resumen' de inmediato, cada 'insight' en cuanto llega completo y
+    finalmente 'resultado' con el análisis completo.
+    """
+    ai_config = get_ai_client()
+    summary = build_sales_summary(sales_data)
+    yield 'resumen', summary
+    
+    if not ai_config:
+        yield 'resultado', basic_sales_analysis(summary, alerts=alerts)
+        return
+    if AI_BREAKER.is_open:
+        yield 'resultado', basic_sales_analysis(summary, AI_UNAVAILABLE_NOTICE, alerts)
+        return
+    
+    try:
+        messages = [{"role": "user", "content": _build_sales_prompt(summary, sales_data, business_name, alerts)}]
+        buffer = ''
+        sent = 0
+        for delta in stream_chat_completion(ai_config, messages, max_tokens=1000, json_mode=True):
+            buffer += delta
+            insights = partial_list_items(buffer, 'insights')
+            for insight in insights[sent:]:
+                yield 'insight', insight
+            sent = len(insights)
+        yield 'resultado', _ai_sales_analysis(summary, parse_ai_response(buffer), alerts)
+    except AIUnavailableError as e:
+        print(e)
+        yield 'resultado', basic_sales_analysis(summary, AI_UNAVAILABLE_NOTICE, alerts)
     except Exception as e:
-        return {
+        yield 'resultado', {
             'resumen': summary,
             'insights': [f"Error en análisis AI: {str(e)}"],
             'recomendaciones': [],
+            'alertas_sunat': list(alerts or []),
+            'proyeccion': forecast_text(summary),
             'ai_powered': False
         }
 
 
-def analyze_clients(clients_data: pd.DataFrame, top_clients: pd.DataFrame) -> dict:
-    """Analiza la base de clientes"""
+def _batch_entry(item: dict) -> str:
+    """
+    JSON de un negocio para el prompt por lotes, acotado a PROMPT_MAX_TOKENS igual que el
+    prompt individual: se recortan los meses y luego las alertas (se informa cuántas faltan)
+    """
+    alerts = list(item.get('alerts') or [])
+    base = {
+        'id': item['business_id'],
+        'nombre': (item['business_name'] or '')[:PROMPT_MAX_NAME_CHARS],
+        **{k: (round(v, 2) if isinstance(v, float) else v) for k, v in item['summary'].items() if k != 'pronostico'}
+    }
+
+    def render(months: int, kept_alerts: list) -> str:
+        entry = {**base, 'meses': monthly_series(item['sales_data'], months)}
+        if kept_alerts:
+            entry['alertas'] = kept_alerts
+        if len(kept_alerts) < len(alerts):
+            entry['alertas_omitidas'] = len(alerts) - len(kept_alerts)
+        return compact_json(entry)
+
+    return build_bounded_prompt(render, PROMPT_MAX_MONTHS, PROMPT_MAX_TOKENS, items=alerts)
+
+
+def _token_chunks(items: list, entries: list, batch_size: int, max_tokens: int) -> list:
+    """
+    Agrupa los negocios en lotes de hasta `batch_size` negocios y `max_tokens` tokens
+    estimados de datos; un negocio que solo ya excede el límite va en su propio lote
+    """
+    chunks = []
+    current, current_entries, tokens = [], [], 0
+    for item, entry in zip(items, entries):
+        entry_tokens = estimate_tokens(entry)
+        if current and (len(current) >= batch_size or tokens + entry_tokens > max_tokens):
+            chunks.append((current, current_entries))
+            current, current_entries, tokens = [], [], 0
+        current.append(item)
+        current_entries.append(entry)
+        tokens += entry_tokens
+    if current:
+        chunks.append((current, current_entries))
+    return chunks
+
+
+def _analyze_sales_chunk(ai_config: dict, chunk: list, entries: list) -> dict:
+    """Analiza un grupo de negocios en una sola llamada y retorna {business_id: respuesta}"""
+    prompt = strip_indentation(f"""
+    Eres un contador y asesor financiero experto para MYPES peruanas.
+    Analiza las ventas de cada negocio (montos en S/, "meses" en JSON columnar,
+    "proyeccion_trimestre" es el pronóstico estadístico de los próximos 3 meses,
+    "alertas" son anomalías detectadas localmente que debes considerar y
+    "alertas_omitidas" cuántas más hubo que no entraron por espacio):
+    [{','.join(entries)}]
+    
+    Responde SOLO con JSON, un elemento por negocio:
+    {{"negocios": [{{"id": 1, "insights": ["..."], "recomendaciones": ["..."], "alertas_sunat": ["..."], "proyeccion_trimestre": "..."}}]}}
+    
+    Considera obligaciones SUNAT, ahorro fiscal, estacionalidad y flujo de caja.
+    """)
+    messages = [{"role": "user", "content": prompt}]
+    # Los lotes no tienen a nadie esperando la respuesta: aguardan cupo en vez de caer al modo básico
+    ai_response_text = chat_completion(
+        ai_config, messages, max_tokens=350 * len(chunk), json_mode=True, quota_wait=AI_DEADLINE_SECONDS
+    )
+    ai_response = parse_ai_response(ai_response_text)
+    return {str(item.get('id')): item for item in ai_response.get('negocios', []) if isinstance(item, dict)}
+
+
+def analyze_sales_batch(businesses: list, batch_size: int = AI_BATCH_SIZE,
+                        max_workers: int = AI_BATCH_CONCURRENCY) -> dict:
+    """
+    Analiza las ventas de varios negocios agrupándolos en pocas llamadas a la IA.
+    `businesses` es una lista de dicts con business_id, business_name, sales_data y
+    opcionalmente alerts (alertas locales que se pasan a la IA y se suman a alertas_sunat).
+    Si un grupo o un negocio falla, ese negocio recibe el análisis básico.
+    """
+    started = time.monotonic()
     ai_config = get_ai_client()
+    forecasts = forecast_sales({b['business_id']: b['sales_data'] for b in businesses})
+    items = [
+        {**b, 'summary': build_sales_summary(b['sales_data'], forecasts.get(b['business_id']))}
+        for b in businesses
+    ]
+    results = {}
+    requests_made = 0
     
-    analysis = {
-        'total_clientes': len(clients_data),
-        'clientes_con_ruc': len(clients_data[clients_data['tipo_documento'] == 'RUC']) if not clients_data.empty else 0,
-        'clientes_persona': len(clients_data[clients_data['tipo_documento'] == 'DNI']) if not clients_data.empty else 0,
+    if ai_config and items:
+        chunks = _token_chunks(items, [_batch_entry(item) for item in items], max(1, batch_size), AI_BATCH_MAX_TOKENS)
+        requests_made = len(chunks)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {
+                executor.submit(_analyze_sales_chunk, ai_config, chunk, entries): chunk for chunk, entries in chunks
+            }
+            for future in as_completed(futures):
+                try:
+                    responses = future.result()
+                except Exception as e:
+                    print(f"Error en análisis por lote: {e}")
+                    continue
+                for item in futures[future]:
+                    ai_response = responses.get(str(item['business_id']))
+                    if ai_response is None:
+                        continue
+                    results[item['business_id']] = {
+                        'resumen': item['summary'],
+                        'insights': ai_response.get('insights', []),
+                        'recomendaciones': ai_response.get('recomendaciones', []),
+                        'alertas_sunat': list(item.get('alerts') or []) + ai_response.get('alertas_sunat', []),
+                        'proyeccion': ai_response.get('proyeccion_trimestre') or forecast_text(item['summary']),
+                        'ai_powered': True
+                    }
+    
+    notice = AI_UNAVAILABLE_NOTICE if ai_config else None
+    results = {
+        item['business_id']: (
+            results.get(item['business_id']) or basic_sales_analysis(item['summary'], notice, item.get('alerts'))
+        )
+        for item in items
     }
     
-    if not ai_config or top_clients.empty:
-        return {
-            'resumen': analysis,
-            'insights': [
-                f"👥 Total de clientes: {analysis['total_clientes']}",
-                f"🏢 Empresas (RUC): {analysis['clientes_con_ruc']}",
-                f"👤 Personas (DNI): {analysis['clientes_persona']}"
-            ],
-            'ai_powered': False
+    elapsed = time.monotonic() - started
+    ai_ok = sum(1 for r in results.values() if r['ai_powered'])
+    return {
+        'results': results,
+        'stats': {
+            'negocios': len(items),
+            'con_ia': ai_ok,
+            'sin_ia': len(items) - ai_ok,
+            'llamadas_ia': requests_made,
+            'segundos': round(elapsed, 2),
+            'negocios_por_minuto': round(len(items) / elapsed * 60, 1) if elapsed > 0 else None
         }
+    }
+
+
+def analyze_clients(client_counts: dict, segments: pd.DataFrame) -> dict:
+    """
+    Analiza la base de clientes a partir de los conteos (SQL) y del
+    resumen de segmentos RFM; la IA recibe solo el resumen por segmento
+    """
+    ai_config = get_ai_client()
+    
+    analysis = {
+        **client_counts,
+        'clientes_con_compras': int(segments['clientes'].sum()) if not segments.empty else 0,
+        'segmentos': segments.to_dict('records')
+    }
+    
+    insights = [
+        f"👥 Total de clientes: {analysis['total_clientes']}",
+        f"🏢 Empresas (RUC): {analysis['clientes_con_ruc']}",
+        f"👤 Personas (DNI): {analysis['clientes_persona']}"
+    ]
+    by_segment = segments.set_index('segmento') if not segments.empty else None
+    for segment, label in (('Campeones', "🏆 Campeones"), ('En riesgo', "⚠️ En riesgo"),
+                           ('No se pueden perder', "🚨 No se pueden perder")):
+        if by_segment is not None and segment in by_segment.index:
+            row = by_segment.loc[segment]
+            insights.append(f"{label}: {int(row['clientes'])} clientes, {row['participacion']}% de las ventas")
+    
+    basic = {
+        'resumen': analysis,
+        'insights': insights,
+        'ai_powered': False
+    }
+    
+    if not ai_config or segments.empty or AI_BREAKER.is_open:
+        return basic
     
     try:
-        prompt = f"""
+        prompt = strip_indentation(f"""
         Analiza esta base de clientes de una MYPE peruana:
         
         RESUMEN:
         - Total clientes: {analysis['total_clientes']}
         - Empresas (RUC): {analysis['clientes_con_ruc']}
         - Personas naturales: {analysis['clientes_persona']}
+        - Clientes con compras: {analysis['clientes_con_compras']}
         
-        TOP CLIENTES:
-        {top_clients.to_string()}
+        SEGMENTOS RFM (CSV; monto en S/, participacion en % de ventas, recencia en días):
+        {table_to_csv(segments)}
         
         Proporciona en JSON:
         {{
@@ -187,11 +599,11 @@ def analyze_clients(clients_data: pd.DataFrame, top_clients: pd.DataFrame) -> di
             "estrategias_retencion": ["2 estrategias"],
             "oportunidades": ["2 oportunidades de crecimiento"]
         }}
-        """
+        """)
         
         messages = [{"role": "user", "content": prompt}]
-        ai_response_text = chat_completion(ai_config, messages, max_tokens=500)
-        ai_response = json.loads(ai_response_text)
+        ai_response_text = chat_completion(ai_config, messages, max_tokens=500, json_mode=True)
+        ai_response = parse_ai_response(ai_response_text)
         
         return {
             'resumen': analysis,
@@ -199,6 +611,9 @@ def analyze_clients(clients_data: pd.DataFrame, top_clients: pd.DataFrame) -> di
             'ai_powered': True
         }
         
+    except AIUnavailableError as e:
+        print(e)
+        return basic
     except Exception as e:
         return {
             'resumen': analysis,
@@ -207,33 +622,12 @@ def analyze_clients(clients_data: pd.DataFrame, top_clients: pd.DataFrame) -> di
         }
 
 
-def generate_tax_calendar(current_date: datetime = None) -> list:
+def generate_tax_calendar(current_date: datetime = None, ruc: str = None) -> list:
     """
     Genera recordatorios de obligaciones tributarias SUNAT
+    según el cronograma del último dígito de RUC
     """
-    if current_date is None:
-        current_date = datetime.now()
-    
-    # Fechas de vencimiento según último dígito de RUC (ejemplo simplificado)
-    calendar = [
-        {
-            'fecha': f"Hasta el 12-{current_date.month:02d}-{current_date.year}",
-            'obligacion': 'Declaración mensual PDT 621 (IGV-Renta)',
-            'descripcion': 'Declaración y pago de IGV y pago a cuenta del Impuesto a la Renta'
-        },
-        {
-            'fecha': f"Hasta el 15-{current_date.month:02d}-{current_date.year}",
-            'obligacion': 'Libros Electrónicos',
-            'descripcion': 'Envío de Registro de Ventas y Compras electrónico'
-        },
-        {
-            'fecha': 'Continuo',
-            'obligacion': 'Emisión de Comprobantes',
-            'descripcion': 'Emitir boletas/facturas electrónicas por cada venta'
-        }
-    ]
-    
-    return calendar
+    return build_calendar(ruc=ruc, current_date=current_date)
 
 
 def get_sunat_tips() -> list:
@@ -0,0 +1,151 @@
+"""
+Detección local de anomalías en las ventas diarias
+Picos y caídas (z-score sobre ventanas móviles), tasa de anulación inusual y boletas
+que superan el monto de identificación obligatoria; vectorizado sobre varios negocios a la vez
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    ANOMALY_HISTORY_DAYS,
+    ANOMALY_WINDOW_DAYS,
+    ANOMALY_RECENT_DAYS,
+    ANOMALY_Z_THRESHOLD,
+    ANNULMENT_RATE_THRESHOLD,
+    BOLETA_IDENTIFICATION_THRESHOLD
+)
+from database import get_daily_totals
+
+
+MIN_ANNULLED = 3  # anulaciones mínimas en el período reciente para alertar
+
+
+def history_start(today: datetime = None) -> str:
+    """Primer día (YYYY-MM-DD) que se lee para la detección"""
+    return ((today or datetime.now()) - timedelta(days=ANOMALY_HISTORY_DAYS)).strftime('%Y-%m-%d')
+
+
+def daily_matrices(daily: pd.DataFrame, today: datetime = None) -> tuple:
+    """
+    Matrices negocios x días (desde history_start hasta hoy, días sin documentos en 0)
+    para cada columna de get_daily_totals. Retorna (ids, fechas, {columna: matriz}).
+    """
+    start = pd.Timestamp(history_start(today))
+    dates = pd.date_range(start, pd.Timestamp((today or datetime.now()).date()), freq='D')
+    columns = ['total', 'documentos', 'anulados', 'boletas_sin_identificar']
+
+    ids, rows = np.unique(daily['business_id'].to_numpy(), return_inverse=True)
+    days = (pd.to_datetime(daily['fecha'], format='%Y-%m-%d', errors='coerce') - start).dt.days.to_numpy()
+    valid = (days >= 0) & (days < len(dates))
+
+    matrices = {}
+    for column in columns:
+        matrix = np.zeros((len(ids), len(dates)))
+        matrix[rows[valid], days[valid].astype(int)] = daily[column].to_numpy(dtype=float)[valid]
+        matrices[column] = matrix
+    return [int(i) for i in ids], dates, matrices
+
+
+def rolling_stats(matrix: np.ndarray, window: int) -> tuple:
+    """
+    Media y desviación de los `window` días anteriores a cada columna (sin incluirla),
+    con sumas acumuladas: O(días) por negocio. Columnas sin ventana completa quedan en NaN.
+    """
+    padded = np.pad(matrix, ((0, 0), (1, 0)))
+    sums = np.cumsum(padded, axis=1)
+    squares = np.cumsum(padded ** 2, axis=1)
+    mean = np.full(matrix.shape, np.nan)
+    std = np.full(matrix.shape, np.nan)
+    if matrix.shape[1] > window:
+        window_sum = sums[:, window:-1] - sums[:, :-window - 1]
+        window_squares = squares[:, window:-1] - squares[:, :-window - 1]
+        mean[:, window:] = window_sum / window
+        std[:, window:] = np.sqrt(np.clip(window_squares / window - mean[:, window:] ** 2, 0, None))
+    return mean, std
+
+
+def _zscores(values: np.ndarray, mean: np.ndarray, std: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(std > 0, (values - mean) / std, 0.0)
+
+
+def detect_anomalies(daily: pd.DataFrame, today: datetime = None) -> dict:
+    """
+    Alertas por negocio a partir de los totales diarios (get_daily_totals con history_start).
+    El día en curso solo cuenta para anulaciones y boletas: sus ventas todavía están incompletas.
+    Retorna {business_id: [alertas]} solo para los negocios con alguna alerta.
+    """
+    if daily.empty:
+        return {}
+    ids, dates, m = daily_matrices(daily, today)
+    alerts = {business_id: [] for business_id in ids}
+    total = m['total'][:, :-1]
+    recent = min(ANOMALY_RECENT_DAYS, max(total.shape[1] - 1, 0))
+
+    # Picos diarios: z-score de cada día reciente frente a su ventana móvil, solo si en la
+    # ventana hubo ventas al menos la mitad de los días (en negocios esporádicos toda venta es un pico)
+    mean, std = rolling_stats(total, ANOMALY_WINDOW_DAYS)
+    active_days, _ = rolling_stats((total > 0).astype(float), ANOMALY_WINDOW_DAYS)
+    z = np.where(active_days >= 0.5, _zscores(total, mean, std), 0.0)
+    z = z[:, -recent:] if recent else np.zeros((len(ids), 0))
+    worst = z.argmax(axis=1) if recent else np.zeros(len(ids), dtype=int)
+    for row in np.flatnonzero(z.max(axis=1, initial=0) > ANOMALY_Z_THRESHOLD):
+        column = total.shape[1] - recent + worst[row]
+        alerts[ids[row]].append(
+            f"📈 Pico de ventas el {dates[column]:%Y-%m-%d}: S/ {total[row, column]:,.2f} frente a "
+            f"S/ {mean[row, column]:,.2f} diarios en promedio los {ANOMALY_WINDOW_DAYS} días previos"
+        )
+
+    # Semana reciente frente a las semanas completas anteriores (absorbe el patrón por día de la semana)
+    weeks = total.shape[1] // ANOMALY_RECENT_DAYS
+    if weeks >= 3:
+        weekly = total[:, -weeks * ANOMALY_RECENT_DAYS:].reshape(len(ids), weeks, ANOMALY_RECENT_DAYS).sum(axis=2)
+        baseline = weekly[:, :-1]
+        week_mean, week_std = baseline.mean(axis=1), baseline.std(axis=1)
+        week_z = _zscores(weekly[:, -1], week_mean, week_std)
+        active = (baseline > 0).mean(axis=1) >= 0.5
+        for row in np.flatnonzero(active & (np.abs(week_z) > ANOMALY_Z_THRESHOLD)):
+            label = "📉 Caída" if week_z[row] < 0 else "📈 Alza"
+            alerts[ids[row]].append(
+                f"{label} de ventas en los últimos {ANOMALY_RECENT_DAYS} días: S/ {weekly[row, -1]:,.2f} "
+                f"frente a S/ {week_mean[row]:,.2f} por semana en promedio"
+            )
+
+    # Tasa de anulación reciente frente a la histórica
+    annulled, documents = m['anulados'], m['documentos']
+    recent_annulled = annulled[:, -ANOMALY_RECENT_DAYS:].sum(axis=1)
+    recent_documents = documents[:, -ANOMALY_RECENT_DAYS:].sum(axis=1)
+    past_annulled = annulled[:, :-ANOMALY_RECENT_DAYS].sum(axis=1)
+    past_documents = documents[:, :-ANOMALY_RECENT_DAYS].sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.where(recent_documents > 0, recent_annulled / recent_documents, 0.0)
+        past_rate = np.where(past_documents > 0, past_annulled / past_documents, 0.0)
+    unusual = (rate >= ANNULMENT_RATE_THRESHOLD) & (recent_annulled >= MIN_ANNULLED) & (rate > 2 * past_rate)
+    for row in np.flatnonzero(unusual):
+        alerts[ids[row]].append(
+            f"🚫 Tasa de anulación de {rate[row]:.0%} en los últimos {ANOMALY_RECENT_DAYS} días "
+            f"({int(recent_annulled[row])} comprobantes; histórico {past_rate[row]:.0%})"
+        )
+
+    # Boletas sobre el monto que exige identificar al adquirente
+    unidentified = m['boletas_sin_identificar'].sum(axis=1)
+    for row in np.flatnonzero(unidentified > 0):
+        alerts[ids[row]].append(
+            f"🧾 {int(unidentified[row])} boletas mayores a S/ {BOLETA_IDENTIFICATION_THRESHOLD:,.0f} "
+            f"sin documento de identidad del cliente en los últimos {ANOMALY_HISTORY_DAYS} días"
+        )
+
+    return {business_id: items for business_id, items in alerts.items() if items}
+
+
+def business_anomaly_alerts(business_id: int, today: datetime = None) -> list:
+    """Alertas de un negocio (una consulta por rango sobre el índice de negocio y fecha)"""
+    daily = get_daily_totals(history_start(today), business_id)
+    return detect_anomalies(daily, today).get(business_id, [])
+
+
+def all_anomaly_alerts(today: datetime = None) -> dict:
+    """Alertas de todos los negocios con una sola consulta agregada: {business_id: [alertas]}"""
+    return detect_anomalies(get_daily_totals(history_start(today)), today)
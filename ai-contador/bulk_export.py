@@ -0,0 +1,99 @@
+"""
+Exportación masiva en formato columnar para herramientas de BI
+Parquet por bloques (pyarrow) o CSV comprimido con gzip si pyarrow no está instalado
+"""
+import gzip
+from datetime import datetime
+
+from config import EXPORTS_DIR
+from database import iter_export_documents, iter_export_items
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow es opcional
+    pa = pq = None
+
+
+# Tipos por columna (tipos nullable de pandas) para que todos los bloques compartan esquema
+DATASETS = {
+    'documentos': {
+        'iterator': iter_export_documents,
+        'dtypes': {
+            'id': 'Int64', 'business_id': 'Int64', 'client_id': 'Int64',
+            'tipo': 'string', 'serie': 'string', 'numero': 'Int64',
+            'fecha_emision': 'string', 'fecha_vencimiento': 'string', 'moneda': 'string',
+            'subtotal': 'float64', 'igv': 'float64', 'total': 'float64', 'tipo_cambio': 'float64',
+            'estado': 'string', 'created_at': 'string',
+            'cliente_tipo_doc': 'string', 'cliente_documento': 'string', 'cliente_nombre': 'string'
+        }
+    },
+    'items': {
+        'iterator': iter_export_items,
+        'dtypes': {
+            'id': 'Int64', 'document_id': 'Int64', 'product_id': 'Int64',
+            'fecha_emision': 'string', 'cantidad': 'float64', 'unidad_medida': 'string',
+            'descripcion': 'string', 'precio_unitario': 'float64', 'valor_venta': 'float64',
+            'igv': 'float64', 'total': 'float64', 'producto_codigo': 'string'
+        }
+    }
+}
+
+EXPORT_MEDIA_TYPES = {
+    '.parquet': 'application/vnd.apache.parquet',
+    '.gz': 'application/gzip'
+}
+
+
+def export_format() -> str:
+    """Formato disponible: parquet si pyarrow está instalado, csv.gz si no"""
+    return 'parquet' if pq is not None else 'csv.gz'
+
+
+def _write_parquet(frames, path, dtypes: dict) -> int:
+    schema = pa.schema([
+        (column, pa.int64() if dtype == 'Int64' else pa.float64() if dtype == 'float64' else pa.string())
+        for column, dtype in dtypes.items()
+    ])
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        for df in frames:
+            table = pa.Table.from_pandas(df.astype(dtypes), schema=schema, preserve_index=False)
+            writer.write_table(table)
+            rows += len(df)
+    return rows
+
+
+def _write_csv_gz(frames, path, dtypes: dict) -> int:
+    rows = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+        for df in frames:
+            df.to_csv(f, header=rows == 0, index=False)
+            rows += len(df)
+        if rows == 0:
+            f.write(','.join(dtypes) + '\n')
+    return rows
+
+
+def export_business_data(business_id: int, start_date: str = None, end_date: str = None,
+                         chunk_size: int = 50000) -> dict:
+    """
+    Exporta documentos e items del negocio (rango de fechas opcional) leyendo
+    y escribiendo por bloques de `chunk_size` filas.
+    Retorna {dataset: {'filename', 'rows'}} y el formato usado.
+    """
+    fmt = export_format()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    files = {}
+
+    for name, spec in DATASETS.items():
+        filename = f"{name}_{business_id}_{start_date or 'inicio'}_{end_date or 'fin'}_{timestamp}.{fmt}"
+        path = EXPORTS_DIR / filename
+        tmp_path = EXPORTS_DIR / f".{filename}.tmp"
+        frames = spec['iterator'](business_id, start_date, end_date, chunk_size)
+        writer = _write_parquet if fmt == 'parquet' else _write_csv_gz
+        rows = writer(frames, tmp_path, spec['dtypes'])
+        tmp_path.replace(path)
+        files[name] = {'filename': filename, 'rows': rows}
+
+    return {'format': fmt, 'files': files}
@@ -0,0 +1,160 @@
+"""
+Feed de cambios de documentos: qué negocios emitieron o anularon comprobantes
+Dos entradas: el webhook POST /events/documents (el servidor Node avisa al instante) y un
+cursor sobre la réplica (id y updated_at) que recoge también lo que no llegó por webhook.
+Los módulos con resultados derivados se suscriben con register_listener y actúan solo
+sobre los negocios y períodos afectados. Cada shard tiene su propio cursor.
+"""
+import json
+import threading
+import time
+from collections import Counter
+from typing import Callable
+
+from config import CHANGE_FEED_POLL_SECONDS
+from database import get_document_changes, get_document_cursor
+from sharding import PRIMARY, SHARDS, shard_for, use_shard
+from state_store import get_state_connection
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS change_cursor (
+    name TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL,
+    last_updated_at TEXT NOT NULL,
+    seen_ids TEXT NOT NULL DEFAULT '[]'
+);
+"""
+
+CURSOR_NAME = 'documents'
+
+_listeners = []
+_lock = threading.Lock()
+_stats = Counter()
+
+
+def register_listener(listener: Callable[[dict], None]):
+    """
+    Suscribe `listener(changes)`, con changes = {business_id: {'YYYY-MM', ...}}; un conjunto
+    vacío significa períodos desconocidos (todo el negocio). Un mismo cambio puede llegar
+    dos veces (webhook y cursor), así que el listener debe ser idempotente.
+    """
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def publish(changes: dict, origin: str):
+    """Entrega los cambios a todos los listeners; el error de uno no detiene a los demás"""
+    if not changes:
+        return
+    _stats[f'eventos_{origin}'] += 1
+    _stats['negocios_afectados'] += len(changes)
+    for listener in list(_listeners):
+        try:
+            listener(changes)
+        except Exception as e:
+            _stats['errores'] += 1
+            print(f"Error en listener del feed de cambios {getattr(listener, '__name__', listener)}: {e}")
+
+
+def document_event(business_id: int, fecha_emision: str = None):
+    """
+    Aviso del servidor Node (webhook). Publica el cambio en el acto y marca la réplica para
+    verificar la base en la próxima lectura, así lo recalculado ya incluye el documento.
+    """
+    snapshot = shard_for(business_id).snapshot
+    if snapshot is not None:
+        snapshot.mark_stale()
+    publish({business_id: {fecha_emision[:7]} if fecha_emision else set()}, 'webhook')
+
+
+def _cursor_name(shard) -> str:
+    return CURSOR_NAME if shard.name == PRIMARY else f"{CURSOR_NAME}:{shard.name}"
+
+
+def _read_cursor(conn, name: str):
+    row = conn.execute(
+        "SELECT last_id, last_updated_at, seen_ids FROM change_cursor WHERE name = ?", (name,)
+    ).fetchone()
+    return None if row is None else (row[0], row[1], set(json.loads(row[2])))
+
+
+def _save_cursor(conn, name: str, last_id: int, last_updated_at: str, seen_ids=()):
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO change_cursor VALUES (?, ?, ?, ?)",
+            (name, last_id, last_updated_at, json.dumps(sorted(seen_ids)))
+        )
+
+
+def _poll_shard(conn, name: str) -> dict:
+    """Cambios del shard activo desde su cursor; los publica y después avanza el cursor"""
+    cursor = _read_cursor(conn, name)
+    if cursor is None:
+        _save_cursor(conn, name, *get_document_cursor())
+        return {}
+    last_id, last_updated_at, seen_ids = cursor
+    frame = get_document_changes(last_id, last_updated_at)
+    _stats['lecturas'] += 1
+    updated_at = frame['updated_at'].fillna('').astype(str)
+    frame = frame[~((updated_at == last_updated_at) & frame['id'].isin(seen_ids))]
+    if frame.empty:
+        return {}
+
+    changes = {}
+    for business_id, periodo in frame[['business_id', 'periodo']].itertuples(index=False):
+        changes.setdefault(int(business_id), set()).add(periodo)
+    publish(changes, 'cursor')
+
+    newest = max(last_updated_at, updated_at[frame.index].max())
+    boundary = frame.loc[updated_at[frame.index] == newest, 'id'].astype(int)
+    _save_cursor(
+        conn,
+        name,
+        max(last_id, int(frame['id'].max())),
+        newest,
+        set(boundary) | (seen_ids if newest == last_updated_at else set())
+    )
+    return changes
+
+
+def poll_changes() -> dict:
+    """
+    Lee los documentos nuevos o modificados desde el cursor de cada shard y los publica. El
+    cursor guarda el último id, el último updated_at y los ids ya vistos en ese segundo (para no
+    publicarlos de nuevo), y se actualiza después de publicar: entrega al menos una vez. La primera
+    lectura solo fija la posición; lo anterior ya lo cubren las huellas de prewarm.
+    """
+    with _lock:
+        conn = get_state_connection(SCHEMA)
+        try:
+            changes = {}
+            for shard in SHARDS.values():
+                with use_shard(shard):
+                    for business_id, periods in _poll_shard(conn, _cursor_name(shard)).items():
+                        changes.setdefault(business_id, set()).update(periods)
+            return changes
+        finally:
+            conn.close()
+
+
+def start_change_feed(interval: float = CHANGE_FEED_POLL_SECONDS) -> threading.Thread:
+    """Hilo que lee el cursor cada `interval` segundos (0: solo webhook)"""
+    if interval <= 0:
+        return None
+
+    def run():
+        while True:
+            try:
+                poll_changes()
+            except Exception as e:
+                print(f"Error leyendo el feed de cambios: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="change-feed", daemon=True)
+    thread.start()
+    return thread
+
+
+def change_feed_stats() -> dict:
+    return {'listeners': len(_listeners), **_stats}
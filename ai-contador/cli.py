@@ -4,18 +4,36 @@ CLI para generar reportes desde línea de comandos
 Uso: python cli.py --business-id 1 --report sales
 """
 import argparse
+import csv
+import json
+import sys
 from datetime import datetime
 
+import pandas as pd
+
 from database import (
     get_business_info,
+    get_businesses,
     get_documents,
     get_sales_summary,
     get_top_clients,
-    get_top_products,
-    get_clients
+    get_client_counts,
+    get_client_activity,
+    iter_item_detail_rows,
+    get_sales_summaries,
+    iter_tenant_period_totals,
+    TENANT_TOTALS_COLUMNS
 )
-from ai_analyzer import analyze_sales_trends, analyze_clients
-from excel_generator import generate_sales_report, generate_tax_report
+from ai_analyzer import analyze_sales_trends, analyze_clients, analyze_sales_batch
+from excel_generator import generate_sales_report, generate_tax_report, generate_annual_tax_report
+from bulk_export import export_business_data
+from ple_exporter import generate_ple_sales
+from tax_calendar import businesses_due_within
+from segmentation import rfm_scores, segment_summary
+from integrity import scan_integrity, integrity_alerts
+from anomalies import business_anomaly_alerts, all_anomaly_alerts
+from prewarm import prewarm_active_businesses
+from product_rollup import get_top_products, get_product_trends
 
 
 def main():
@@ -25,12 +43,12 @@ def main():
     parser.add_argument(
         "--business-id", "-b",
         type=int,
-        required=True,
         help="ID del negocio"
     )
     parser.add_argument(
         "--report", "-r",
-        choices=["sales", "tax", "analysis"],
+        choices=["sales", "tax", "ple", "export", "analysis", "integrity", "reminders", "batch-analysis",
+                 "tenant-summary", "prewarm"],
         default="sales",
         help="Tipo de reporte a generar"
     )
@@ -44,7 +62,17 @@ def main():
         "--month", "-m",
         type=int,
         default=datetime.now().month,
-        help="Mes para reporte tributario"
+        help="Mes para reporte tributario o PLE"
+    )
+    parser.add_argument(
+        "--annual", "-a",
+        action="store_true",
+        help="Reporte tributario anual (12 meses + resumen) en un solo archivo; en tenant-summary, todo el año"
+    )
+    parser.add_argument(
+        "--items", "-i",
+        action="store_true",
+        help="Incluir hoja de detalle de ítems en el reporte de ventas"
     )
     parser.add_argument(
         "--start-date", "-s",
@@ -61,9 +89,80 @@ def main():
         type=str,
         help="Nombre del archivo de salida"
     )
+    parser.add_argument(
+        "--days", "-d",
+        type=int,
+        default=7,
+        help="Días hacia adelante para recordatorios de vencimiento"
+    )
     
     args = parser.parse_args()
     
+    if args.report == "reminders":
+        # Recordatorios masivos de vencimientos (todos los negocios)
+        due = businesses_due_within(get_businesses(), args.days)
+        print(f"📅 Negocios con vencimientos en los próximos {args.days} días: {len(due)}")
+        for item in due.to_dict('records'):
+            print(f"   • {item['fecha_vencimiento']} ({item['dias_restantes']} días) - "
+                  f"{item['razon_social']} [{item['ruc']}] - {item['obligacion']} {item['periodo']}")
+        return
+    
+    if args.report == "tenant-summary":
+        # Totales por negocio, período y tipo de todos los negocios (CSV)
+        month = None if args.annual else args.month
+        periodo = str(args.year) if args.annual else f"{args.year}-{args.month:02d}"
+        output = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+        try:
+            writer = csv.writer(output)
+            writer.writerow(TENANT_TOTALS_COLUMNS)
+            count = 0
+            for rows in iter_tenant_period_totals(args.year, month):
+                writer.writerows(rows)
+                count += len(rows)
+        finally:
+            if args.output:
+                output.close()
+        if args.output:
+            print(f"✅ {count} filas ({periodo}) guardadas en: {args.output}")
+        return
+    
+    if args.report == "batch-analysis":
+        # Análisis nocturno de todos los negocios en lotes
+        businesses = get_businesses()
+        summaries = get_sales_summaries(args.year)
+        anomalies = all_anomaly_alerts()
+        print(f"   Negocios a analizar: {len(businesses)}")
+        batch = analyze_sales_batch([
+            {
+                'business_id': int(b['id']),
+                'business_name': b['razon_social'],
+                'sales_data': summaries.get(int(b['id']), pd.DataFrame()),
+                'alerts': anomalies.get(int(b['id']), [])
+            }
+            for b in businesses.to_dict('records')
+        ])
+        stats = batch['stats']
+        print(f"✅ {stats['negocios']} negocios analizados en {stats['segundos']}s "
+              f"({stats['negocios_por_minuto']} negocios/min, {stats['llamadas_ia']} llamadas IA, "
+              f"{stats['sin_ia']} sin IA)")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(batch, f, ensure_ascii=False, indent=2, default=str)
+            print(f"   Resultados guardados en: {args.output}")
+        return
+    
+    if args.report == "prewarm":
+        # Precalentado de análisis y reportes de los negocios activos (cron fuera de horario)
+        result = prewarm_active_businesses()
+        print(f"✅ {result.get('procesados', 0)} de {result['activos']} negocios activos precalentados "
+              f"en {result['segundos']}s ({result['llamadas_ia']} llamadas IA, {result.get('errores', 0)} errores)")
+        if result['detenido_por']:
+            print(f"   ⏹️ Detenido: {result['detenido_por']}")
+        return
+    
+    if args.business_id is None:
+        parser.error("--business-id es requerido para este tipo de reporte")
+    
     print(f"🤖 Contador AI - Generando reporte...")
     print(f"   Business ID: {args.business_id}")
     print(f"   Tipo: {args.report}")
@@ -83,11 +182,16 @@ def main():
         top_clients = get_top_clients(args.business_id)
         top_products = get_top_products(args.business_id)
         
+        integrity = scan_integrity(args.business_id)
+        
         print(f"   Documentos encontrados: {len(documents)}")
         
         # Análisis IA
         print("   Generando análisis con IA...")
-        ai_analysis = analyze_sales_trends(sales_summary, business.get('razon_social', ''))
+        ai_analysis = analyze_sales_trends(
+            sales_summary, business.get('razon_social', ''),
+            integrity_alerts(integrity) + business_anomaly_alerts(args.business_id)
+        )
         
         # Generar Excel
         filepath = generate_sales_report(
@@ -97,7 +201,12 @@ def main():
             top_clients=top_clients,
             top_products=top_products,
             ai_analysis=ai_analysis,
-            filename=args.output
+            filename=args.output,
+            item_rows=iter_item_detail_rows(
+                args.business_id, args.start_date, args.end_date
+            ) if args.items else None,
+            integrity=integrity,
+            product_trends=get_product_trends(args.business_id)
         )
         
         print(f"✅ Reporte generado: {filepath}")
@@ -107,6 +216,19 @@ def main():
             for insight in ai_analysis.get('insights', [])[:3]:
                 print(f"   • {insight}")
     
+    elif args.report == "tax" and args.annual:
+        # Reporte tributario anual: una sola consulta y un solo libro
+        documents = get_documents(args.business_id, f"{args.year}-01-01", f"{args.year}-12-31")
+        
+        filepath = generate_annual_tax_report(
+            business_info=business,
+            documents=documents,
+            year=args.year,
+            filename=args.output
+        )
+        
+        print(f"✅ Reporte tributario anual generado: {filepath}")
+    
     elif args.report == "tax":
         # Reporte tributario
         documents = get_documents(args.business_id)
@@ -121,16 +243,34 @@ def main():
         
         print(f"✅ Reporte tributario generado: {filepath}")
     
+    elif args.report == "ple":
+        # Registro de Ventas electrónico (PLE 14.1)
+        filepath = generate_ple_sales(
+            business_info=business,
+            business_id=args.business_id,
+            year=args.year,
+            month=args.month
+        )
+        
+        print(f"✅ Registro de Ventas PLE generado: {filepath}")
+    
+    elif args.report == "export":
+        # Exportación columnar de documentos e items para BI
+        export = export_business_data(args.business_id, args.start_date, args.end_date)
+        for name, info in export['files'].items():
+            print(f"✅ {name}: {info['rows']} filas -> {info['filename']} ({export['format']})")
+    
     elif args.report == "analysis":
         # Solo análisis (sin Excel)
         sales_summary = get_sales_summary(args.business_id, args.year)
-        clients = get_clients(args.business_id)
-        top_clients = get_top_clients(args.business_id)
+        client_counts = get_client_counts(args.business_id)
+        segments = segment_summary(rfm_scores(get_client_activity(args.business_id)))
         
         print("\n📊 ANÁLISIS DE VENTAS")
         print("=" * 50)
         
-        sales_analysis = analyze_sales_trends(sales_summary, business.get('razon_social', ''))
+        alerts = integrity_alerts(scan_integrity(args.business_id)) + business_anomaly_alerts(args.business_id)
+        sales_analysis = analyze_sales_trends(sales_summary, business.get('razon_social', ''), alerts)
         
         if 'resumen' in sales_analysis:
             resumen = sales_analysis['resumen']
@@ -147,15 +287,50 @@ def main():
         for rec in sales_analysis.get('recomendaciones', []):
             print(f"   • {rec}")
         
+        if sales_analysis.get('alertas_sunat'):
+            print("\n⚠️  ALERTAS:")
+            for alert in sales_analysis['alertas_sunat']:
+                print(f"   • {alert}")
+        
         print("\n👥 ANÁLISIS DE CLIENTES")
         print("=" * 50)
-        clients_analysis = analyze_clients(clients, top_clients)
+        clients_analysis = analyze_clients(client_counts, segments)
         
         if 'resumen' in clients_analysis:
             resumen = clients_analysis['resumen']
             print(f"Total Clientes: {resumen.get('total_clientes', 0)}")
             print(f"Empresas (RUC): {resumen.get('clientes_con_ruc', 0)}")
             print(f"Personas: {resumen.get('clientes_persona', 0)}")
+        
+        print("\n🎯 SEGMENTOS RFM:")
+        for segment in segments.to_dict('records'):
+            print(f"   • {segment['segmento']}: {segment['clientes']} clientes, "
+                  f"S/ {segment['monto']:,.2f} ({segment['participacion']}%)")
+    
+    elif args.report == "integrity":
+        integrity = scan_integrity(args.business_id)
+        totals = integrity['totales']
+        
+        print("\n🔢 CONTROL DE CORRELATIVOS")
+        print("=" * 50)
+        for row in integrity['series']:
+            print(f"   {row['serie']} ({row['tipo']}): {row['emitidos']:,} emitidos, "
+                  f"{row['primer_numero']}-{row['ultimo_numero']}, {row['faltantes']} faltantes, "
+                  f"{row['duplicados']} duplicados, {row['fuera_de_orden']} fuera de orden")
+        print(f"\n   Total: {totals['faltantes']} números faltantes en {totals['huecos']} huecos, "
+              f"{totals['duplicados']} duplicados, {totals['fuera_de_orden']} fuera de orden")
+        
+        for gap in integrity['huecos'][:20]:
+            rango = gap['desde'] if gap['desde'] == gap['hasta'] else f"{gap['desde']}-{gap['hasta']}"
+            print(f"   ❌ {gap['serie']}: faltan {rango} ({gap['fecha_anterior']} → {gap['fecha_siguiente']})")
+        for dup in integrity['duplicados'][:20]:
+            print(f"   ⚠️  {dup['serie']}-{dup['numero']} duplicado (id {dup['id']}, {dup['fecha_emision']})")
+        for item in integrity['fuera_de_orden'][:20]:
+            print(f"   ⚠️  {item['serie']}-{item['numero']} con fecha {item['fecha_emision']} "
+                  f"anterior a {item['serie']}-{item['numero_anterior']} ({item['fecha_anterior']})")
+        
+        if not any(totals[key] for key in ('huecos', 'duplicados', 'fuera_de_orden')):
+            print("   ✅ Numeración correlativa sin observaciones")
 
 
 if __name__ == "__main__":
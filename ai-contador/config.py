@@ -12,8 +12,40 @@ BASE_DIR = Path(__file__).parent
 DATABASE_PATH = os.getenv('DATABASE_PATH', '../server/data/facturafacil.db')
 REPORTS_DIR = Path(os.getenv('REPORTS_DIR', './reports'))
 
-# Crear directorio de reportes si no existe
+EXPORTS_DIR = Path(os.getenv('EXPORTS_DIR', './exports'))
+
+# Crear directorios de reportes y exportaciones si no existen
 REPORTS_DIR.mkdir(exist_ok=True)
+EXPORTS_DIR.mkdir(exist_ok=True)
+
+# ZIP de reportes por negocio y año (/reports/bundle); de cada selección se conservan los
+# REPORT_BUNDLES_KEEP más recientes (una descarga en curso puede estar leyendo uno reemplazado)
+REPORT_BUNDLES_DIR = Path(os.getenv('REPORT_BUNDLES_DIR', str(REPORTS_DIR / 'bundles')))
+REPORT_BUNDLES_KEEP = max(1, int(os.getenv('REPORT_BUNDLES_KEEP', 3)))
+
+# Réplica analítica: copia de la base (API de backup de SQLite) sobre la que corren los reportes
+SNAPSHOT_ENABLED = os.getenv('SNAPSHOT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SNAPSHOT_PATH = Path(os.getenv('SNAPSHOT_PATH', './data/facturafacil_analytics.db'))
+SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv('SNAPSHOT_MAX_AGE_SECONDS', 300))
+SNAPSHOT_REFRESH_SECONDS = float(os.getenv('SNAPSHOT_REFRESH_SECONDS', 120))
+
+# Shards: bases de FacturaFácil adicionales como "nombre=ruta" separadas por coma (archivo .db o
+# directorio con facturafacil.db). DATABASE_PATH es siempre el shard "principal"
+DATABASE_SHARDS = os.getenv('DATABASE_SHARDS', '')
+# JSON {business_id: shard} para fijar tenants; el resto se ubica buscando el negocio en cada shard
+SHARD_MAP_PATH = os.getenv('SHARD_MAP_PATH', '')
+SHARD_FANOUT_WORKERS = int(os.getenv('SHARD_FANOUT_WORKERS', 4))
+
+# Feed de cambios de documentos: cada cuántos segundos se lee el cursor sobre la réplica (0: solo webhook)
+CHANGE_FEED_POLL_SECONDS = float(os.getenv('CHANGE_FEED_POLL_SECONDS', 30))
+
+# Base de estado propia del servicio (resultados precalculados, etc.); nunca la del servidor
+STATE_DB_PATH = Path(os.getenv('STATE_DB_PATH', str(SNAPSHOT_PATH.with_name('contador_state.db'))))
+
+# Caché Arrow en disco de los documentos por negocio (requiere pyarrow); solo negocios grandes
+DOCUMENT_CACHE_ENABLED = os.getenv('DOCUMENT_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+DOCUMENT_CACHE_DIR = Path(os.getenv('DOCUMENT_CACHE_DIR', str(SNAPSHOT_PATH.with_name('document_cache'))))
+DOCUMENT_CACHE_MIN_ROWS = int(os.getenv('DOCUMENT_CACHE_MIN_ROWS', 50000))
 
 # DigitalOcean GenAI / OpenAI Configuration
 # Usar DigitalOcean GenAI como proveedor principal
@@ -24,9 +56,95 @@ DIGITALOCEAN_MODEL = os.getenv('DIGITALOCEAN_MODEL', 'openai-gpt-oss-120b')
 # Fallback a OpenAI si no hay DigitalOcean
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
 
+# Resiliencia de llamadas a la IA: timeout por intento, plazo total, reintentos y circuit breaker
+AI_TIMEOUT_SECONDS = float(os.getenv('AI_TIMEOUT_SECONDS', 20))
+AI_DEADLINE_SECONDS = float(os.getenv('AI_DEADLINE_SECONDS', 45))
+AI_MAX_RETRIES = int(os.getenv('AI_MAX_RETRIES', 2))
+AI_RETRY_BASE_DELAY = float(os.getenv('AI_RETRY_BASE_DELAY', 0.5))
+AI_BREAKER_FAILURES = int(os.getenv('AI_BREAKER_FAILURES', 5))
+AI_BREAKER_RESET_SECONDS = float(os.getenv('AI_BREAKER_RESET_SECONDS', 30))
+
+# Pedir respuestas en modo JSON (response_format) cuando el proveedor lo soporte
+AI_JSON_MODE = os.getenv('AI_JSON_MODE', 'true').lower() in ('1', 'true', 'yes')
+
+# Análisis por lotes: negocios por llamada y llamadas simultáneas
+AI_BATCH_SIZE = int(os.getenv('AI_BATCH_SIZE', 8))
+AI_BATCH_CONCURRENCY = int(os.getenv('AI_BATCH_CONCURRENCY', 4))
+# Tokens estimados de datos por llamada: un lote que no cabe se parte en llamadas más chicas
+AI_BATCH_MAX_TOKENS = int(os.getenv('AI_BATCH_MAX_TOKENS', 6000))
+
+# Cupo de llamadas a la IA (token bucket): global (cuota del proveedor) y por negocio.
+# Sin cupo el análisis responde en modo básico; los lotes esperan hasta AI_DEADLINE_SECONDS
+LLM_CALLS_PER_MINUTE = float(os.getenv('LLM_CALLS_PER_MINUTE', 60))
+LLM_BURST = float(os.getenv('LLM_BURST', 10))
+LLM_CALLS_PER_BUSINESS_PER_MINUTE = float(os.getenv('LLM_CALLS_PER_BUSINESS_PER_MINUTE', 6))
+LLM_BUSINESS_BURST = float(os.getenv('LLM_BUSINESS_BURST', 3))
+
+# Límites de tamaño de los prompts (meses incluidos, tokens estimados)
+PROMPT_MAX_MONTHS = int(os.getenv('PROMPT_MAX_MONTHS', 12))
+PROMPT_MAX_TOKENS = int(os.getenv('PROMPT_MAX_TOKENS', 1500))
+
+# Cronograma oficial SUNAT (JSON opcional que reemplaza las fechas calculadas)
+TAX_SCHEDULE_PATH = os.getenv('TAX_SCHEDULE_PATH', '')
+
+# Tipos de cambio para expresar en soles los comprobantes en otra moneda
+# CSV con columnas fecha, moneda, tipo_cambio (o venta); FX_FALLBACK_RATES="USD=3.75,EUR=4.05"
+# se usa para monedas o fechas que el CSV no cubre
+FX_RATES_PATH = os.getenv('FX_RATES_PATH', '')
+FX_FALLBACK_RATES = {
+    moneda.strip().upper(): float(rate)
+    for moneda, rate in (
+        item.split('=', 1) for item in os.getenv('FX_FALLBACK_RATES', '').split(',') if '=' in item
+    )
+}
+
+# Precalentado nocturno de análisis y reportes de los negocios activos (cli.py -r prewarm).
+# PREWARM_HOUR (0-23) lo programa dentro del servidor; vacío: solo por CLI/cron
+PREWARM_HOUR = int(os.getenv('PREWARM_HOUR')) if os.getenv('PREWARM_HOUR', '').strip() else None
+PREWARM_ACTIVE_DAYS = int(os.getenv('PREWARM_ACTIVE_DAYS', 35))          # actividad reciente exigida
+PREWARM_MAX_MINUTES = float(os.getenv('PREWARM_MAX_MINUTES', 120))       # presupuesto de tiempo por corrida
+PREWARM_MAX_LLM_CALLS = int(os.getenv('PREWARM_MAX_LLM_CALLS', 1000))    # presupuesto de llamadas a la IA
+PREWARM_MAX_AGE_HOURS = float(os.getenv('PREWARM_MAX_AGE_HOURS', 36))    # vigencia de un resultado precalculado
+
 # Servidor
 PORT = int(os.getenv('PORT', 3002))
 
+# Control de admisión de análisis y reportes (por separado): ejecuciones simultáneas en total
+# y por negocio, y cola acotada. Negocio sobre su límite: 429; cola llena o espera vencida: 503.
+# Ejecutando + en cola de ambos grupos debe caber en el pool de hilos del servidor (40)
+ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT', 4))
+ADMISSION_MAX_PER_BUSINESS = int(os.getenv('ADMISSION_MAX_PER_BUSINESS', 2))
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 8))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv('ADMISSION_QUEUE_TIMEOUT_SECONDS', 10))
+
+# Token obligatorio para los endpoints /admin (vacío: endpoints deshabilitados)
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+# Token obligatorio del webhook POST /events/documents (vacío: webhook deshabilitado)
+EVENTS_TOKEN = os.getenv('EVENTS_TOKEN', '')
+
+# Máximo de filas de la hoja "Detalle de Ítems" (el detalle completo va por /exports)
+ITEMS_SHEET_MAX_ROWS = int(os.getenv('ITEMS_SHEET_MAX_ROWS', 100000))
+
+# Plantillas Excel personalizadas por tipo de reporte (sales.xlsx, tax.xlsx); si no existen se arman en memoria
+EXCEL_TEMPLATES_DIR = Path(os.getenv('EXCEL_TEMPLATES_DIR', './templates'))
+
+# Máximo de huecos/duplicados/fechas fuera de orden listados en el control de integridad (los conteos son completos)
+INTEGRITY_MAX_ISSUES = int(os.getenv('INTEGRITY_MAX_ISSUES', 1000))
+
+# Detección local de anomalías en ventas diarias (alimenta alertas_sunat aun sin IA)
+ANOMALY_HISTORY_DAYS = int(os.getenv('ANOMALY_HISTORY_DAYS', 120))      # días leídos por negocio
+ANOMALY_WINDOW_DAYS = int(os.getenv('ANOMALY_WINDOW_DAYS', 28))         # ventana móvil de referencia
+ANOMALY_RECENT_DAYS = int(os.getenv('ANOMALY_RECENT_DAYS', 7))          # días recientes que se evalúan
+ANOMALY_Z_THRESHOLD = float(os.getenv('ANOMALY_Z_THRESHOLD', 3.0))
+ANNULMENT_RATE_THRESHOLD = float(os.getenv('ANNULMENT_RATE_THRESHOLD', 0.15))
+BOLETA_IDENTIFICATION_THRESHOLD = float(os.getenv('BOLETA_IDENTIFICATION_THRESHOLD', 700))
+
+# Análisis de productos: tasa de IGV para llevar el precio de lista a valor de venta y
+# meses de cada ventana de la tendencia (últimos N frente a los N anteriores)
+IGV_RATE = float(os.getenv('IGV_RATE', 0.18))
+PRODUCT_TREND_MONTHS = int(os.getenv('PRODUCT_TREND_MONTHS', 3))
+
 # Configuración de reportes
 REPORT_CONFIG = {
     'company_name': 'FacturaFácil',
@@ -1,18 +1,46 @@
 """
 Conexión a la base de datos SQLite de FacturaFácil
 """
+import json
 import sqlite3
+import unicodedata
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from config import DATABASE_PATH
+from config import BOLETA_IDENTIFICATION_THRESHOLD, DOCUMENT_CACHE_MIN_ROWS
+from sharding import active_shard, chain_shards, fan_out, routed, shard_for, use_shard
+from fx_rates import add_pen_columns, rates_database, sql_pen, sql_rate
+import document_cache
 
 
-def get_connection():
-    """Obtiene conexión a la base de datos SQLite"""
-    db_path = Path(DATABASE_PATH)
+def get_connection(live: bool = False):
+    """
+    Obtiene conexión a la base de datos SQLite.
+    Abre la base del shard activo (ver sharding.py; el principal es DATABASE_PATH).
+    Por defecto lee la réplica analítica (si está habilitada); `live=True` lee la base del servidor.
+    La tabla de tipos de cambio queda adjuntada como `fx` (ver fx_rates.sql_pen).
+    """
+    shard = active_shard()
+    db_path = shard.database_path
     if not db_path.exists():
         raise FileNotFoundError(f"Base de datos no encontrada en: {db_path}")
-    return sqlite3.connect(db_path)
+    conn = None
+    if shard.snapshot is not None and not live:
+        replica = shard.snapshot.path_for_reading()
+        if replica != db_path:
+            conn = sqlite3.connect(f"file:{replica}?mode=ro", uri=True)
+    conn = conn or sqlite3.connect(db_path)
+    conn.execute("ATTACH DATABASE ? AS fx", (str(rates_database()),))
+    conn.create_function('normalizar_descripcion', 1, normalize_description, deterministic=True)
+    return conn
+
+
+def normalize_description(text) -> str:
+    """Descripción comparable de un ítem libre: sin tildes, en minúsculas y con espacios simples"""
+    if text is None:
+        return ''
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(text.lower().split())
 
 
 def query_to_dataframe(query: str, params: tuple = ()) -> pd.DataFrame:
@@ -23,6 +51,56 @@ def query_to_dataframe(query: str, params: tuple = ()) -> pd.DataFrame:
     return df
 
 
+def iter_query(query: str, params: tuple = (), chunk_size: int = 5000):
+    """
+    Ejecuta una query y genera las filas por bloques de `chunk_size`,
+    sin cargar el resultado completo en memoria
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def iter_query_frames(query: str, params: tuple = (), chunk_size: int = 50000):
+    """Ejecuta una query y genera DataFrames de hasta `chunk_size` filas"""
+    conn = get_connection()
+    try:
+        yield from pd.read_sql_query(query, conn, params=params, chunksize=chunk_size)
+    finally:
+        conn.close()
+
+
+def _date_filter(column: str, start_date: str = None, end_date: str = None) -> tuple:
+    """Condiciones SQL y parámetros para un rango de fechas opcional"""
+    conditions, params = '', []
+    if start_date:
+        conditions += f" AND {column} >= ?"
+        params.append(start_date)
+    if end_date:
+        conditions += f" AND {column} <= ?"
+        params.append(end_date)
+    return conditions, params
+
+
+def _concat_shards(frames: list, by: list, ascending=True) -> pd.DataFrame:
+    """Une los DataFrames de fan_out en un solo orden (con un shard, el resultado tal cual)"""
+    if len(frames) == 1:
+        return frames[0]
+    return (
+        pd.concat(frames, ignore_index=True)
+        .sort_values(by, ascending=ascending, kind='stable')
+        .reset_index(drop=True)
+    )
+
+
+@routed
 def get_business_info(business_id: int) -> dict:
     """Obtiene información del negocio"""
     query = """
@@ -37,11 +115,307 @@ def get_business_info(business_id: int) -> dict:
     return df.iloc[0].to_dict()
 
 
-def get_documents(business_id: int, start_date: str = None, end_date: str = None) -> pd.DataFrame:
-    """Obtiene documentos (facturas/boletas) con filtros opcionales"""
+def get_businesses() -> pd.DataFrame:
+    """Obtiene todos los negocios registrados (de todos los shards)"""
+    query = """
+        SELECT id, ruc, razon_social, nombre_comercial, email
+        FROM businesses
+        ORDER BY id
+    """
+    return _concat_shards(fan_out(query_to_dataframe, query), ['id'])
+
+
+def get_active_businesses(since_date: str) -> pd.DataFrame:
+    """Negocios con documentos desde `since_date`, de mayor a menor actividad (business_id, documentos)"""
+    query = """
+        SELECT business_id, COUNT(*) as documentos
+        FROM documents
+        WHERE fecha_emision >= ?
+        GROUP BY business_id
+        ORDER BY documentos DESC, business_id
+    """
+    return _concat_shards(
+        fan_out(query_to_dataframe, query, (since_date,)), ['documentos', 'business_id'], [False, True]
+    )
+
+
+@routed
+def get_business_fingerprint(business_id: int) -> str:
+    """
+    Huella de los datos del negocio: cambia si se emite, anula o modifica el total de un
+    documento, o si se registra un cliente. Se resuelve con los índices por negocio.
+    """
+    query = """
+        SELECT COUNT(*), COALESCE(MAX(id), 0), ROUND(COALESCE(SUM(total), 0), 2),
+               COALESCE(SUM(estado = 'anulado'), 0),
+               (SELECT COUNT(*) FROM clients WHERE business_id = ?)
+        FROM documents
+        WHERE business_id = ?
+    """
+    conn = get_connection()
+    try:
+        row = conn.execute(query, (business_id, business_id)).fetchone()
+    finally:
+        conn.close()
+    return ':'.join(str(value) for value in row)
+
+
+@routed
+def get_period_fingerprints(business_id: int, year: int = None) -> dict:
+    """
+    Huella de cada período (YYYY-MM) con documentos, del año o de toda la historia, como
+    get_business_fingerprint pero por mes. La clave 'clientes' cambia si se crea, edita o
+    elimina un cliente (su nombre va en los reportes). Se agrupa por día, en el orden del
+    índice business_id, fecha_emision (agrupar por mes en SQL requiere ordenar), y los
+    días se suman por mes aquí.
+    """
+    conditions, params = _period_range(year)
+    query = f"""
+        SELECT substr(fecha_emision, 1, 7), COUNT(*), MAX(id), SUM(total), SUM(estado = 'anulado')
+        FROM documents
+        WHERE business_id = ?{conditions}
+        GROUP BY fecha_emision
+    """
+    conn = get_connection()
+    try:
+        rows = conn.execute(query, (business_id, *params)).fetchall()
+    finally:
+        conn.close()
+    periods = {}
+    for periodo, count, max_id, total, annulled in rows:
+        current = periods.get(periodo, (0, 0, 0.0, 0))
+        periods[periodo] = (
+            current[0] + count, max(current[1], max_id), current[2] + (total or 0), current[3] + annulled
+        )
+    fingerprints = {
+        periodo: f"{count}:{max_id}:{round(total, 2)}:{annulled}"
+        for periodo, (count, max_id, total, annulled) in periods.items()
+    }
+    fingerprints['clientes'] = _clients_version(business_id)
+    return fingerprints
+
+
+def get_document_cursor() -> tuple:
+    """
+    Posición actual del feed de cambios en el shard activo:
+    (último id, último updated_at, ids con ese updated_at)
+    """
+    conn = get_connection()
+    try:
+        last_id, last_updated_at = conn.execute(
+            "SELECT COALESCE(MAX(id), 0), COALESCE(MAX(updated_at), '') FROM documents"
+        ).fetchone()
+        seen_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM documents WHERE updated_at = ?", (last_updated_at,)
+        )]
+    finally:
+        conn.close()
+    return last_id, last_updated_at, seen_ids
+
+
+def get_document_changes(after_id: int, since_updated_at: str) -> pd.DataFrame:
+    """
+    Documentos del shard activo emitidos (id > after_id) o modificados (updated_at >= since_updated_at; la
+    resolución es de segundos, así que el último segundo se relee y el feed descarta lo visto).
+    Columnas: id, business_id, periodo, updated_at
+    """
     query = """
+        SELECT id, business_id, substr(fecha_emision, 1, 7) as periodo, updated_at
+        FROM documents
+        WHERE id > ? OR updated_at >= ?
+    """
+    return query_to_dataframe(query, (after_id, since_updated_at))
+
+
+DOCUMENTS_QUERY = """
+    SELECT 
+        d.id,
+        d.tipo,
+        d.serie,
+        d.numero,
+        d.fecha_emision,
+        d.fecha_vencimiento,
+        d.moneda,
+        d.subtotal,
+        d.igv,
+        d.total,
+        d.estado,
+        c.nombre as cliente_nombre,
+        c.numero_documento as cliente_documento,
+        c.tipo_documento as cliente_tipo_doc,
+        d.updated_at
+    FROM documents d
+    LEFT JOIN clients c ON d.client_id = c.id
+    WHERE d.business_id = ?
+"""
+
+
+def _clients_version(business_id: int) -> str:
+    """Cambia si se crea, edita o elimina un cliente del negocio (nombre y documento van en cada fila)"""
+    conn = get_connection()
+    try:
+        row = conn.execute(
+            "SELECT COUNT(*), MAX(id), MAX(updated_at) FROM clients WHERE business_id = ?", (business_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return json.dumps(row)
+
+
+def _documents_cursor(frame: pd.DataFrame, clients: str) -> dict:
+    """Posición del caché: último id, último updated_at e ids con ese updated_at (como en el feed de cambios)"""
+    updated_at = frame['updated_at'].fillna('').astype(str)
+    last_updated_at = updated_at.max() if len(frame) else ''
+    return {
+        'last_id': int(frame['id'].max()) if len(frame) else 0,
+        'last_updated_at': last_updated_at,
+        'seen_ids': frame.loc[updated_at == last_updated_at, 'id'].astype(int).tolist(),
+        'clients': clients
+    }
+
+
+def _cached_documents(business_id: int):
+    """
+    Tabla Arrow vigente con todos los documentos del negocio o None si no hay caché.
+    Trae de la base solo lo nuevo o modificado desde el cursor del archivo (índice
+    business_id, updated_at) y lo aplica; si cambiaron los clientes, lo reconstruye entero.
+    """
+    cached = document_cache.read_documents(business_id)
+    if cached is None:
+        return None
+    table, meta = cached
+    clients = _clients_version(business_id)
+    if clients != meta['clients']:
+        frame = query_to_dataframe(DOCUMENTS_QUERY, (business_id,))
+        table = document_cache.to_table(frame)
+        document_cache.write_documents(business_id, table, _documents_cursor(frame, clients))
+        document_cache.record('reconstrucciones')
+        return table
+
+    # Primero id, estado y total; las filas completas, solo si hay cambios. Los del último
+    # segundo ya vistos se comparan con el caché: un UPDATE en el mismo segundo que el
+    # INSERT (respuesta de SUNAT) no mueve updated_at
+    seen = document_cache.boundary_values(table, meta['last_updated_at'])
+    conn = get_connection()
+    try:
+        changed_ids = [
+            doc_id for doc_id, updated_at, estado, total in conn.execute(
+                "SELECT id, updated_at, estado, total FROM documents WHERE business_id = ? AND updated_at >= ?",
+                (business_id, meta['last_updated_at'])
+            )
+            if updated_at != meta['last_updated_at'] or seen.get(doc_id) != (estado, total)
+        ]
+    finally:
+        conn.close()
+    if not changed_ids:
+        document_cache.record('vigentes')
+        return table
+
+    changes = query_to_dataframe(DOCUMENTS_QUERY + " AND d.updated_at >= ?", (business_id, meta['last_updated_at']))
+    changes = changes[changes['id'].isin(changed_ids)]
+
+    cursor = _documents_cursor(changes, clients)
+    if cursor['last_updated_at'] == meta['last_updated_at']:
+        cursor['seen_ids'] = sorted(set(cursor['seen_ids']) | set(meta['seen_ids']))
+    cursor['last_id'] = max(cursor['last_id'], meta['last_id'])
+    table = document_cache.merge_documents(table, changes)
+    document_cache.write_documents(business_id, table, cursor)
+    document_cache.record('incrementos')
+    return table
+
+
+@routed
+def get_documents(business_id: int, start_date: str = None, end_date: str = None) -> pd.DataFrame:
+    """
+    Obtiene documentos (facturas/boletas) con filtros opcionales.
+    Incluye tipo_cambio y subtotal_pen, igv_pen, total_pen (montos en soles).
+    Los negocios con al menos DOCUMENT_CACHE_MIN_ROWS documentos se leen del caché Arrow
+    en disco (document_cache.py), que se arma en la primera consulta de toda la historia.
+    """
+    if document_cache.available():
+        table = _cached_documents(business_id)
+        if table is not None:
+            return add_pen_columns(document_cache.documents_frame(table, start_date, end_date))
+
+    query = DOCUMENTS_QUERY
+    params = [business_id]
+    
+    if start_date:
+        query += " AND d.fecha_emision >= ?"
+        params.append(start_date)
+    if end_date:
+        query += " AND d.fecha_emision <= ?"
+        params.append(end_date)
+    
+    query += " ORDER BY d.fecha_emision DESC"
+    
+    # Versión de clientes antes de la consulta: si cambian en el medio, la próxima lectura reconstruye
+    full_history = document_cache.available() and not start_date and not end_date
+    clients = _clients_version(business_id) if full_history else None
+    frame = query_to_dataframe(query, tuple(params))
+    if full_history and len(frame) >= DOCUMENT_CACHE_MIN_ROWS:
+        document_cache.write_documents(
+            business_id, document_cache.to_table(frame), _documents_cursor(frame, clients)
+        )
+
+    # Montos en soles: búsqueda vectorizada del tipo de cambio por (moneda, fecha)
+    return add_pen_columns(frame.drop(columns=['updated_at']))
+
+
+@routed
+def iter_ple_sales_rows(business_id: int, year: int, month: int, chunk_size: int = 5000):
+    """
+    Genera por bloques los documentos del período con los datos del cliente,
+    en el orden del Registro de Ventas (fecha, serie, número).
+    El registro se lleva en moneda nacional: los montos salen en soles y el
+    tipo de cambio del día va en la última columna.
+    """
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    query = f"""
+        SELECT
+            id, tipo, serie, numero, fecha_emision, fecha_vencimiento, moneda,
+            ROUND(subtotal * tipo_cambio, 2) as subtotal,
+            ROUND(igv * tipo_cambio, 2) as igv,
+            ROUND(total * tipo_cambio, 2) as total,
+            estado, cliente_tipo_doc, cliente_documento, cliente_nombre,
+            tipo_cambio
+        FROM (
+            SELECT 
+                d.id,
+                d.tipo,
+                d.serie,
+                d.numero,
+                d.fecha_emision,
+                d.fecha_vencimiento,
+                d.moneda,
+                d.subtotal,
+                d.igv,
+                d.total,
+                d.estado,
+                c.tipo_documento as cliente_tipo_doc,
+                c.numero_documento as cliente_documento,
+                c.nombre as cliente_nombre,
+                {sql_rate('d')} as tipo_cambio
+            FROM documents d
+            LEFT JOIN clients c ON d.client_id = c.id
+            WHERE d.business_id = ? AND d.fecha_emision >= ? AND d.fecha_emision < ?
+            ORDER BY d.fecha_emision, d.serie, d.numero
+        )
+    """
+    params = (business_id, f"{year}-{month:02d}-01", f"{next_year}-{next_month:02d}-01")
+    return iter_query(query, params, chunk_size)
+
+
+@routed
+def iter_export_documents(business_id: int, start_date: str = None, end_date: str = None,
+                          chunk_size: int = 50000):
+    """Documentos del negocio por bloques, en orden de id, para exportación masiva"""
+    conditions, date_params = _date_filter('d.fecha_emision', start_date, end_date)
+    query = f"""
         SELECT 
             d.id,
+            d.business_id,
+            d.client_id,
             d.tipo,
             d.serie,
             d.numero,
@@ -51,52 +425,146 @@ def get_documents(business_id: int, start_date: str = None, end_date: str = None
             d.subtotal,
             d.igv,
             d.total,
+            {sql_rate('d')} as tipo_cambio,
             d.estado,
-            c.nombre as cliente_nombre,
+            d.created_at,
+            c.tipo_documento as cliente_tipo_doc,
             c.numero_documento as cliente_documento,
-            c.tipo_documento as cliente_tipo_doc
+            c.nombre as cliente_nombre
         FROM documents d
         LEFT JOIN clients c ON d.client_id = c.id
-        WHERE d.business_id = ?
+        WHERE d.business_id = ?{conditions}
+        ORDER BY d.id
     """
-    params = [business_id]
-    
-    if start_date:
-        query += " AND d.fecha_emision >= ?"
-        params.append(start_date)
-    if end_date:
-        query += " AND d.fecha_emision <= ?"
-        params.append(end_date)
-    
-    query += " ORDER BY d.fecha_emision DESC"
-    
-    return query_to_dataframe(query, tuple(params))
+    return iter_query_frames(query, (business_id, *date_params), chunk_size)
+
+
+@routed
+def iter_export_items(business_id: int, start_date: str = None, end_date: str = None,
+                      chunk_size: int = 50000):
+    """Items de los documentos del negocio por bloques (join, sin listas IN)"""
+    conditions, date_params = _date_filter('d.fecha_emision', start_date, end_date)
+    query = f"""
+        SELECT 
+            di.id,
+            di.document_id,
+            di.product_id,
+            d.fecha_emision,
+            di.cantidad,
+            di.unidad_medida,
+            di.descripcion,
+            di.precio_unitario,
+            di.valor_venta,
+            di.igv,
+            di.total,
+            p.codigo as producto_codigo
+        FROM document_items di
+        JOIN documents d ON di.document_id = d.id
+        LEFT JOIN products p ON di.product_id = p.id
+        WHERE d.business_id = ?{conditions}
+        ORDER BY di.id
+    """
+    return iter_query_frames(query, (business_id, *date_params), chunk_size)
+
+
+# Máximo de parámetros por consulta (SQLite antiguo limita a 999 variables)
+SQLITE_MAX_VARIABLES = 900
 
 
 def get_document_items(document_ids: list) -> pd.DataFrame:
-    """Obtiene los items de los documentos"""
+    """Obtiene los items de los documentos (consulta por lotes de ids)"""
     if not document_ids:
         return pd.DataFrame()
     
-    placeholders = ','.join(['?' for _ in document_ids])
+    frames = []
+    for start in range(0, len(document_ids), SQLITE_MAX_VARIABLES):
+        batch = list(document_ids[start:start + SQLITE_MAX_VARIABLES])
+        placeholders = ','.join(['?' for _ in batch])
+        query = f"""
+            SELECT 
+                di.document_id,
+                di.cantidad,
+                di.unidad_medida,
+                di.descripcion,
+                di.precio_unitario,
+                di.valor_venta,
+                di.igv,
+                di.total,
+                p.codigo as producto_codigo
+            FROM document_items di
+            LEFT JOIN products p ON di.product_id = p.id
+            WHERE di.document_id IN ({placeholders})
+        """
+        frames.append(query_to_dataframe(query, tuple(batch)))
+    return pd.concat(frames, ignore_index=True)
+
+
+@routed
+def iter_item_detail_rows(business_id: int, start_date: str = None, end_date: str = None,
+                          chunk_size: int = 5000):
+    """
+    Genera por bloques las filas de detalle de ítems del negocio (join con
+    documentos, sin listas IN) en el orden de la hoja "Detalle de Ítems"
+    """
+    conditions, date_params = _date_filter('d.fecha_emision', start_date, end_date)
     query = f"""
         SELECT 
-            di.document_id,
+            d.fecha_emision,
+            d.tipo,
+            d.serie || '-' || d.numero as comprobante,
+            p.codigo as producto_codigo,
+            di.descripcion,
             di.cantidad,
             di.unidad_medida,
-            di.descripcion,
             di.precio_unitario,
             di.valor_venta,
             di.igv,
             di.total,
-            p.codigo as producto_codigo
+            d.estado
         FROM document_items di
+        JOIN documents d ON di.document_id = d.id
         LEFT JOIN products p ON di.product_id = p.id
-        WHERE di.document_id IN ({placeholders})
+        WHERE d.business_id = ?{conditions}
+        ORDER BY d.fecha_emision DESC, d.id, di.id
+    """
+    return iter_query(query, (business_id, *date_params), chunk_size)
+
+
+@routed
+def get_series_summary(business_id: int) -> pd.DataFrame:
+    """Por tipo y serie: emitidos, primer y último número, números distintos (incluye anulados)"""
+    query = """
+        SELECT
+            tipo,
+            serie,
+            COUNT(*) as emitidos,
+            MIN(numero) as primer_numero,
+            MAX(numero) as ultimo_numero,
+            COUNT(DISTINCT numero) as numeros_distintos
+        FROM documents
+        WHERE business_id = ?
+        GROUP BY tipo, serie
+        ORDER BY tipo, serie
     """
-    return query_to_dataframe(query, tuple(document_ids))
+    return query_to_dataframe(query, (business_id,))
 
 
+@routed
+def iter_serie_numbers(business_id: int, tipo: str, serie: str, chunk_size: int = 200000):
+    """
+    Numeración de una serie en orden de número (recorrido del índice de correlativos, sin ordenar en memoria).
+    Retorna DataFrames por bloques con columnas: id, numero, fecha_emision
+    """
+    query = """
+        SELECT id, numero, fecha_emision
+        FROM documents
+        WHERE business_id = ? AND tipo = ? AND serie = ?
+        ORDER BY numero
+    """
+    yield from iter_query_frames(query, (business_id, tipo, serie), chunk_size)
+
+
+@routed
 def get_clients(business_id: int) -> pd.DataFrame:
     """Obtiene todos los clientes del negocio"""
     query = """
@@ -110,6 +578,40 @@ def get_clients(business_id: int) -> pd.DataFrame:
     return query_to_dataframe(query, (business_id,))
 
 
+@routed
+def get_client_counts(business_id: int) -> dict:
+    """Conteo de clientes por tipo de documento, calculado en SQL"""
+    query = """
+        SELECT
+            COUNT(*) as total_clientes,
+            COALESCE(SUM(tipo_documento = 'RUC'), 0) as clientes_con_ruc,
+            COALESCE(SUM(tipo_documento = 'DNI'), 0) as clientes_persona
+        FROM clients
+        WHERE business_id = ?
+    """
+    return {key: int(value) for key, value in query_to_dataframe(query, (business_id,)).iloc[0].items()}
+
+
+@routed
+def get_client_activity(business_id: int) -> pd.DataFrame:
+    """
+    Compras por cliente (todos los clientes con documentos): frecuencia,
+    monto y última compra, base del análisis RFM
+    """
+    query = f"""
+        SELECT
+            client_id,
+            COUNT(*) as frecuencia,
+            SUM({sql_pen('total', 'documents')}) as monto,
+            MAX(fecha_emision) as ultima_compra
+        FROM documents
+        WHERE business_id = ? AND estado != 'anulado' AND client_id IS NOT NULL
+        GROUP BY client_id
+    """
+    return query_to_dataframe(query, (business_id,))
+
+
+@routed
 def get_products(business_id: int) -> pd.DataFrame:
     """Obtiene todos los productos del negocio"""
     query = """
@@ -123,17 +625,18 @@ def get_products(business_id: int) -> pd.DataFrame:
     return query_to_dataframe(query, (business_id,))
 
 
+@routed
 def get_sales_summary(business_id: int, year: int = None) -> pd.DataFrame:
     """Obtiene resumen de ventas por mes"""
-    query = """
+    query = f"""
         SELECT 
             strftime('%Y', fecha_emision) as año,
             strftime('%m', fecha_emision) as mes,
             tipo,
             COUNT(*) as cantidad_documentos,
-            SUM(subtotal) as subtotal,
-            SUM(igv) as igv,
-            SUM(total) as total
+            SUM({sql_pen('subtotal', 'documents')}) as subtotal,
+            SUM({sql_pen('igv', 'documents')}) as igv,
+            SUM({sql_pen('total', 'documents')}) as total
         FROM documents
         WHERE business_id = ? AND estado != 'anulado'
     """
@@ -148,14 +651,166 @@ def get_sales_summary(business_id: int, year: int = None) -> pd.DataFrame:
     return query_to_dataframe(query, tuple(params))
 
 
+def _period_range(year: int = None, month: int = None) -> tuple:
+    """Condición SQL por rango de fecha_emision (usa el índice, a diferencia de strftime)"""
+    if not year:
+        return '', []
+    if month:
+        start = f"{year}-{month:02d}-01"
+        end = f"{year + 1}-01-01" if month == 12 else f"{year}-{month + 1:02d}-01"
+    else:
+        start, end = f"{year}-01-01", f"{year + 1}-01-01"
+    return " AND fecha_emision >= ? AND fecha_emision < ?", [start, end]
+
+
+TENANT_TOTALS_COLUMNS = [
+    'business_id', 'ruc', 'razon_social', 'periodo', 'tipo',
+    'cantidad_documentos', 'subtotal', 'igv', 'total'
+]
+
+
+def _tenant_totals_query(year: int = None, month: int = None, after_business_id: int = 0,
+                         until_business_id: int = None) -> tuple:
+    """
+    Totales (negocio, período, tipo) de todos los negocios en un solo GROUP BY.
+    Agrega primero sobre documents y luego une con businesses (una fila por grupo, no por documento).
+    """
+    conditions, params = _period_range(year, month)
+    conditions += " AND business_id > ?"
+    params.append(after_business_id)
+    if until_business_id is not None:
+        conditions += " AND business_id <= ?"
+        params.append(until_business_id)
+    query = f"""
+        SELECT t.business_id, b.ruc, b.razon_social, t.periodo, t.tipo,
+               t.cantidad_documentos, t.subtotal, t.igv, t.total
+        FROM (
+            SELECT
+                business_id,
+                substr(fecha_emision, 1, 7) as periodo,
+                tipo,
+                COUNT(*) as cantidad_documentos,
+                ROUND(SUM({sql_pen('subtotal', 'documents')}), 2) as subtotal,
+                ROUND(SUM({sql_pen('igv', 'documents')}), 2) as igv,
+                ROUND(SUM({sql_pen('total', 'documents')}), 2) as total
+            FROM documents
+            WHERE estado != 'anulado'{conditions}
+            GROUP BY business_id, periodo, tipo
+        ) t
+        JOIN businesses b ON b.id = t.business_id
+        ORDER BY t.business_id, t.periodo, t.tipo
+    """
+    return query, tuple(params)
+
+
+def get_tenant_period_totals(year: int = None, month: int = None, after_business_id: int = 0,
+                             limit_businesses: int = 500) -> tuple:
+    """
+    Página de totales por (negocio, período, tipo) para el panel de administración.
+    Paginación por cursor sobre businesses.id: retorna (totales, siguiente cursor o None).
+    Con varios shards la página son los `limit_businesses` ids menores entre todos.
+    """
+    pages = fan_out(
+        query_to_dataframe,
+        "SELECT id FROM businesses WHERE id > ? ORDER BY id LIMIT ?",
+        (after_business_id, limit_businesses)
+    )
+    page = _concat_shards(pages, ['id']).head(limit_businesses)
+    if page.empty:
+        return pd.DataFrame(columns=TENANT_TOTALS_COLUMNS), None
+    
+    last_id = int(page['id'].iloc[-1])
+    totals = _concat_shards(
+        fan_out(query_to_dataframe, *_tenant_totals_query(year, month, after_business_id, last_id)),
+        ['business_id', 'periodo', 'tipo']
+    )
+    # Quedan negocios si algún shard tiene ids después del cursor o llenó su página
+    more = any(len(p) == limit_businesses or (p['id'] > last_id).any() for p in pages)
+    return totals, last_id if more else None
+
+
+def iter_tenant_period_totals(year: int = None, month: int = None, chunk_size: int = 5000):
+    """
+    Todos los totales (negocio, período, tipo) por bloques de tuplas, en el orden de TENANT_TOTALS_COLUMNS.
+    Los shards se recorren uno tras otro (ordenado por negocio dentro de cada shard).
+    """
+    query, params = _tenant_totals_query(year, month)
+    yield from chain_shards(iter_query, query, params, chunk_size)
+
+
+def get_sales_summaries(year: int = None) -> dict:
+    """
+    Resumen mensual de todos los negocios con una sola consulta agregada.
+    Retorna {business_id: DataFrame} con las mismas columnas que get_sales_summary.
+    """
+    columns = ['año', 'mes', 'tipo', 'cantidad_documentos', 'subtotal', 'igv', 'total']
+    totals = _concat_shards(fan_out(query_to_dataframe, *_tenant_totals_query(year)), ['business_id'])
+    if totals.empty:
+        return {}
+    totals = totals.sort_values(['business_id', 'periodo'], ascending=[True, False], kind='stable')
+    totals['año'] = totals['periodo'].str[:4]
+    totals['mes'] = totals['periodo'].str[5:7]
+    
+    # Un corte por negocio sobre la tabla ordenada (más barato que groupby + copia por grupo)
+    ids = totals['business_id'].to_numpy()
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    ends = np.r_[starts[1:], len(ids)]
+    frame = totals[columns].reset_index(drop=True)
+    return {int(ids[start]): frame.iloc[start:end] for start, end in zip(starts, ends)}
+
+
+DAILY_TOTALS_COLUMNS = [
+    'business_id', 'fecha', 'documentos', 'anulados', 'total', 'boletas_sin_identificar'
+]
+
+
+def get_daily_totals(start_date: str, business_id: int = None,
+                     boleta_threshold: float = BOLETA_IDENTIFICATION_THRESHOLD) -> pd.DataFrame:
+    """
+    Totales diarios desde `start_date` de un negocio o de todos (business_id=None) en un solo GROUP BY.
+    `total` excluye anulados; `boletas_sin_identificar` cuenta boletas mayores a `boleta_threshold`
+    sin cliente con documento de identidad.
+    Columnas: DAILY_TOTALS_COLUMNS
+    """
+    conditions = "fecha_emision >= ?"
+    params = [boleta_threshold, start_date]
+    if business_id is not None:
+        conditions = "business_id = ? AND " + conditions
+        params = [boleta_threshold, business_id, start_date]
+    query = f"""
+        SELECT
+            business_id,
+            substr(fecha_emision, 1, 10) as fecha,
+            COUNT(*) as documentos,
+            SUM(estado = 'anulado') as anulados,
+            ROUND(SUM(CASE WHEN estado != 'anulado' THEN {sql_pen('total', 'documents')} ELSE 0 END), 2) as total,
+            SUM(CASE
+                WHEN tipo = 'boleta' AND estado != 'anulado' AND {sql_pen('total', 'documents')} > ?
+                 AND (client_id IS NULL OR NOT EXISTS (
+                     SELECT 1 FROM clients c WHERE c.id = client_id AND COALESCE(c.numero_documento, '') != ''
+                 ))
+                THEN 1 ELSE 0
+            END) as boletas_sin_identificar
+        FROM documents
+        WHERE {conditions}
+        GROUP BY business_id, fecha
+        ORDER BY business_id, fecha
+    """
+    if business_id is not None:
+        with use_shard(shard_for(business_id)):
+            return query_to_dataframe(query, tuple(params))
+    return _concat_shards(fan_out(query_to_dataframe, query, tuple(params)), ['business_id', 'fecha'])
+
+
+@routed
 def get_top_clients(business_id: int, limit: int = 10) -> pd.DataFrame:
     """Obtiene los clientes con más compras"""
-    query = """
+    query = f"""
         SELECT 
             c.nombre,
             c.numero_documento,
             COUNT(d.id) as total_compras,
-            SUM(d.total) as monto_total,
+            SUM({sql_pen('total', 'd')}) as monto_total,
             MAX(d.fecha_emision) as ultima_compra
         FROM clients c
         JOIN documents d ON c.id = d.client_id
@@ -167,19 +822,41 @@ def get_top_clients(business_id: int, limit: int = 10) -> pd.DataFrame:
     return query_to_dataframe(query, (business_id, limit))
 
 
-def get_top_products(business_id: int, limit: int = 10) -> pd.DataFrame:
-    """Obtiene los productos más vendidos"""
-    query = """
-        SELECT 
-            di.descripcion,
-            SUM(di.cantidad) as cantidad_vendida,
-            SUM(di.total) as monto_total,
-            COUNT(DISTINCT di.document_id) as en_documentos
-        FROM document_items di
-        JOIN documents d ON di.document_id = d.id
-        WHERE d.business_id = ? AND d.estado != 'anulado'
-        GROUP BY di.descripcion
-        ORDER BY monto_total DESC
-        LIMIT ?
+@routed
+def get_product_month_totals(business_id: int, periods: list = None) -> pd.DataFrame:
     """
-    return query_to_dataframe(query, (business_id, limit))
+    Ventas no anuladas por (mes, producto) para el rollup de productos (product_rollup.py), de
+    todos los meses o solo de `periods` ('YYYY-MM'). Los ítems del catálogo se agrupan por
+    product_id y los libres por descripción normalizada (`clave`, ver normalize_description),
+    así un documento con "Café" y "cafe " cuenta una sola vez. Montos en soles.
+    Columnas: periodo, product_id, clave, descripcion, cantidad, valor_venta, monto_total, documentos
+    """
+    conditions, params = '', [business_id]
+    if periods:
+        periods = sorted(periods)
+        last_year, last_month = map(int, periods[-1].split('-'))
+        conditions = (
+            " AND d.fecha_emision >= ? AND d.fecha_emision < ?"
+            f" AND substr(d.fecha_emision, 1, 7) IN ({','.join('?' * len(periods))})"
+        )
+        params += [
+            f"{periods[0]}-01",
+            f"{last_year + 1}-01-01" if last_month == 12 else f"{last_year}-{last_month + 1:02d}-01",
+            *periods
+        ]
+    query = f"""
+        SELECT
+            substr(d.fecha_emision, 1, 7) as periodo,
+            di.product_id,
+            CASE WHEN di.product_id IS NULL THEN normalizar_descripcion(di.descripcion) END as clave,
+            MAX(trim(di.descripcion)) as descripcion,
+            SUM(di.cantidad) as cantidad,
+            SUM(di.valor_venta * {sql_rate('d')}) as valor_venta,
+            SUM(di.total * {sql_rate('d')}) as monto_total,
+            COUNT(DISTINCT di.document_id) as documentos
+        FROM documents d
+        JOIN document_items di ON di.document_id = d.id
+        WHERE d.business_id = ? AND d.estado != 'anulado'{conditions}
+        GROUP BY periodo, di.product_id, clave
+    """
+    return query_to_dataframe(query, tuple(params))
@@ -0,0 +1,137 @@
+"""
+Caché en disco de los documentos de cada negocio (Arrow IPC, memory-mapped)
+Un archivo por negocio con las columnas de get_documents, sin comprimir para abrirlo con mmap:
+leerlo no copia los datos y las páginas las comparte el sistema operativo entre los workers.
+Se actualiza por incrementos (documentos nuevos o modificados desde el último updated_at) y
+se reemplaza con un rename atómico; la lógica de frescura está en database.get_documents.
+"""
+import json
+import os
+from collections import Counter
+from pathlib import Path
+
+import pandas as pd
+
+from config import DOCUMENT_CACHE_ENABLED, DOCUMENT_CACHE_DIR
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+except ImportError:  # pyarrow es opcional: sin él get_documents consulta siempre la base
+    pa = pc = ipc = None
+
+
+# Versión del formato: un archivo de otra versión se ignora y se reconstruye
+FORMAT_VERSION = '2'
+
+# Orden del archivo, el de la consulta SQL: leerlo no requiere ordenar
+SORT_KEYS = [('fecha_emision', 'descending'), ('id', 'ascending')]
+
+_stats = Counter()
+
+
+def _schema():
+    return pa.schema([
+        ('id', pa.int64()), ('tipo', pa.string()), ('serie', pa.string()), ('numero', pa.int64()),
+        ('fecha_emision', pa.string()), ('fecha_vencimiento', pa.string()), ('moneda', pa.string()),
+        ('subtotal', pa.float64()), ('igv', pa.float64()), ('total', pa.float64()), ('estado', pa.string()),
+        ('cliente_nombre', pa.string()), ('cliente_documento', pa.string()), ('cliente_tipo_doc', pa.string()),
+        ('updated_at', pa.string())
+    ])
+
+
+def available() -> bool:
+    return DOCUMENT_CACHE_ENABLED and pa is not None
+
+
+def _path(business_id: int) -> Path:
+    return Path(DOCUMENT_CACHE_DIR) / f"documentos_{int(business_id)}.arrow"
+
+
+def read_documents(business_id: int):
+    """
+    (tabla, meta) del negocio o None si no hay caché. La tabla apunta al archivo mapeado en
+    memoria; `meta` es el cursor con el que se armó (last_id, last_updated_at, seen_ids, clients).
+    """
+    path = _path(business_id)
+    try:
+        source = pa.memory_map(str(path))
+    except FileNotFoundError:
+        return None
+    try:
+        table = ipc.open_file(source).read_all()
+    except (pa.ArrowInvalid, OSError) as e:
+        print(f"Caché de documentos ilegible para negocio {business_id}: {e}")
+        return None
+    metadata = table.schema.metadata or {}
+    if metadata.get(b'version') != FORMAT_VERSION.encode():
+        return None
+    return table, json.loads(metadata[b'meta'])
+
+
+def to_table(frame: pd.DataFrame):
+    """Tabla Arrow con el esquema fijo del caché, en el orden del archivo"""
+    schema = _schema()
+    frame = frame[schema.names].astype({
+        column: 'string' for column in schema.names if pa.types.is_string(schema.field(column).type)
+    })
+    table = pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+    return table.take(pc.sort_indices(table, sort_keys=SORT_KEYS))
+
+
+def boundary_values(table, updated_at: str) -> dict:
+    """{id: (estado, total)} de los documentos del caché con ese updated_at (el último segundo del cursor)"""
+    rows = table.filter(pc.equal(table['updated_at'], updated_at)).select(['id', 'estado', 'total']).to_pydict()
+    return {doc_id: (estado, total) for doc_id, estado, total in zip(rows['id'], rows['estado'], rows['total'])}
+
+
+def merge_documents(table, changes: pd.DataFrame):
+    """Aplica a la tabla los documentos nuevos o modificados: los ids que ya estaban se reemplazan"""
+    changed = to_table(changes)
+    kept = pc.invert(pc.is_in(table['id'], value_set=changed['id']))
+    if not pc.all(kept).as_py():
+        _stats['modificados'] += 1
+    merged = pa.concat_tables([table.filter(kept).cast(changed.schema), changed])
+    return merged.take(pc.sort_indices(merged, sort_keys=SORT_KEYS))
+
+
+def write_documents(business_id: int, table, meta: dict):
+    """Escribe el archivo del negocio (temporal + rename: quien lo tenga mapeado sigue con el anterior)"""
+    path = _path(business_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = table.replace_schema_metadata({'version': FORMAT_VERSION, 'meta': json.dumps(meta)})
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with pa.OSFile(str(tmp_path), 'wb') as sink, ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=256 * 1024)
+        os.replace(tmp_path, path)
+        _stats['escrituras'] += 1
+    except OSError as e:
+        tmp_path.unlink(missing_ok=True)
+        print(f"Error escribiendo caché de documentos del negocio {business_id}: {e}")
+
+
+def documents_frame(table, start_date: str = None, end_date: str = None) -> pd.DataFrame:
+    """
+    Documentos en el rango como DataFrame; se filtra en Arrow, antes de convertir, y el
+    archivo ya está en el orden de la consulta SQL (fecha de emisión descendente)
+    """
+    if start_date:
+        table = table.filter(pc.greater_equal(table['fecha_emision'], start_date))
+    if end_date:
+        table = table.filter(pc.less_equal(table['fecha_emision'], end_date))
+    frame = table.drop_columns(['updated_at']).to_pandas()
+    # Sin valores, la consulta deja la columna como object con None
+    for column in frame.columns[frame.isna().all()]:
+        frame[column] = frame[column].astype(object).where(frame[column].notna(), None)
+    _stats['lecturas'] += 1
+    return frame
+
+
+def record(event: str):
+    _stats[event] += 1
+
+
+def document_cache_stats() -> dict:
+    return {'habilitado': available(), **_stats}
@@ -5,13 +5,14 @@ Crea reportes contables con formato empresarial
 import pandas as pd
 from pathlib import Path
 from datetime import datetime
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font, Alignment, Border, Side, PatternFill, NamedStyle
 from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.chart import BarChart, LineChart, PieChart, Reference
 from openpyxl.utils import get_column_letter
 
-from config import REPORTS_DIR, REPORT_CONFIG
+from config import REPORTS_DIR, REPORT_CONFIG, ITEMS_SHEET_MAX_ROWS, EXCEL_TEMPLATES_DIR, INTEGRITY_MAX_ISSUES
+from fx_rates import add_pen_columns
 
 
 # Estilos
@@ -27,19 +28,93 @@ THIN_BORDER = Border(
     bottom=Side(style='thin')
 )
 
+# Estilos con nombre: se registran una vez por libro y las celdas solo guardan el nombre,
+# así styles.xml no crece con cada Font/Alignment creado por celda
+STYLE_SPECS = {
+    'ff_title': {'font': Font(bold=True, size=16, color="1E40AF"), 'alignment': Alignment(horizontal='center')},
+    'ff_title_tax': {'font': Font(bold=True, size=14)},
+    'ff_section': {'font': Font(bold=True, size=12)},
+    'ff_highlight': {'font': Font(bold=True, size=12, color="1E40AF")},
+    'ff_bold': {'font': Font(bold=True)},
+    'ff_alert': {'font': Font(bold=True, color="FF0000")},
+    'ff_header': {
+        'font': HEADER_FONT, 'fill': HEADER_FILL, 'border': THIN_BORDER,
+        'alignment': Alignment(horizontal='center', vertical='center')
+    },
+    'ff_currency': {'number_format': CURRENCY_FORMAT},
+    'ff_currency_bold': {'number_format': CURRENCY_FORMAT, 'font': Font(bold=True)},
+    'ff_currency_alert': {'number_format': CURRENCY_FORMAT, 'font': Font(bold=True, color="FF0000")},
+}
+
+# Estructura fija de cada tipo de reporte: hojas y encabezados de tabla
+REPORT_TEMPLATES = {
+    'sales': [
+        ('Resumen Ejecutivo', None),
+        ('Documentos', ['Tipo', 'Serie-Número', 'Fecha', 'Cliente', 'Subtotal', 'IGV', 'Total', 'Estado',
+                        'Moneda', 'T.C.']),
+        ('Resumen Mensual', ['Año', 'Mes', 'Tipo', 'Documentos', 'Subtotal', 'IGV', 'Total']),
+        ('Top Clientes', ['Cliente', 'Documento', 'Total Compras', 'Monto Total', 'Última Compra']),
+        ('Top Productos', ['Producto', 'Cantidad Vendida', 'Monto Total', 'En Documentos', '% de Ventas',
+                           'Precio Prom. (sin IGV)', 'Precio Lista (sin IGV)', 'Dif. vs Lista %',
+                           'Tendencia %']),
+    ],
+    'tax': [
+        ('Declaración Mensual', None),
+    ],
+}
+
+
+def register_styles(wb):
+    """Registra los estilos con nombre en el libro (si la plantilla ya los trae, no hace nada)"""
+    for name, spec in STYLE_SPECS.items():
+        if name not in wb.named_styles:
+            wb.add_named_style(NamedStyle(name=name, **spec))
+
+
+def build_report_template(report_type: str) -> Workbook:
+    """Libro vacío del tipo de reporte: estilos registrados, hojas creadas y encabezados escritos"""
+    wb = Workbook()
+    register_styles(wb)
+    for index, (title, headers) in enumerate(REPORT_TEMPLATES[report_type]):
+        ws = wb.active if index == 0 else wb.create_sheet()
+        ws.title = title
+        if headers:
+            ws.append(headers)
+            for cell in ws[1]:
+                cell.style = 'ff_header'
+    return wb
+
+
+def save_report_template(report_type: str, path=None) -> str:
+    """
+    Guarda la plantilla del reporte en EXCEL_TEMPLATES_DIR para personalizarla
+    (logo, colores, anchos); los reportes se generan luego sobre ese archivo
+    """
+    path = Path(path) if path else EXCEL_TEMPLATES_DIR / f"{report_type}.xlsx"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    build_report_template(report_type).save(path)
+    return str(path)
+
+
+def new_report_workbook(report_type: str) -> Workbook:
+    """Plantilla del reporte: desde EXCEL_TEMPLATES_DIR si existe el archivo, si no se arma en memoria"""
+    template_path = EXCEL_TEMPLATES_DIR / f"{report_type}.xlsx"
+    if template_path.exists():
+        wb = load_workbook(template_path)
+        register_styles(wb)
+        return wb
+    return build_report_template(report_type)
+
 
 def apply_header_style(cell):
     """Aplica estilo de encabezado a una celda"""
-    cell.fill = HEADER_FILL
-    cell.font = HEADER_FONT
-    cell.alignment = Alignment(horizontal='center', vertical='center')
-    cell.border = THIN_BORDER
+    cell.style = 'ff_header'
 
 
-def apply_currency_format(ws, col, start_row, end_row):
+def apply_currency_format(ws, col, start_row, end_row, style: str = 'ff_currency'):
     """Aplica formato de moneda a una columna"""
-    for row in range(start_row, end_row + 1):
-        ws.cell(row=row, column=col).number_format = CURRENCY_FORMAT
+    for (cell,) in ws.iter_rows(min_row=start_row, max_row=end_row, min_col=col, max_col=col):
+        cell.style = style
 
 
 def auto_adjust_columns(ws):
@@ -47,7 +122,31 @@ def auto_adjust_columns(ws):
     for column_cells in ws.columns:
         length = max(len(str(cell.value or '')) for cell in column_cells)
         length = min(length + 2, 50)  # Máximo 50 caracteres
-        ws.column_dimensions[column_cells[0].column_letter].width = length
+        ws.column_dimensions[get_column_letter(column_cells[0].column)].width = length
+
+
+def set_column_widths(ws, frame: pd.DataFrame):
+    """Ancho de columnas calculado sobre el DataFrame (encabezados de la fila 1 incluidos)"""
+    for col, column in enumerate(frame.columns, 1):
+        header = ws.cell(row=1, column=col).value
+        values = frame[column].dropna().astype(str).str.len()
+        length = max(len(str(header or '')), int(values.max()) if len(values) else 0)
+        ws.column_dimensions[get_column_letter(col)].width = min(length + 2, 50)
+
+
+def append_frame(ws, frame: pd.DataFrame, currency_columns=()) -> int:
+    """
+    Agrega las filas del DataFrame debajo del contenido actual de la hoja
+    y aplica el estilo de moneda a las columnas indicadas (1-based).
+    Retorna la última fila escrita.
+    """
+    first_row = ws.max_row + 1
+    for values in frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None):
+        ws.append(values)
+    last_row = first_row + len(frame) - 1
+    for col in currency_columns:
+        apply_currency_format(ws, col, first_row, last_row)
+    return last_row
 
 
 def generate_sales_report(
@@ -57,30 +156,34 @@ def generate_sales_report(
     top_clients: pd.DataFrame,
     top_products: pd.DataFrame,
     ai_analysis: dict,
-    filename: str = None
+    filename: str = None,
+    item_rows=None,
+    integrity: dict = None,
+    product_trends: pd.DataFrame = None
 ) -> str:
     """
-    Genera reporte completo de ventas en Excel
+    Genera reporte completo de ventas en Excel sobre la plantilla 'sales'.
+    `item_rows` (opcional): bloques de filas de detalle de ítems para la hoja "Detalle de Ítems"
+    `integrity` (opcional): resultado de integrity.scan_integrity para la hoja "Integridad"
+    `product_trends` (opcional): ventas mensuales por producto (product_rollup.get_product_trends)
+    para la hoja "Tendencia Productos"
     """
     if filename is None:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"reporte_ventas_{timestamp}.xlsx"
     
     filepath = REPORTS_DIR / filename
-    wb = Workbook()
+    wb = new_report_workbook('sales')
     
     # =========================================
     # HOJA 1: RESUMEN EJECUTIVO
     # =========================================
-    ws_resumen = wb.active
-    ws_resumen.title = "Resumen Ejecutivo"
+    ws_resumen = wb["Resumen Ejecutivo"]
     
     # Título
     ws_resumen.merge_cells('A1:F1')
-    title_cell = ws_resumen['A1']
-    title_cell.value = f"📊 REPORTE DE VENTAS - {business_info.get('razon_social', 'Mi Negocio')}"
-    title_cell.font = Font(bold=True, size=16, color="1E40AF")
-    title_cell.alignment = Alignment(horizontal='center')
+    ws_resumen['A1'] = f"📊 REPORTE DE VENTAS - {business_info.get('razon_social', 'Mi Negocio')}"
+    ws_resumen['A1'].style = 'ff_title'
     
     # Información del negocio
     ws_resumen['A3'] = "RUC:"
@@ -93,7 +196,7 @@ def generate_sales_report(
     # Métricas principales
     row = 8
     ws_resumen[f'A{row}'] = "📈 MÉTRICAS PRINCIPALES"
-    ws_resumen[f'A{row}'].font = Font(bold=True, size=12)
+    ws_resumen[f'A{row}'].style = 'ff_section'
     
     if ai_analysis and 'resumen' in ai_analysis:
         resumen = ai_analysis['resumen']
@@ -105,16 +208,20 @@ def generate_sales_report(
             ("IGV Acumulado", f"S/ {resumen.get('igv_total', 0):,.2f}"),
             ("Tendencia", resumen.get('tendencia', 'N/A'))
         ]
+        if resumen.get('proyeccion_trimestre') is not None:
+            metrics.append(("Proyección Próx. Trimestre", f"S/ {resumen['proyeccion_trimestre']:,.2f}"))
+            for month in resumen['pronostico']['meses']:
+                metrics.append((f"   {month['periodo']} (proyectado)", f"S/ {month['total']:,.2f}"))
         for metric, value in metrics:
             ws_resumen[f'A{row}'] = metric
             ws_resumen[f'B{row}'] = value
-            ws_resumen[f'A{row}'].font = Font(bold=True)
+            ws_resumen[f'A{row}'].style = 'ff_bold'
             row += 1
     
     # Insights de IA
     row += 2
     ws_resumen[f'A{row}'] = "🤖 ANÁLISIS INTELIGENTE"
-    ws_resumen[f'A{row}'].font = Font(bold=True, size=12)
+    ws_resumen[f'A{row}'].style = 'ff_section'
     row += 1
     
     if ai_analysis:
@@ -124,7 +231,7 @@ def generate_sales_report(
         
         row += 1
         ws_resumen[f'A{row}'] = "💡 RECOMENDACIONES"
-        ws_resumen[f'A{row}'].font = Font(bold=True, size=12)
+        ws_resumen[f'A{row}'].style = 'ff_section'
         row += 1
         
         for rec in ai_analysis.get('recomendaciones', []):
@@ -136,69 +243,40 @@ def generate_sales_report(
     # =========================================
     # HOJA 2: DETALLE DE DOCUMENTOS
     # =========================================
-    ws_docs = wb.create_sheet("Documentos")
+    ws_docs = wb["Documentos"]
     
     if not documents.empty:
-        # Encabezados
-        headers = ['Tipo', 'Serie-Número', 'Fecha', 'Cliente', 'Subtotal', 'IGV', 'Total', 'Estado']
-        for col, header in enumerate(headers, 1):
-            cell = ws_docs.cell(row=1, column=col, value=header)
-            apply_header_style(cell)
-        
-        # Datos
-        for row_idx, doc in documents.iterrows():
-            row = row_idx + 2
-            ws_docs.cell(row=row, column=1, value=doc.get('tipo', '').upper())
-            ws_docs.cell(row=row, column=2, value=f"{doc.get('serie', '')}-{doc.get('numero', '')}")
-            ws_docs.cell(row=row, column=3, value=doc.get('fecha_emision', ''))
-            ws_docs.cell(row=row, column=4, value=doc.get('cliente_nombre', 'Cliente General'))
-            ws_docs.cell(row=row, column=5, value=doc.get('subtotal', 0))
-            ws_docs.cell(row=row, column=6, value=doc.get('igv', 0))
-            ws_docs.cell(row=row, column=7, value=doc.get('total', 0))
-            ws_docs.cell(row=row, column=8, value=doc.get('estado', '').upper())
-        
-        # Formato de moneda
-        last_row = len(documents) + 1
-        for col in [5, 6, 7]:
-            apply_currency_format(ws_docs, col, 2, last_row)
+        rows = pd.DataFrame({
+            'tipo': documents['tipo'].fillna('').str.upper(),
+            'comprobante': documents['serie'].fillna('').astype(str) + '-' + documents['numero'].astype(str),
+            'fecha': documents['fecha_emision'],
+            'cliente': documents['cliente_nombre'] if 'cliente_nombre' in documents else 'Cliente General',
+            'subtotal': documents['subtotal_pen'],
+            'igv': documents['igv_pen'],
+            'total': documents['total_pen'],
+            'estado': documents['estado'].fillna('').str.upper(),
+            'moneda': documents['moneda'].fillna('PEN'),
+            'tipo_cambio': documents['tipo_cambio']
+        })
+        last_row = append_frame(ws_docs, rows, currency_columns=(5, 6, 7))
+        set_column_widths(ws_docs, rows)
         
         # Totales
         total_row = last_row + 2
-        ws_docs.cell(row=total_row, column=4, value="TOTALES:")
-        ws_docs.cell(row=total_row, column=4).font = Font(bold=True)
-        ws_docs.cell(row=total_row, column=5, value=documents['subtotal'].sum())
-        ws_docs.cell(row=total_row, column=6, value=documents['igv'].sum())
-        ws_docs.cell(row=total_row, column=7, value=documents['total'].sum())
-        for col in [5, 6, 7]:
-            ws_docs.cell(row=total_row, column=col).number_format = CURRENCY_FORMAT
-            ws_docs.cell(row=total_row, column=col).font = Font(bold=True)
-    
-    auto_adjust_columns(ws_docs)
+        ws_docs.cell(row=total_row, column=4, value="TOTALES:").style = 'ff_bold'
+        for col, column in ((5, 'subtotal'), (6, 'igv'), (7, 'total')):
+            ws_docs.cell(row=total_row, column=col, value=rows[column].sum()).style = 'ff_currency_bold'
     
     # =========================================
     # HOJA 3: RESUMEN MENSUAL
     # =========================================
-    ws_mensual = wb.create_sheet("Resumen Mensual")
+    ws_mensual = wb["Resumen Mensual"]
     
     if not sales_summary.empty:
-        headers = ['Año', 'Mes', 'Tipo', 'Documentos', 'Subtotal', 'IGV', 'Total']
-        for col, header in enumerate(headers, 1):
-            cell = ws_mensual.cell(row=1, column=col, value=header)
-            apply_header_style(cell)
-        
-        for row_idx, data in sales_summary.iterrows():
-            row = row_idx + 2
-            ws_mensual.cell(row=row, column=1, value=data.get('año', ''))
-            ws_mensual.cell(row=row, column=2, value=data.get('mes', ''))
-            ws_mensual.cell(row=row, column=3, value=data.get('tipo', '').upper())
-            ws_mensual.cell(row=row, column=4, value=data.get('cantidad_documentos', 0))
-            ws_mensual.cell(row=row, column=5, value=data.get('subtotal', 0))
-            ws_mensual.cell(row=row, column=6, value=data.get('igv', 0))
-            ws_mensual.cell(row=row, column=7, value=data.get('total', 0))
-        
-        last_row = len(sales_summary) + 1
-        for col in [5, 6, 7]:
-            apply_currency_format(ws_mensual, col, 2, last_row)
+        rows = sales_summary[['año', 'mes', 'tipo', 'cantidad_documentos', 'subtotal', 'igv', 'total']].assign(
+            tipo=sales_summary['tipo'].fillna('').str.upper()
+        )
+        last_row = append_frame(ws_mensual, rows, currency_columns=(5, 6, 7))
         
         # Gráfico de barras
         if len(sales_summary) > 1:
@@ -219,45 +297,24 @@ def generate_sales_report(
     # =========================================
     # HOJA 4: TOP CLIENTES
     # =========================================
-    ws_clientes = wb.create_sheet("Top Clientes")
+    ws_clientes = wb["Top Clientes"]
     
     if not top_clients.empty:
-        headers = ['Cliente', 'Documento', 'Total Compras', 'Monto Total', 'Última Compra']
-        for col, header in enumerate(headers, 1):
-            cell = ws_clientes.cell(row=1, column=col, value=header)
-            apply_header_style(cell)
-        
-        for row_idx, client in top_clients.iterrows():
-            row = row_idx + 2
-            ws_clientes.cell(row=row, column=1, value=client.get('nombre', ''))
-            ws_clientes.cell(row=row, column=2, value=client.get('numero_documento', ''))
-            ws_clientes.cell(row=row, column=3, value=client.get('total_compras', 0))
-            ws_clientes.cell(row=row, column=4, value=client.get('monto_total', 0))
-            ws_clientes.cell(row=row, column=5, value=client.get('ultima_compra', ''))
-        
-        apply_currency_format(ws_clientes, 4, 2, len(top_clients) + 1)
+        rows = top_clients[['nombre', 'numero_documento', 'total_compras', 'monto_total', 'ultima_compra']]
+        append_frame(ws_clientes, rows, currency_columns=(4,))
     
     auto_adjust_columns(ws_clientes)
     
     # =========================================
     # HOJA 5: TOP PRODUCTOS
     # =========================================
-    ws_productos = wb.create_sheet("Top Productos")
+    ws_productos = wb["Top Productos"]
     
     if not top_products.empty:
-        headers = ['Producto', 'Cantidad Vendida', 'Monto Total', 'En Documentos']
-        for col, header in enumerate(headers, 1):
-            cell = ws_productos.cell(row=1, column=col, value=header)
-            apply_header_style(cell)
-        
-        for row_idx, prod in top_products.iterrows():
-            row = row_idx + 2
-            ws_productos.cell(row=row, column=1, value=prod.get('descripcion', ''))
-            ws_productos.cell(row=row, column=2, value=prod.get('cantidad_vendida', 0))
-            ws_productos.cell(row=row, column=3, value=prod.get('monto_total', 0))
-            ws_productos.cell(row=row, column=4, value=prod.get('en_documentos', 0))
-        
-        apply_currency_format(ws_productos, 3, 2, len(top_products) + 1)
+        columns = ['descripcion', 'cantidad_vendida', 'monto_total', 'en_documentos', 'participacion',
+                   'precio_promedio', 'precio_lista', 'variacion_precio', 'tendencia']
+        rows = top_products[[column for column in columns if column in top_products]]
+        append_frame(ws_productos, rows, currency_columns=(3, 6, 7))
         
         # Gráfico de pastel
         if len(top_products) > 1:
@@ -269,42 +326,181 @@ def generate_sales_report(
             chart.set_categories(cats_ref)
             chart.width = 12
             chart.height = 10
-            ws_productos.add_chart(chart, "F2")
+            ws_productos.add_chart(chart, "K2")
     
     auto_adjust_columns(ws_productos)
     
+    # =========================================
+    # HOJA OPCIONAL: TENDENCIA DE PRODUCTOS
+    # =========================================
+    if product_trends is not None and not product_trends.empty:
+        write_product_trends_sheet(wb.create_sheet("Tendencia Productos"), product_trends)
+    
+    # =========================================
+    # HOJA 6 (OPCIONAL): DETALLE DE ÍTEMS
+    # =========================================
+    if item_rows is not None:
+        write_item_detail_sheet(wb.create_sheet("Detalle de Ítems"), item_rows)
+    
+    # =========================================
+    # HOJA 7 (OPCIONAL): INTEGRIDAD DE CORRELATIVOS
+    # =========================================
+    if integrity is not None:
+        write_integrity_sheet(wb.create_sheet("Integridad"), integrity)
+    
     # Guardar
     wb.save(filepath)
     return str(filepath)
 
 
-def generate_tax_report(
-    business_info: dict,
-    documents: pd.DataFrame,
-    year: int,
-    month: int,
-    filename: str = None
-) -> str:
+ITEM_DETAIL_HEADERS = [
+    ('Fecha', 12), ('Tipo', 10), ('Comprobante', 16), ('Código', 12), ('Descripción', 45),
+    ('Cantidad', 10), ('Unidad', 8), ('Precio Unitario', 15), ('Valor Venta', 15),
+    ('IGV', 13), ('Total', 15), ('Estado', 11)
+]
+ITEM_CURRENCY_COLUMNS = (8, 9, 10, 11)
+
+
+def write_item_detail_sheet(ws, item_rows, max_rows: int = None) -> int:
     """
-    Genera reporte tributario mensual para declaración SUNAT
+    Escribe la hoja de detalle de ítems a partir de bloques de filas (tuplas)
+    leídos de la base de datos, sin pasar por DataFrames.
+    Se detiene en `max_rows` y deja una nota indicando cuántos ítems faltan.
     """
-    if filename is None:
-        filename = f"reporte_tributario_{year}_{month:02d}.xlsx"
+    if max_rows is None:
+        max_rows = ITEMS_SHEET_MAX_ROWS
     
-    filepath = REPORTS_DIR / filename
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Declaración Mensual"
+    for col, (header, width) in enumerate(ITEM_DETAIL_HEADERS, 1):
+        apply_header_style(ws.cell(row=1, column=col, value=header))
+        ws.column_dimensions[get_column_letter(col)].width = width
+    ws.freeze_panes = 'A2'
     
-    # Filtrar documentos del mes
-    docs_mes = documents[
-        (documents['fecha_emision'].str[:7] == f"{year}-{month:02d}")
-    ] if not documents.empty else pd.DataFrame()
+    written = 0
+    omitted = 0
+    for rows in item_rows:
+        for fecha, tipo, comprobante, codigo, descripcion, cantidad, unidad, precio, valor, igv, total, estado in rows:
+            if written >= max_rows:
+                omitted += 1
+                continue
+            ws.append([fecha, (tipo or '').upper(), comprobante, codigo, descripcion, cantidad,
+                       unidad, precio, valor, igv, total, (estado or '').upper()])
+            written += 1
     
-    # Título
+    for col in ITEM_CURRENCY_COLUMNS:
+        apply_currency_format(ws, col, 2, written + 1)
+    
+    if omitted:
+        note = ws.cell(row=written + 3, column=1,
+                       value=f"Detalle truncado: {omitted:,} ítems adicionales no incluidos. "
+                             f"Usa la exportación masiva (/exports) para el detalle completo.")
+        note.style = 'ff_alert'
+    return written
+
+
+INTEGRITY_SECTIONS = [
+    ('huecos', "HUECOS EN LA NUMERACIÓN",
+     ['Tipo', 'Serie', 'Desde', 'Hasta', 'Faltantes', 'Fecha Anterior', 'Fecha Siguiente'],
+     ['tipo', 'serie', 'desde', 'hasta', 'faltantes', 'fecha_anterior', 'fecha_siguiente']),
+    ('duplicados', "NÚMEROS DUPLICADOS",
+     ['Tipo', 'Serie', 'Número', 'ID Documento', 'Fecha'],
+     ['tipo', 'serie', 'numero', 'id', 'fecha_emision']),
+    ('fuera_de_orden', "FECHAS FUERA DE ORDEN",
+     ['Tipo', 'Serie', 'Número', 'Fecha', 'Número Anterior', 'Fecha Anterior'],
+     ['tipo', 'serie', 'numero', 'fecha_emision', 'numero_anterior', 'fecha_anterior']),
+]
+
+
+def write_product_trends_sheet(ws, trends: pd.DataFrame):
+    """Hoja de ventas mensuales por producto (una fila por producto, una columna por mes) con gráfico de líneas"""
+    ws.append(['Producto', *trends.columns[1:]])
+    for cell in ws[1]:
+        apply_header_style(cell)
+    append_frame(ws, trends, currency_columns=range(2, len(trends.columns) + 1))
+    ws.freeze_panes = 'B2'
+    auto_adjust_columns(ws)
+    
+    # Una línea por producto (los 5 primeros) a lo largo de los meses
+    if len(trends.columns) > 2:
+        chart = LineChart()
+        chart.title = "Ventas Mensuales por Producto"
+        chart.y_axis.title = "Monto (S/)"
+        last_row = min(len(trends), 5) + 1
+        data_ref = Reference(ws, min_col=1, max_col=len(trends.columns), min_row=2, max_row=last_row)
+        chart.add_data(data_ref, from_rows=True, titles_from_data=True)
+        chart.set_categories(Reference(ws, min_col=2, max_col=len(trends.columns), min_row=1, max_row=1))
+        chart.width = 20
+        chart.height = 10
+        ws.add_chart(chart, f"A{len(trends) + 4}")
+
+
+def write_integrity_sheet(ws, integrity: dict):
+    """Hoja de control de correlativos: resumen por serie y detalle de cada problema"""
+    ws['A1'] = "CONTROL DE CORRELATIVOS"
+    ws['A1'].style = 'ff_section'
+    
+    ws.append([])
+    ws.append(['Tipo', 'Serie', 'Emitidos', 'Primer Número', 'Último Número',
+               'Faltantes', 'Huecos', 'Duplicados', 'Fuera de Orden'])
+    for cell in ws[ws.max_row]:
+        cell.style = 'ff_header'
+    for row in integrity['series']:
+        ws.append([row['tipo'].upper(), row['serie'], row['emitidos'], row['primer_numero'],
+                   row['ultimo_numero'], row['faltantes'], row['huecos'], row['duplicados'],
+                   row['fuera_de_orden']])
+        if row['huecos'] or row['duplicados'] or row['fuera_de_orden']:
+            ws.cell(row=ws.max_row, column=2).style = 'ff_alert'
+    
+    for key, title, headers, fields in INTEGRITY_SECTIONS:
+        ws.append([])
+        ws.append([f"{title} ({integrity['totales'][key]})"])
+        ws.cell(row=ws.max_row, column=1).style = 'ff_section'
+        if not integrity[key]:
+            ws.append(["Sin observaciones"])
+            continue
+        ws.append(headers)
+        for cell in ws[ws.max_row][:len(headers)]:
+            cell.style = 'ff_header'
+        for issue in integrity[key]:
+            ws.append([issue['tipo'].upper()] + [issue[field] for field in fields[1:]])
+    
+    if integrity.get('truncado'):
+        ws.append([])
+        ws.append([f"Detalle truncado a {INTEGRITY_MAX_ISSUES:,} filas por sección; los conteos están completos"])
+        ws.cell(row=ws.max_row, column=1).style = 'ff_alert'
+    auto_adjust_columns(ws)
+
+
+MONTH_NAMES = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Set', 'Oct', 'Nov', 'Dic']
+
+
+def tax_period_totals(documents: pd.DataFrame) -> pd.DataFrame:
+    """
+    Totales en soles por (periodo 'YYYY-MM', tipo) en un solo groupby sobre los documentos
+    Columnas: periodo, tipo, cantidad, subtotal, igv, total
+    """
+    columns = ['periodo', 'tipo', 'cantidad', 'subtotal', 'igv', 'total']
+    if documents.empty:
+        return pd.DataFrame(columns=columns)
+    if 'total_pen' not in documents:
+        documents = add_pen_columns(documents)
+    
+    return (
+        documents.assign(periodo=documents['fecha_emision'].astype(str).str[:7])
+        .groupby(['periodo', 'tipo'], as_index=False)
+        .agg(
+            cantidad=('total', 'size'),
+            subtotal=('subtotal_pen', 'sum'),
+            igv=('igv_pen', 'sum'),
+            total=('total_pen', 'sum')
+        )[columns]
+    )
+
+
+def _write_tax_period(ws, business_info: dict, title: str, totals: pd.DataFrame):
+    """Escribe la hoja de declaración de un período a partir de sus totales por tipo"""
     ws.merge_cells('A1:E1')
-    ws['A1'] = f"REPORTE TRIBUTARIO - {month:02d}/{year}"
-    ws['A1'].font = Font(bold=True, size=14)
+    ws['A1'] = title
+    ws['A1'].style = 'ff_title_tax'
     
     # Info del negocio
     ws['A3'] = "RUC:"
@@ -315,75 +511,161 @@ def generate_tax_report(
     # Resumen de ventas
     row = 7
     ws[f'A{row}'] = "RESUMEN DE VENTAS DEL MES"
-    ws[f'A{row}'].font = Font(bold=True, size=12)
+    ws[f'A{row}'].style = 'ff_section'
     
     row += 2
-    if not docs_mes.empty:
-        # Boletas
-        boletas = docs_mes[docs_mes['tipo'] == 'boleta']
-        ws[f'A{row}'] = "BOLETAS DE VENTA"
-        ws[f'A{row}'].font = Font(bold=True)
+    if totals.empty:
+        ws[f'A{row}'] = "No hay documentos emitidos en este período"
+        auto_adjust_columns(ws)
+        return
+    
+    by_tipo = totals.set_index('tipo')
+    for tipo, label in (('boleta', "BOLETAS DE VENTA"), ('factura', "FACTURAS")):
+        values = by_tipo.loc[tipo] if tipo in by_tipo.index else None
+        ws[f'A{row}'] = label
+        ws[f'A{row}'].style = 'ff_bold'
         row += 1
         ws[f'A{row}'] = "Cantidad:"
-        ws[f'B{row}'] = len(boletas)
+        ws[f'B{row}'] = int(values['cantidad']) if values is not None else 0
         row += 1
         ws[f'A{row}'] = "Base Imponible:"
-        ws[f'B{row}'] = boletas['subtotal'].sum() if not boletas.empty else 0
-        ws[f'B{row}'].number_format = CURRENCY_FORMAT
+        ws[f'B{row}'] = float(values['subtotal']) if values is not None else 0
+        ws[f'B{row}'].style = 'ff_currency'
         row += 1
         ws[f'A{row}'] = "IGV:"
-        ws[f'B{row}'] = boletas['igv'].sum() if not boletas.empty else 0
-        ws[f'B{row}'].number_format = CURRENCY_FORMAT
+        ws[f'B{row}'] = float(values['igv']) if values is not None else 0
+        ws[f'B{row}'].style = 'ff_currency'
         row += 1
         ws[f'A{row}'] = "Total:"
-        ws[f'B{row}'] = boletas['total'].sum() if not boletas.empty else 0
-        ws[f'B{row}'].number_format = CURRENCY_FORMAT
-        ws[f'B{row}'].font = Font(bold=True)
-        
+        ws[f'B{row}'] = float(values['total']) if values is not None else 0
+        ws[f'B{row}'].style = 'ff_currency_bold'
         row += 2
-        # Facturas
-        facturas = docs_mes[docs_mes['tipo'] == 'factura']
-        ws[f'A{row}'] = "FACTURAS"
-        ws[f'A{row}'].font = Font(bold=True)
-        row += 1
-        ws[f'A{row}'] = "Cantidad:"
-        ws[f'B{row}'] = len(facturas)
-        row += 1
-        ws[f'A{row}'] = "Base Imponible:"
-        ws[f'B{row}'] = facturas['subtotal'].sum() if not facturas.empty else 0
-        ws[f'B{row}'].number_format = CURRENCY_FORMAT
-        row += 1
-        ws[f'A{row}'] = "IGV:"
-        ws[f'B{row}'] = facturas['igv'].sum() if not facturas.empty else 0
-        ws[f'B{row}'].number_format = CURRENCY_FORMAT
-        row += 1
-        ws[f'A{row}'] = "Total:"
-        ws[f'B{row}'] = facturas['total'].sum() if not facturas.empty else 0
-        ws[f'B{row}'].number_format = CURRENCY_FORMAT
-        ws[f'B{row}'].font = Font(bold=True)
-        
-        # Totales generales
-        row += 3
-        ws[f'A{row}'] = "TOTALES PARA DECLARACIÓN"
-        ws[f'A{row}'].font = Font(bold=True, size=12, color="1E40AF")
-        row += 1
-        ws[f'A{row}'] = "Base Imponible Total:"
-        ws[f'B{row}'] = docs_mes['subtotal'].sum()
-        ws[f'B{row}'].number_format = CURRENCY_FORMAT
-        ws[f'B{row}'].font = Font(bold=True)
-        row += 1
-        ws[f'A{row}'] = "IGV por Pagar:"
-        ws[f'B{row}'] = docs_mes['igv'].sum()
-        ws[f'B{row}'].number_format = CURRENCY_FORMAT
-        ws[f'B{row}'].font = Font(bold=True, color="FF0000")
-        row += 1
-        ws[f'A{row}'] = "Total Ventas:"
-        ws[f'B{row}'] = docs_mes['total'].sum()
-        ws[f'B{row}'].number_format = CURRENCY_FORMAT
-        ws[f'B{row}'].font = Font(bold=True)
-    else:
-        ws[f'A{row}'] = "No hay documentos emitidos en este período"
+    
+    # Totales generales
+    row += 1
+    ws[f'A{row}'] = "TOTALES PARA DECLARACIÓN"
+    ws[f'A{row}'].style = 'ff_highlight'
+    row += 1
+    ws[f'A{row}'] = "Base Imponible Total:"
+    ws[f'B{row}'] = float(totals['subtotal'].sum())
+    ws[f'B{row}'].style = 'ff_currency_bold'
+    row += 1
+    ws[f'A{row}'] = "IGV por Pagar:"
+    ws[f'B{row}'] = float(totals['igv'].sum())
+    ws[f'B{row}'].style = 'ff_currency_alert'
+    row += 1
+    ws[f'A{row}'] = "Total Ventas:"
+    ws[f'B{row}'] = float(totals['total'].sum())
+    ws[f'B{row}'].style = 'ff_currency_bold'
     
     auto_adjust_columns(ws)
+
+
+def generate_tax_report(
+    business_info: dict,
+    documents: pd.DataFrame,
+    year: int,
+    month: int,
+    filename: str = None
+) -> str:
+    """
+    Genera reporte tributario mensual para declaración SUNAT
+    """
+    if filename is None:
+        filename = f"reporte_tributario_{year}_{month:02d}.xlsx"
+    
+    filepath = REPORTS_DIR / filename
+    wb = new_report_workbook('tax')
+    ws = wb["Declaración Mensual"]
+    
+    totals = tax_period_totals(documents)
+    _write_tax_period(
+        ws, business_info,
+        f"REPORTE TRIBUTARIO - {month:02d}/{year}",
+        totals[totals['periodo'] == f"{year}-{month:02d}"]
+    )
+    
+    wb.save(filepath)
+    return str(filepath)
+
+
+def generate_annual_tax_report(
+    business_info: dict,
+    documents: pd.DataFrame,
+    year: int,
+    filename: str = None
+) -> str:
+    """
+    Genera el reporte tributario anual: resumen del año y una hoja por mes.
+    Los totales de los 12 períodos salen de un único groupby(periodo, tipo).
+    """
+    if filename is None:
+        filename = f"reporte_tributario_{year}_anual.xlsx"
+    
+    filepath = REPORTS_DIR / filename
+    wb = Workbook()
+    register_styles(wb)
+    ws = wb.active
+    ws.title = "Resumen Anual"
+    
+    totals = tax_period_totals(documents)
+    totals = totals[totals['periodo'].str[:4] == str(year)]
+    
+    # Resumen anual: un período por fila
+    ws.merge_cells('A1:I1')
+    ws['A1'] = f"REPORTE TRIBUTARIO ANUAL - {year}"
+    ws['A1'].style = 'ff_title_tax'
+    ws['A3'] = "RUC:"
+    ws['B3'] = business_info.get('ruc', '')
+    ws['A4'] = "Razón Social:"
+    ws['B4'] = business_info.get('razon_social', '')
+    
+    header_row = 6
+    headers = ['Período', 'Boletas', 'Facturas', 'Base Boletas', 'Base Facturas',
+               'Base Imponible', 'IGV por Pagar', 'Total Ventas']
+    for col, header in enumerate(headers, 1):
+        apply_header_style(ws.cell(row=header_row, column=col, value=header))
+    
+    pivot = totals.pivot_table(
+        index='periodo', columns='tipo', values=['cantidad', 'subtotal'], aggfunc='sum', fill_value=0
+    )
+    by_period = totals.groupby('periodo')[['subtotal', 'igv', 'total']].sum()
+    
+    def pivot_value(field, periodo, tipo):
+        key = (field, tipo)
+        return pivot.at[periodo, key] if key in pivot.columns and periodo in pivot.index else 0
+    
+    for month in range(1, 13):
+        periodo = f"{year}-{month:02d}"
+        row = header_row + month
+        ws.cell(row=row, column=1, value=f"{MONTH_NAMES[month - 1]} {year}")
+        ws.cell(row=row, column=2, value=int(pivot_value('cantidad', periodo, 'boleta')))
+        ws.cell(row=row, column=3, value=int(pivot_value('cantidad', periodo, 'factura')))
+        ws.cell(row=row, column=4, value=float(pivot_value('subtotal', periodo, 'boleta')))
+        ws.cell(row=row, column=5, value=float(pivot_value('subtotal', periodo, 'factura')))
+        for col, field in ((6, 'subtotal'), (7, 'igv'), (8, 'total')):
+            ws.cell(row=row, column=col, value=float(by_period.at[periodo, field]) if periodo in by_period.index else 0)
+    
+    last_row = header_row + 12
+    total_row = last_row + 1
+    ws.cell(row=total_row, column=1, value="TOTAL AÑO").style = 'ff_bold'
+    for col in range(2, 9):
+        letter = get_column_letter(col)
+        cell = ws.cell(row=total_row, column=col, value=f"=SUM({letter}{header_row + 1}:{letter}{last_row})")
+        cell.style = 'ff_currency_bold' if col >= 4 else 'ff_bold'
+    for col in range(4, 9):
+        apply_currency_format(ws, col, header_row + 1, last_row)
+    auto_adjust_columns(ws)
+    
+    # Una hoja de declaración por mes
+    for month in range(1, 13):
+        periodo = f"{year}-{month:02d}"
+        ws_mes = wb.create_sheet(f"{month:02d}-{MONTH_NAMES[month - 1]}")
+        _write_tax_period(
+            ws_mes, business_info,
+            f"REPORTE TRIBUTARIO - {month:02d}/{year}",
+            totals[totals['periodo'] == periodo]
+        )
+    
     wb.save(filepath)
     return str(filepath)
@@ -0,0 +1,140 @@
+"""
+Pronóstico estadístico de ventas mensuales
+Estacional ingenuo con crecimiento interanual (24+ meses de historia) o suavizado
+exponencial de Holt con tendencia amortiguada; vectorizado sobre varios negocios a la vez
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+SEASON = 12
+HORIZON = 3
+ALPHA = 0.5   # suavizado del nivel
+BETA = 0.3    # suavizado de la tendencia
+PHI = 0.9     # amortiguación de la tendencia
+
+
+def _month_range(first: str, last: str) -> list:
+    return [p.strftime('%Y-%m') for p in pd.period_range(first, last, freq='M')]
+
+
+def _next_periods(last: str, horizon: int) -> list:
+    start = pd.Period(last, freq='M') + 1
+    return [p.strftime('%Y-%m') for p in pd.period_range(start, periods=horizon, freq='M')]
+
+
+def monthly_matrix(sales_by_business: dict, today: datetime = None) -> tuple:
+    """
+    Matriz negocios x meses con el total mensual (boletas + facturas), meses sin ventas en 0.
+    El mes en curso se excluye porque todavía está incompleto.
+    Retorna (ids, periodos, matriz).
+    """
+    frames = [
+        (business_id, data) for business_id, data in sales_by_business.items()
+        if data is not None and not data.empty
+    ]
+    if not frames:
+        return list(sales_by_business), [], np.zeros((len(sales_by_business), 0))
+
+    # Columnas concatenadas como arreglos: evita armar un DataFrame intermedio por negocio
+    data = pd.DataFrame({
+        'business_id': np.repeat([b for b, _ in frames], [len(d) for _, d in frames]),
+        'año': np.concatenate([d['año'].to_numpy() for _, d in frames]),
+        'mes': np.concatenate([d['mes'].to_numpy() for _, d in frames]),
+        'total': np.concatenate([d['total'].to_numpy(dtype=float) for _, d in frames])
+    })
+    data['periodo'] = data['año'].astype(str) + '-' + data['mes'].astype(str).str.zfill(2)
+    data = data[data['periodo'] < (today or datetime.now()).strftime('%Y-%m')]
+    if data.empty:
+        return list(sales_by_business), [], np.zeros((len(sales_by_business), 0))
+
+    periods = _month_range(data['periodo'].min(), data['periodo'].max())
+    matrix = (
+        data.pivot_table(index='business_id', columns='periodo', values='total', aggfunc='sum', fill_value=0)
+        .reindex(index=list(sales_by_business), columns=periods, fill_value=0)
+    )
+    return list(matrix.index), periods, matrix.to_numpy(dtype=float)
+
+
+def _holt(matrix: np.ndarray, first: np.ndarray, horizon: int) -> np.ndarray:
+    """Holt con tendencia amortiguada, fila por negocio, desde su primer mes con ventas"""
+    rows, months = matrix.shape
+    level = np.full(rows, np.nan)
+    trend = np.zeros(rows)
+    for t in range(months):
+        y = matrix[:, t]
+        active = t >= first
+        starting = active & np.isnan(level)
+        level[starting] = y[starting]
+        updating = active & ~starting
+        previous = level[updating]
+        level[updating] = ALPHA * y[updating] + (1 - ALPHA) * (previous + PHI * trend[updating])
+        trend[updating] = BETA * (level[updating] - previous) + (1 - BETA) * PHI * trend[updating]
+    steps = np.cumsum(PHI ** np.arange(1, horizon + 1))
+    return np.nan_to_num(level)[:, None] + np.outer(trend, steps)
+
+
+def _seasonal_naive(matrix: np.ndarray, horizon: int) -> np.ndarray:
+    """Mismo mes del año anterior, ajustado por el crecimiento de los últimos 12 meses"""
+    last_year = matrix[:, -SEASON:].sum(axis=1)
+    previous_year = matrix[:, -2 * SEASON:-SEASON].sum(axis=1)
+    growth = np.divide(last_year, previous_year, out=np.ones_like(last_year), where=previous_year > 0)
+    return matrix[:, -SEASON:-SEASON + horizon] * growth[:, None]
+
+
+def trend_pct(matrix: np.ndarray, window: int = 3) -> np.ndarray:
+    """Variación % de los últimos `window` meses frente a los `window` anteriores (NaN si no hay base)"""
+    if matrix.shape[1] < 2 * window:
+        return np.full(matrix.shape[0], np.nan)
+    recent = matrix[:, -window:].sum(axis=1)
+    older = matrix[:, -2 * window:-window].sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(older > 0, (recent - older) / older * 100, np.nan)
+
+
+def forecast_sales(sales_by_business: dict, horizon: int = HORIZON, today: datetime = None) -> dict:
+    """
+    Pronóstico de los próximos `horizon` meses para todos los negocios en una pasada.
+    `sales_by_business`: {business_id: resumen mensual como el de get_sales_summary}.
+    Retorna {business_id: {'metodo', 'meses': [{'periodo', 'total'}], 'total_trimestre',
+    'tendencia_pct', 'meses_historia'}}.
+    """
+    ids, periods, matrix = monthly_matrix(sales_by_business, today)
+    if not periods:
+        return {business_id: None for business_id in ids}
+
+    has_sales = matrix > 0
+    first = np.where(has_sales.any(axis=1), has_sales.argmax(axis=1), matrix.shape[1])
+    history = matrix.shape[1] - first
+
+    forecast = _holt(matrix, first, horizon)
+    seasonal = history >= 2 * SEASON
+    if seasonal.any() and horizon <= SEASON:
+        forecast[seasonal] = _seasonal_naive(matrix[seasonal], horizon)
+    forecast = np.clip(forecast, 0, None).round(2)
+    trends = trend_pct(matrix)
+
+    future = _next_periods(periods[-1], horizon)
+    results = {}
+    for row, business_id in enumerate(ids):
+        if history[row] == 0:
+            results[business_id] = None
+            continue
+        results[business_id] = {
+            'metodo': 'estacional' if seasonal[row] else 'suavizado_exponencial',
+            'meses': [{'periodo': p, 'total': float(v)} for p, v in zip(future, forecast[row])],
+            'total_trimestre': round(float(forecast[row].sum()), 2),
+            'tendencia_pct': None if np.isnan(trends[row]) else round(float(trends[row]), 1),
+            'meses_historia': int(history[row])
+        }
+    return results
+
+
+def monthly_totals(sales_data: pd.DataFrame) -> pd.Series:
+    """Total mensual (todas las series sumadas) en orden cronológico"""
+    if sales_data is None or sales_data.empty:
+        return pd.Series(dtype=float)
+    periods = sales_data['año'].astype(str) + '-' + sales_data['mes'].astype(str).str.zfill(2)
+    return sales_data.groupby(periods)['total'].sum().sort_index()
@@ -0,0 +1,169 @@
+"""
+Tipos de cambio para expresar en soles (PEN) los comprobantes en otra moneda
+Tabla local cargada desde un CSV (fecha, moneda, tipo_cambio), cacheada en memoria mientras
+el archivo no cambie; se aplica vectorizada sobre DataFrames y dentro de las consultas SQL
+"""
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from config import FX_RATES_PATH, FX_FALLBACK_RATES, SNAPSHOT_PATH
+
+
+BASE_CURRENCY = 'PEN'
+RATES_COLUMNS = ['moneda', 'fecha', 'tipo_cambio']
+
+# Copia SQLite de la tabla, adjuntada a cada conexión como `fx` para convertir dentro de los SUM
+RATES_DATABASE = SNAPSHOT_PATH.with_name('fx_rates.db')
+
+# Las tasas de respaldo se fechan al inicio para cubrir días anteriores al primer registro del CSV
+FALLBACK_DATE = '0001-01-01'
+
+_lock = threading.Lock()
+_cache = {'signature': None, 'rates': None, 'database': None}
+_warned = set()
+
+
+def _signature():
+    path = Path(FX_RATES_PATH) if FX_RATES_PATH else None
+    if not path or not path.exists():
+        return None
+    stat = path.stat()
+    return str(path), stat.st_mtime_ns, stat.st_size
+
+
+def _read_rates() -> pd.DataFrame:
+    """
+    Lee el CSV de tipos de cambio. Columnas: fecha (YYYY-MM-DD), moneda y tipo_cambio
+    (también se acepta `venta`, como lo publica SUNAT). Se agregan las tasas de FX_FALLBACK_RATES.
+    """
+    frames = [pd.DataFrame(
+        [(moneda, FALLBACK_DATE, rate) for moneda, rate in FX_FALLBACK_RATES.items()],
+        columns=RATES_COLUMNS
+    )]
+    if FX_RATES_PATH and Path(FX_RATES_PATH).exists():
+        data = pd.read_csv(FX_RATES_PATH, dtype={'fecha': str, 'moneda': str})
+        if 'tipo_cambio' not in data and 'venta' in data:
+            data = data.rename(columns={'venta': 'tipo_cambio'})
+        data['moneda'] = data['moneda'].str.strip().str.upper()
+        data['fecha'] = data['fecha'].str.strip().str[:10]
+        data['tipo_cambio'] = pd.to_numeric(data['tipo_cambio'], errors='coerce')
+        frames.append(data.dropna(subset=['tipo_cambio'])[RATES_COLUMNS])
+    rates = pd.concat(frames, ignore_index=True)
+    rates = rates[(rates['moneda'] != BASE_CURRENCY) & (rates['tipo_cambio'] > 0)]
+    return (
+        rates.drop_duplicates(['moneda', 'fecha'], keep='last')
+        .sort_values(['moneda', 'fecha'], kind='stable')
+        .reset_index(drop=True)
+    )
+
+
+def load_rates() -> pd.DataFrame:
+    """Tabla de tipos de cambio ordenada por (moneda, fecha); se relee solo si el CSV cambió"""
+    signature = _signature()
+    with _lock:
+        if _cache['rates'] is None or signature != _cache['signature']:
+            _cache['rates'] = _read_rates()
+            _cache['signature'] = signature
+            _cache['database'] = None
+        return _cache['rates']
+
+
+def rates_for(monedas, fechas) -> np.ndarray:
+    """
+    Tipo de cambio de cada fila: el último publicado en o antes de la fecha (el primero si la
+    fecha es anterior a toda la tabla). PEN y moneda vacía valen 1; una moneda sin tasas también,
+    con un aviso.
+    """
+    monedas = pd.Series(monedas, dtype=object).fillna(BASE_CURRENCY).str.upper().to_numpy()
+    fechas = pd.Series(fechas, dtype=object).astype(str).str[:10].to_numpy()
+    result = np.ones(len(monedas))
+    rates = load_rates()
+
+    for moneda in np.unique(monedas):
+        if moneda == BASE_CURRENCY:
+            continue
+        rows = monedas == moneda
+        table = rates[rates['moneda'] == moneda]
+        if table.empty:
+            if moneda not in _warned:
+                _warned.add(moneda)
+                print(f"Sin tipo de cambio para {moneda}: configura FX_RATES_PATH o FX_FALLBACK_RATES")
+            continue
+        positions = np.searchsorted(table['fecha'].to_numpy(), fechas[rows], side='right') - 1
+        result[rows] = table['tipo_cambio'].to_numpy()[np.clip(positions, 0, None)]
+    return result
+
+
+def add_pen_columns(frame: pd.DataFrame, columns=('subtotal', 'igv', 'total'),
+                    date_column: str = 'fecha_emision', currency_column: str = 'moneda') -> pd.DataFrame:
+    """
+    Agrega `tipo_cambio` y `<columna>_pen` (monto en soles) para cada columna de montos.
+    Los montos convertidos se redondean a céntimos por documento; los que ya están en soles no cambian.
+    """
+    if currency_column not in frame:
+        return frame.assign(tipo_cambio=1.0, **{f"{column}_pen": frame[column] for column in columns})
+    # Solo las filas en otra moneda pasan por la búsqueda de tasas (en la mayoría de negocios, ninguna)
+    converted = (frame[currency_column].fillna(BASE_CURRENCY) != BASE_CURRENCY).to_numpy(dtype=bool)
+    rate = np.ones(len(frame))
+    if converted.any():
+        rate[converted] = rates_for(frame[currency_column][converted], frame[date_column][converted])
+    amounts = {column: frame[column].to_numpy(dtype=float) for column in columns}
+    return frame.assign(
+        tipo_cambio=rate,
+        **{
+            f"{column}_pen": np.where(converted, np.round(values * rate, 2), values) if converted.any() else values
+            for column, values in amounts.items()
+        }
+    )
+
+
+def rates_database() -> Path:
+    """
+    Archivo SQLite con la tabla fx_rates (moneda, fecha, tipo_cambio), reconstruido cuando el CSV
+    cambia. Adjuntarlo cuesta mucho menos que cargar una tabla temporal en cada conexión.
+    """
+    rates = load_rates()
+    with _lock:
+        if _cache['database'] is not None and RATES_DATABASE.exists():
+            return _cache['database']
+        RATES_DATABASE.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = RATES_DATABASE.with_name(f".{RATES_DATABASE.name}.{os.getpid()}.tmp")
+        tmp_path.unlink(missing_ok=True)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute(
+                "CREATE TABLE fx_rates (moneda TEXT, fecha TEXT, tipo_cambio REAL, "
+                "PRIMARY KEY (moneda, fecha)) WITHOUT ROWID"
+            )
+            conn.executemany("INSERT INTO fx_rates VALUES (?, ?, ?)", rates[RATES_COLUMNS].itertuples(index=False))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, RATES_DATABASE)
+        _cache['database'] = RATES_DATABASE
+        return RATES_DATABASE
+
+
+def sql_rate(table: str = 'd') -> str:
+    """
+    Expresión SQL del tipo de cambio del documento `table` (requiere `fx` adjuntada).
+    Los documentos en soles no consultan la tabla; el resto es una búsqueda por clave primaria.
+    """
+    return f"""(CASE WHEN {table}.moneda IS NULL OR {table}.moneda = '{BASE_CURRENCY}' THEN 1.0 ELSE COALESCE(
+        (SELECT r.tipo_cambio FROM fx.fx_rates r WHERE r.moneda = {table}.moneda
+         AND r.fecha <= substr({table}.fecha_emision, 1, 10) ORDER BY r.fecha DESC LIMIT 1),
+        (SELECT r.tipo_cambio FROM fx.fx_rates r WHERE r.moneda = {table}.moneda ORDER BY r.fecha LIMIT 1),
+        1.0) END)"""
+
+
+def sql_pen(column: str, table: str = 'd') -> str:
+    """Expresión SQL de `table.column` en soles, con el mismo redondeo que add_pen_columns"""
+    return (
+        f"(CASE WHEN {table}.moneda IS NULL OR {table}.moneda = '{BASE_CURRENCY}' THEN {table}.{column} "
+        f"ELSE ROUND({table}.{column} * {sql_rate(table)}, 2) END)"
+    )
@@ -0,0 +1,110 @@
+"""
+Control de integridad de correlativos (serie-número) para auditorías SUNAT
+Huecos en la numeración, números duplicados y fechas fuera de orden por serie,
+con una diferencia vectorizada sobre cada serie leída en orden de número
+"""
+import numpy as np
+
+from config import INTEGRITY_MAX_ISSUES
+from database import get_series_summary, iter_serie_numbers
+
+
+def _serie_issues(business_id: int, tipo: str, serie: str, issues: dict, max_issues: int) -> list:
+    """
+    Recorre la serie por bloques comparando cada número con el anterior (el último
+    del bloque previo se arrastra al siguiente). Agrega el detalle a `issues` hasta
+    `max_issues` por lista y retorna los conteos [huecos, duplicados, fuera_de_orden].
+    """
+    counts = [0, 0, 0]
+    previous = None  # (id, numero, fecha) de la última fila del bloque anterior
+    for frame in iter_serie_numbers(business_id, tipo, serie):
+        ids = frame['id'].to_numpy()
+        numeros = frame['numero'].to_numpy(dtype=np.int64)
+        fechas = frame['fecha_emision'].fillna('').astype(str).str[:10].to_numpy()
+        if previous is not None:
+            ids = np.concatenate([[previous[0]], ids])
+            numeros = np.concatenate([[previous[1]], numeros])
+            fechas = np.concatenate([[previous[2]], fechas])
+        previous = (ids[-1], numeros[-1], fechas[-1])
+        if len(numeros) < 2:
+            continue
+
+        step = np.diff(numeros)
+        gaps = np.flatnonzero(step > 1)
+        duplicates = np.flatnonzero(step == 0)
+        out_of_order = np.flatnonzero(fechas[1:] < fechas[:-1])
+        counts[0] += len(gaps)
+        counts[1] += len(duplicates)
+        counts[2] += len(out_of_order)
+
+        # Solo las primeras filas de cada lista se convierten a dict
+        for i in gaps[:max(max_issues - len(issues['huecos']), 0)]:
+            issues['huecos'].append({
+                'tipo': tipo, 'serie': serie,
+                'desde': int(numeros[i]) + 1, 'hasta': int(numeros[i + 1]) - 1,
+                'faltantes': int(step[i]) - 1,
+                'fecha_anterior': fechas[i], 'fecha_siguiente': fechas[i + 1]
+            })
+        for i in duplicates[:max(max_issues - len(issues['duplicados']), 0)]:
+            issues['duplicados'].append({
+                'tipo': tipo, 'serie': serie, 'numero': int(numeros[i + 1]),
+                'id': int(ids[i + 1]), 'fecha_emision': fechas[i + 1]
+            })
+        for i in out_of_order[:max(max_issues - len(issues['fuera_de_orden']), 0)]:
+            issues['fuera_de_orden'].append({
+                'tipo': tipo, 'serie': serie, 'numero': int(numeros[i + 1]), 'fecha_emision': fechas[i + 1],
+                'numero_anterior': int(numeros[i]), 'fecha_anterior': fechas[i]
+            })
+    return counts
+
+
+def scan_integrity(business_id: int, max_issues: int = INTEGRITY_MAX_ISSUES) -> dict:
+    """
+    Revisa toda la historia del negocio. Los conteos son completos; las listas
+    de detalle se cortan en `max_issues` elementos cada una.
+    """
+    issues = {'huecos': [], 'duplicados': [], 'fuera_de_orden': []}
+
+    series_rows = []
+    for row in get_series_summary(business_id).to_dict('records'):
+        huecos, duplicados, fuera_de_orden = _serie_issues(
+            business_id, row['tipo'], row['serie'], issues, max_issues
+        )
+        series_rows.append({
+            'tipo': row['tipo'],
+            'serie': row['serie'],
+            'emitidos': int(row['emitidos']),
+            'primer_numero': int(row['primer_numero']),
+            'ultimo_numero': int(row['ultimo_numero']),
+            'faltantes': int(row['ultimo_numero'] - row['primer_numero'] + 1 - row['numeros_distintos']),
+            'huecos': huecos,
+            'duplicados': duplicados,
+            'fuera_de_orden': fuera_de_orden
+        })
+
+    totals = {
+        key: sum(row[key] for row in series_rows)
+        for key in ('emitidos', 'faltantes', 'huecos', 'duplicados', 'fuera_de_orden')
+    }
+    return {
+        'series': series_rows,
+        'totales': totals,
+        **issues,
+        'truncado': any(totals[key] > len(issues[key]) for key in issues)
+    }
+
+
+def integrity_alerts(result: dict) -> list:
+    """Alertas en texto por serie con problemas (entrada para el análisis con IA)"""
+    alerts = []
+    for row in result['series']:
+        problems = []
+        if row['huecos']:
+            problems.append(f"{row['huecos']} huecos ({row['faltantes']} números faltantes)")
+        if row['duplicados']:
+            problems.append(f"{row['duplicados']} números duplicados")
+        if row['fuera_de_orden']:
+            problems.append(f"{row['fuera_de_orden']} comprobantes con fecha anterior al número previo")
+        if problems:
+            alerts.append(f"🔢 Serie {row['serie']} ({row['tipo']}): " + ', '.join(problems))
+    return alerts
@@ -2,31 +2,55 @@
 Contador AI - Servicio de reportes inteligentes para FacturaFácil
 API REST con FastAPI para generar reportes Excel con análisis de IA
 """
+import hmac
+import json
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
-from fastapi import FastAPI, HTTPException, Query
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 
-from config import PORT, REPORTS_DIR
+from config import PORT, REPORTS_DIR, EXPORTS_DIR, ADMIN_TOKEN, EVENTS_TOKEN
 from database import (
     get_business_info,
-    get_documents,
+    get_businesses,
     get_sales_summary,
-    get_top_clients,
-    get_top_products,
-    get_clients,
-    get_products
+    get_products,
+    get_tenant_period_totals,
+    iter_tenant_period_totals,
+    TENANT_TOTALS_COLUMNS
 )
 from ai_analyzer import (
-    analyze_sales_trends,
-    analyze_clients,
+    AI_BREAKER,
+    AI_STATS,
+    stream_sales_analysis,
     generate_tax_calendar,
     get_sunat_tips
 )
-from excel_generator import generate_sales_report, generate_tax_report
+from bulk_export import EXPORT_MEDIA_TYPES, export_business_data
+from ple_exporter import generate_ple_sales
+from tax_calendar import businesses_due_within
+from integrity import scan_integrity, integrity_alerts
+from anomalies import business_anomaly_alerts
+from snapshot import snapshot_status
+from sharding import sharding_stats, start_shard_refreshers
+from singleflight import FLIGHTS, request_key, singleflight_stats
+from admission import ADMISSION, AdmissionRejected, Lease, admission_stats
+from report_builder import build_analysis, build_sales_report, build_tax_report
+from prewarm import lookup_prewarmed, prewarm_stats, start_prewarm_scheduler
+from change_feed import change_feed_stats, document_event, start_change_feed
+from document_cache import document_cache_stats
+from product_rollup import product_rollup_stats
+from report_bundle import (
+    BUNDLE_KINDS,
+    DEFAULT_KINDS,
+    bundle_stats,
+    etag_matches,
+    prepare_bundle,
+    record as record_bundle_event
+)
 
 app = FastAPI(
     title="Contador AI - FacturaFácil",
@@ -44,6 +68,39 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+def start_background_tasks():
+    start_shard_refreshers()
+    start_prewarm_scheduler()
+    start_change_feed()
+
+
+@app.exception_handler(AdmissionRejected)
+def admission_rejected_handler(request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse que libera su lugar de admisión al cerrarse, aunque el cliente se haya
+    desconectado antes de leer el cuerpo (ahí el generador no llega a su finally)
+    """
+
+    def __init__(self, lease: Lease, content, **kwargs):
+        super().__init__(content, **kwargs)
+        self.lease = lease
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.lease.release()
+
+
 # =====================
 # MODELOS
 # =====================
@@ -51,12 +108,33 @@ class ReportRequest(BaseModel):
     business_id: int
     start_date: Optional[str] = None
     end_date: Optional[str] = None
+    include_items: bool = False  # Agrega la hoja "Detalle de Ítems" al reporte de ventas
+
+
+class PLERequest(BaseModel):
+    business_id: int
+    year: int
+    month: int = Field(..., ge=1, le=12)
 
 
 class TaxReportRequest(BaseModel):
     business_id: int
     year: int
-    month: int
+    month: Optional[int] = Field(None, ge=1, le=12)  # Sin mes: reporte anual (12 meses + resumen)
+
+
+class DocumentEvent(BaseModel):
+    business_id: int
+    evento: str = "emitido"  # emitido | anulado
+    document_id: Optional[int] = None
+    fecha_emision: Optional[str] = None
+
+
+# Tipos de archivo que se pueden listar y descargar
+REPORT_MEDIA_TYPES = {
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".txt": "text/plain; charset=utf-8"
+}
 
 
 # =====================
@@ -71,19 +149,47 @@ def root():
         "endpoints": {
             "GET /health": "Estado del servicio",
             "GET /analysis/{business_id}": "Análisis de ventas con IA",
+            "GET /analysis/{business_id}/stream": "Análisis de ventas con IA (streaming SSE)",
             "POST /reports/sales": "Generar reporte de ventas Excel",
             "POST /reports/tax": "Generar reporte tributario Excel",
+            "POST /reports/ple": "Generar PLE Registro de Ventas 14.1 (TXT)",
             "GET /reports/list": "Listar reportes generados",
             "GET /reports/download/{filename}": "Descargar reporte",
+            "GET /reports/bundle/{business_id}": "ZIP con los reportes del año (ETag, Range)",
+            "POST /exports": "Exportar documentos e items (Parquet / CSV.gz)",
+            "GET /exports/download/{filename}": "Descargar exportación",
+            "GET /integrity/{business_id}": "Control de correlativos (huecos, duplicados, fechas)",
+            "POST /events/documents": "Aviso del servidor: documento emitido o anulado",
             "GET /calendar/{business_id}": "Calendario tributario",
-            "GET /tips": "Tips SUNAT"
+            "GET /calendar/due": "Negocios con vencimientos próximos",
+            "GET /tips": "Tips SUNAT",
+            "GET /admin/summary": "Totales por negocio, período y tipo de todos los negocios"
         }
     }
 
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok", "service": "Contador AI", "timestamp": datetime.now().isoformat()}
+    calls = AI_STATS['llamadas']
+    return {
+        "status": "ok",
+        "service": "Contador AI",
+        "timestamp": datetime.now().isoformat(),
+        "ai": {
+            **AI_STATS,
+            "tasa_utilizable": round(AI_STATS['respuestas_utiles'] / calls, 3) if calls else None,
+            "circuit_breaker": AI_BREAKER.snapshot()
+        },
+        "replica_analitica": snapshot_status(),
+        "coalescencia": singleflight_stats(),
+        "admision": admission_stats(),
+        "precalentado": prewarm_stats(),
+        "feed_cambios": change_feed_stats(),
+        "cache_documentos": document_cache_stats(),
+        "shards": sharding_stats(),
+        "rollup_productos": product_rollup_stats(),
+        "paquetes_reportes": bundle_stats()
+    }
 
 
 @app.get("/analysis/{business_id}")
@@ -92,109 +198,170 @@ def get_analysis(
     year: Optional[int] = None
 ):
     """
-    Obtiene análisis completo de ventas con IA
+    Obtiene análisis completo de ventas con IA.
+    Si el precalentado nocturno ya lo calculó (y los datos no cambiaron) se responde al instante;
+    si no, peticiones idénticas simultáneas comparten una sola ejecución (y una sola llamada a la IA).
+    """
+    key = request_key('analysis', business_id=business_id, year=year)
+    prewarmed = lookup_prewarmed(key, business_id)
+    if prewarmed is not None:
+        return prewarmed
+    return FLIGHTS['analysis'].do(
+        key,
+        lambda: _admitted('analysis', business_id, _build_analysis, business_id, year)
+    )
+
+
+def _admitted(kind: str, business_id: int, fn, *args):
+    """
+    Ejecuta fn(*args) con un lugar del control de admisión. Va dentro de single-flight:
+    solo la ejecución líder ocupa lugar y las duplicadas no consumen el cupo del negocio.
+    """
+    with ADMISSION[kind].slot(business_id):
+        return fn(*args)
+
+
+def _build_analysis(business_id: int, year: Optional[int]) -> dict:
+    try:
+        analysis = build_analysis(business_id, year)
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail="Base de datos no encontrada")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if analysis is None:
+        raise HTTPException(status_code=404, detail="Negocio no encontrado")
+    return analysis
+
+
+@app.get("/analysis/{business_id}/stream")
+def stream_analysis(
+    business_id: int,
+    year: Optional[int] = None
+):
+    """
+    Análisis de ventas con IA como Server-Sent Events: envía el resumen
+    al instante y cada insight apenas la IA lo termina de generar.
+    El lugar del control de admisión se libera cuando termina el stream.
     """
+    controller = ADMISSION['analysis']
+    lease = controller.lease(business_id)
     try:
         business = get_business_info(business_id)
         if not business:
             raise HTTPException(status_code=404, detail="Negocio no encontrado")
-        
-        # Obtener datos
         sales_summary = get_sales_summary(business_id, year)
-        top_clients = get_top_clients(business_id)
-        top_products = get_top_products(business_id)
-        
-        # Análisis con IA
-        sales_analysis = analyze_sales_trends(sales_summary, business.get('razon_social', ''))
-        clients_analysis = analyze_clients(get_clients(business_id), top_clients)
-        
-        return {
-            "business": business,
-            "sales_analysis": sales_analysis,
-            "clients_analysis": clients_analysis,
-            "top_products": top_products.to_dict('records'),
-            "generated_at": datetime.now().isoformat()
-        }
-        
+        alerts = integrity_alerts(scan_integrity(business_id)) + business_anomaly_alerts(business_id)
     except FileNotFoundError:
+        lease.release()
         raise HTTPException(status_code=500, detail="Base de datos no encontrada")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    except BaseException:
+        lease.release()
+        raise
+    
+    def event_stream():
+        for event, data in stream_sales_analysis(sales_summary, business.get('razon_social', ''), alerts):
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+    
+    return AdmittedStreamingResponse(
+        lease,
+        controller.stream(lease, event_stream()),
+        media_type="text/event-stream"
+    )
 
 
 @app.post("/reports/sales")
 def generate_sales_excel(request: ReportRequest):
     """
-    Genera reporte completo de ventas en Excel
+    Genera reporte completo de ventas en Excel.
+    Sirve el reporte precalculado si sigue vigente; peticiones idénticas simultáneas
+    comparten el mismo archivo generado.
     """
+    key = request_key('sales_report', **request.model_dump())
+    prewarmed = lookup_prewarmed(key, request.business_id)
+    if prewarmed is not None:
+        return _sales_report_response(prewarmed)
+    return FLIGHTS['sales_report'].do(
+        key,
+        lambda: _admitted('reports', request.business_id, _build_sales_report, request)
+    )
+
+
+def _build_sales_report(request: ReportRequest) -> dict:
     try:
-        business = get_business_info(request.business_id)
-        if not business:
-            raise HTTPException(status_code=404, detail="Negocio no encontrado")
-        
-        # Obtener datos
-        documents = get_documents(request.business_id, request.start_date, request.end_date)
-        sales_summary = get_sales_summary(request.business_id)
-        top_clients = get_top_clients(request.business_id)
-        top_products = get_top_products(request.business_id)
-        
-        # Análisis IA
-        ai_analysis = analyze_sales_trends(sales_summary, business.get('razon_social', ''))
-        
-        # Generar Excel
-        filepath = generate_sales_report(
-            business_info=business,
-            documents=documents,
-            sales_summary=sales_summary,
-            top_clients=top_clients,
-            top_products=top_products,
-            ai_analysis=ai_analysis
+        report = build_sales_report(
+            request.business_id, request.start_date, request.end_date, request.include_items
         )
-        
-        filename = Path(filepath).name
-        
-        return {
-            "success": True,
-            "message": "Reporte generado exitosamente",
-            "filename": filename,
-            "download_url": f"/reports/download/{filename}",
-            "ai_powered": ai_analysis.get('ai_powered', False)
-        }
-        
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if report is None:
+        raise HTTPException(status_code=404, detail="Negocio no encontrado")
+    return _sales_report_response(report)
+
+
+def _sales_report_response(report: dict) -> dict:
+    return {
+        "success": True,
+        "message": "Reporte generado exitosamente",
+        "filename": report['filename'],
+        "download_url": f"/reports/download/{report['filename']}",
+        "ai_powered": report['ai_powered']
+    }
 
 
 @app.post("/reports/tax")
 def generate_tax_excel(request: TaxReportRequest):
     """
-    Genera reporte tributario mensual para SUNAT
+    Genera reporte tributario mensual para SUNAT, o anual si no se indica mes
     """
-    try:
-        business = get_business_info(request.business_id)
-        if not business:
+    report = lookup_prewarmed(request_key('tax_report', **request.model_dump()), request.business_id)
+    if report is None:
+        with ADMISSION['reports'].slot(request.business_id):
+            try:
+                report = build_tax_report(request.business_id, request.year, request.month)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+        if report is None:
             raise HTTPException(status_code=404, detail="Negocio no encontrado")
-        
-        documents = get_documents(request.business_id)
-        
-        filepath = generate_tax_report(
-            business_info=business,
-            documents=documents,
-            year=request.year,
-            month=request.month
-        )
-        
-        filename = Path(filepath).name
-        
-        return {
-            "success": True,
-            "message": "Reporte tributario generado",
-            "filename": filename,
-            "download_url": f"/reports/download/{filename}"
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    
+    return {
+        "success": True,
+        "message": "Reporte tributario generado",
+        "filename": report['filename'],
+        "download_url": f"/reports/download/{report['filename']}"
+    }
+
+
+@app.post("/reports/ple")
+def generate_ple_txt(request: PLERequest):
+    """
+    Genera el Registro de Ventas electrónico (PLE 14.1) del período
+    """
+    with ADMISSION['reports'].slot(request.business_id):
+        try:
+            business = get_business_info(request.business_id)
+            if not business:
+                raise HTTPException(status_code=404, detail="Negocio no encontrado")
+            
+            filepath = generate_ple_sales(
+                business_info=business,
+                business_id=request.business_id,
+                year=request.year,
+                month=request.month
+            )
+            
+            filename = Path(filepath).name
+            
+            return {
+                "success": True,
+                "message": "Registro de Ventas PLE generado",
+                "filename": filename,
+                "download_url": f"/reports/download/{filename}"
+            }
+            
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/reports/list")
@@ -203,7 +370,10 @@ def list_reports():
     Lista todos los reportes generados
     """
     reports = []
-    for file in REPORTS_DIR.glob("*.xlsx"):
+    for file in REPORTS_DIR.iterdir():
+        # Los que empiezan con punto son temporales que aún se están escribiendo
+        if file.suffix not in REPORT_MEDIA_TYPES or file.name.startswith('.') or not file.is_file():
+            continue
         reports.append({
             "filename": file.name,
             "size_kb": round(file.stat().st_size / 1024, 2),
@@ -220,19 +390,152 @@ def list_reports():
 @app.get("/reports/download/{filename}")
 def download_report(filename: str):
     """
-    Descarga un reporte Excel
+    Descarga un reporte (Excel o TXT PLE)
     """
     filepath = REPORTS_DIR / filename
-    if not filepath.exists():
+    if not filepath.exists() or filepath.suffix not in REPORT_MEDIA_TYPES:
         raise HTTPException(status_code=404, detail="Reporte no encontrado")
     
     return FileResponse(
         path=filepath,
         filename=filename,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        media_type=REPORT_MEDIA_TYPES[filepath.suffix]
+    )
+
+
+@app.get("/reports/bundle/{business_id}")
+def download_report_bundle(
+    business_id: int,
+    year: int = Query(..., ge=2000),
+    months: Optional[List[int]] = Query(None),
+    reports: Optional[List[str]] = Query(None),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Descarga en un ZIP los reportes del año (tributarios mensuales, anual, PLE y, si se pide,
+    ventas), generando los que falten. Con If-None-Match responde 304 si nada cambió y con
+    Range/If-Range retoma una descarga cortada.
+    """
+    if year > datetime.now().year:
+        raise HTTPException(status_code=400, detail="El año no puede ser futuro")
+    if months and any(not 1 <= month <= 12 for month in months):
+        raise HTTPException(status_code=400, detail="Los meses van de 1 a 12")
+    kinds = tuple(reports or DEFAULT_KINDS)
+    unknown = sorted(set(kinds) - set(BUNDLE_KINDS))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Reportes desconocidos: {unknown}; válidos: {list(BUNDLE_KINDS)}")
+    months = tuple(sorted(set(months))) if months else None
+
+    bundle = FLIGHTS['report_bundle'].do(
+        request_key('report_bundle', business_id=business_id, year=year, months=months, kinds=tuple(sorted(kinds))),
+        lambda: _prepare_bundle(business_id, year, months, kinds)
+    )
+    headers = {"ETag": bundle['etag'], "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, bundle['etag']):
+        record_bundle_event('no_modificados')
+        return Response(status_code=304, headers=headers)
+    record_bundle_event('descargas')
+    return FileResponse(
+        path=bundle['path'],
+        filename=bundle['filename'],
+        media_type="application/zip",
+        headers=headers
+    )
+
+
+def _prepare_bundle(business_id: int, year: int, months: Optional[tuple], kinds: tuple) -> dict:
+    try:
+        bundle = prepare_bundle(business_id, year, list(months) if months else None, kinds)
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if bundle is None:
+        raise HTTPException(status_code=404, detail="Negocio no encontrado")
+    return bundle
+
+
+@app.post("/exports")
+def export_business(request: ReportRequest):
+    """
+    Exporta documentos e items del negocio en formato columnar para BI
+    """
+    with ADMISSION['reports'].slot(request.business_id):
+        try:
+            business = get_business_info(request.business_id)
+            if not business:
+                raise HTTPException(status_code=404, detail="Negocio no encontrado")
+            
+            export = export_business_data(request.business_id, request.start_date, request.end_date)
+            
+            return {
+                "success": True,
+                "format": export['format'],
+                "files": {
+                    name: {**info, "download_url": f"/exports/download/{info['filename']}"}
+                    for name, info in export['files'].items()
+                }
+            }
+            
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/exports/download/{filename}")
+def download_export(filename: str):
+    """
+    Descarga un archivo de exportación
+    """
+    filepath = EXPORTS_DIR / filename
+    if not filepath.exists() or filepath.suffix not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=404, detail="Exportación no encontrada")
+    
+    return FileResponse(
+        path=filepath,
+        filename=filename,
+        media_type=EXPORT_MEDIA_TYPES[filepath.suffix]
     )
 
 
+@app.get("/integrity/{business_id}")
+def get_integrity(business_id: int):
+    """
+    Control de correlativos del negocio: huecos, duplicados y fechas fuera de orden por serie
+    """
+    try:
+        business = get_business_info(business_id)
+        if not business:
+            raise HTTPException(status_code=404, detail="Negocio no encontrado")
+        integrity = scan_integrity(business_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail="Base de datos no encontrada")
+    
+    return {
+        "business": business.get('razon_social', ''),
+        "ruc": business.get('ruc', ''),
+        **integrity,
+        "alertas": integrity_alerts(integrity)
+    }
+
+
+@app.get("/calendar/due")
+def get_due_businesses(days: int = Query(7, ge=0, le=62)):
+    """
+    Lista los negocios con vencimientos tributarios en los próximos N días
+    """
+    try:
+        due = businesses_due_within(get_businesses(), days)
+        return {
+            "days": days,
+            "total": len(due),
+            "due": due.to_dict('records')
+        }
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail="Base de datos no encontrada")
+
+
 @app.get("/calendar/{business_id}")
 def get_tax_calendar(business_id: int):
     """
@@ -245,7 +548,7 @@ def get_tax_calendar(business_id: int):
     return {
         "business": business.get('razon_social', ''),
         "ruc": business.get('ruc', ''),
-        "calendar": generate_tax_calendar(),
+        "calendar": generate_tax_calendar(ruc=business.get('ruc')),
         "tips": get_sunat_tips()
     }
 
@@ -261,6 +564,73 @@ def get_tips():
     }
 
 
+def _check_token(token: Optional[str], expected: str, name: str):
+    """Exige el token configurado; sin token configurado el endpoint queda deshabilitado"""
+    if not expected:
+        raise HTTPException(status_code=403, detail=f"{name} no configurado: endpoint deshabilitado")
+    if not token or not hmac.compare_digest(token.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail=f"{name} inválido")
+
+
+def _check_admin_token(token: Optional[str]):
+    """Los endpoints de administración exigen ADMIN_TOKEN en X-Admin-Token"""
+    _check_token(token, ADMIN_TOKEN, "ADMIN_TOKEN")
+
+
+@app.post("/events/documents")
+def receive_document_event(
+    event: DocumentEvent,
+    x_events_token: Optional[str] = Header(None)
+):
+    """
+    Webhook del servidor FacturaFácil al emitir o anular un documento: invalida
+    solo los resultados del negocio afectado y adelanta la actualización de la réplica.
+    Exige EVENTS_TOKEN en X-Events-Token (el AI_CONTADOR_TOKEN del servidor Node)
+    """
+    _check_token(x_events_token, EVENTS_TOKEN, "EVENTS_TOKEN")
+    document_event(event.business_id, event.fecha_emision)
+    return {"success": True}
+
+
+@app.get("/admin/summary")
+def get_admin_summary(
+    year: Optional[int] = None,
+    month: Optional[int] = Query(None, ge=1, le=12),
+    after: int = Query(0, ge=0, description="Último business_id de la página anterior"),
+    limit: int = Query(500, ge=1, le=5000, description="Negocios por página"),
+    stream: bool = Query(False, description="Todos los negocios como NDJSON, sin paginar"),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Totales de ventas por (negocio, período, tipo) de todos los negocios,
+    calculados en una sola consulta agregada
+    """
+    _check_admin_token(x_admin_token)
+    
+    if stream:
+        def ndjson():
+            for rows in iter_tenant_period_totals(year, month):
+                yield ''.join(
+                    json.dumps(dict(zip(TENANT_TOTALS_COLUMNS, row)), ensure_ascii=False) + '\n'
+                    for row in rows
+                )
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    
+    try:
+        totals, next_after = get_tenant_period_totals(year, month, after, limit)
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail="Base de datos no encontrada")
+    
+    return {
+        "year": year,
+        "month": month,
+        "negocios": int(totals['business_id'].nunique()),
+        "total": len(totals),
+        "next_after": next_after,
+        "totals": totals.to_dict('records')
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     print(f"🤖 Contador AI iniciando en http://localhost:{PORT}")
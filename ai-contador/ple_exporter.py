@@ -0,0 +1,126 @@
+"""
+Exportador PLE - Registro de Ventas e Ingresos (formato 14.1 SUNAT)
+Escribe el TXT delimitado por "|" fila por fila, con memoria constante
+"""
+import os
+import threading
+
+from config import REPORTS_DIR
+from database import iter_ple_sales_rows
+
+
+# Tabla 10 SUNAT: tipo de comprobante
+TIPO_COMPROBANTE = {
+    'factura': '01',
+    'boleta': '03',
+    'nota_credito': '07',
+    'nota_debito': '08'
+}
+
+# Tabla 2 SUNAT: tipo de documento de identidad
+TIPO_DOC_IDENTIDAD = {
+    'DNI': '1',
+    'CE': '4',
+    'RUC': '6',
+    'PASAPORTE': '7'
+}
+
+EMPTY_DATE = '01/01/0001'
+
+
+def ple_filename(ruc: str, year: int, month: int, has_data: bool) -> str:
+    """
+    Nombre oficial del archivo: LE + RUC + AAAAMM00 + 140100 + 00 (oportunidad)
+    + indicador de operaciones + indicador de contenido + moneda (1 = soles) + 1 (PLE)
+    """
+    return f"LE{ruc}{year}{month:02d}00140100001{1 if has_data else 0}11.txt"
+
+
+def _format_date(value) -> str:
+    """'YYYY-MM-DD...' -> 'DD/MM/YYYY' (por corte de texto: es el camino caliente)"""
+    if not value:
+        return EMPTY_DATE
+    value = str(value)
+    return f"{value[8:10]}/{value[5:7]}/{value[:4]}"
+
+
+def _amount(value) -> str:
+    return f"{float(value or 0):.2f}"
+
+
+def ple_sales_line(row: tuple, periodo: str, correlativo: int) -> str:
+    """Convierte un documento en una línea del Registro de Ventas 14.1"""
+    (doc_id, tipo, serie, numero, fecha_emision, fecha_vencimiento, moneda,
+     subtotal, igv, total, estado, cliente_tipo_doc, cliente_documento, cliente_nombre) = row[:14]
+    tipo_cambio = row[14] if len(row) > 14 and row[14] else 1.0
+
+    anulado = estado == 'anulado'
+    if anulado:
+        subtotal = igv = total = 0
+
+    fields = [
+        periodo,                                            # 1 Periodo
+        str(doc_id),                                        # 2 CUO
+        f"M{correlativo}",                                  # 3 Correlativo del asiento
+        _format_date(fecha_emision),                        # 4 Fecha de emisión
+        _format_date(fecha_vencimiento),                    # 5 Fecha de vencimiento
+        TIPO_COMPROBANTE.get(tipo, '00'),                   # 6 Tipo de comprobante
+        serie or '',                                        # 7 Serie
+        str(numero),                                        # 8 Número
+        '',                                                 # 9 Número final (tickets consolidados)
+        TIPO_DOC_IDENTIDAD.get(cliente_tipo_doc, '0'),      # 10 Tipo doc. identidad del cliente
+        cliente_documento or '0',                           # 11 Número doc. identidad
+        (cliente_nombre or 'CLIENTES VARIOS').replace('|', ' '),  # 12 Nombre o razón social
+        _amount(0),                                         # 13 Valor facturado exportación
+        _amount(subtotal),                                  # 14 Base imponible gravada
+        _amount(0),                                         # 15 Descuento de la base imponible
+        _amount(igv),                                       # 16 IGV
+        _amount(0),                                         # 17 Descuento del IGV
+        _amount(0),                                         # 18 Importe exonerado
+        _amount(0),                                         # 19 Importe inafecto
+        _amount(0),                                         # 20 ISC
+        _amount(0),                                         # 21 Base imponible arroz pilado
+        _amount(0),                                         # 22 IVAP
+        _amount(0),                                         # 23 ICBPER
+        _amount(0),                                         # 24 Otros tributos
+        _amount(total),                                     # 25 Importe total
+        moneda or 'PEN',                                    # 26 Código de moneda
+        f"{float(tipo_cambio):.3f}",                        # 27 Tipo de cambio
+        '',                                                 # 28 Fecha doc. modificado
+        '',                                                 # 29 Tipo doc. modificado
+        '',                                                 # 30 Serie doc. modificado
+        '',                                                 # 31 Número doc. modificado
+        '',                                                 # 32 Identificación del contrato
+        '',                                                 # 33 Error tipo 1 (tipo de cambio)
+        '',                                                 # 34 Indicador medio de pago
+        '2' if anulado else '1'                             # 35 Estado de la anotación
+    ]
+    return '|'.join(fields) + '|'
+
+
+def generate_ple_sales(business_info: dict, business_id: int, year: int, month: int,
+                       chunk_size: int = 5000) -> str:
+    """
+    Genera el TXT del Registro de Ventas del período leyendo los documentos
+    por bloques y escribiendo cada bloque al archivo apenas se lee
+    """
+    ruc = business_info.get('ruc', '')
+    periodo = f"{year}{month:02d}00"
+    # Temporal propio de cada proceso e hilo: dos generaciones del mismo período no se pisan
+    tmp_path = REPORTS_DIR / f".{ple_filename(ruc, year, month, True)}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    count = 0
+    try:
+        with open(tmp_path, 'w', encoding='utf-8', newline='\r\n') as f:
+            for rows in iter_ple_sales_rows(business_id, year, month, chunk_size):
+                f.writelines(
+                    ple_sales_line(row, periodo, count + i) + '\n'
+                    for i, row in enumerate(rows, 1)
+                )
+                count += len(rows)
+        filepath = REPORTS_DIR / ple_filename(ruc, year, month, count > 0)
+        tmp_path.replace(filepath)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return str(filepath)
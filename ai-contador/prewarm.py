@@ -0,0 +1,285 @@
+"""
+Precalentado de análisis y reportes de los negocios activos
+Fuera de horario se calculan el análisis, el reporte de ventas y el tributario del mes
+anterior (lo que se pide a inicio de mes) y se guardan en la base de estado. La API los
+sirve al instante mientras los datos del negocio no cambien (huella) y no venzan.
+"""
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from config import (
+    REPORTS_DIR,
+    AI_DEADLINE_SECONDS,
+    PREWARM_HOUR,
+    PREWARM_ACTIVE_DAYS,
+    PREWARM_MAX_MINUTES,
+    PREWARM_MAX_LLM_CALLS,
+    PREWARM_MAX_AGE_HOURS
+)
+from database import get_active_businesses, get_business_fingerprint
+from ai_analyzer import AI_STATS, get_ai_client
+from report_builder import build_analysis, build_sales_report, build_tax_report
+from admission import current_business, llm_quota_wait
+from singleflight import request_key
+from state_store import get_state_connection
+from change_feed import register_listener
+from sharding import active_shard, fan_out, shard_for
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prewarmed (
+    request_key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    business_id INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_prewarmed_business ON prewarmed(business_id);
+"""
+
+# Llamadas a la IA por negocio: análisis de ventas (compartido con el Excel) y de clientes
+LLM_CALLS_PER_BUSINESS = 2
+
+_stats = Counter()
+_last_run = {}
+
+
+def _key_text(key: tuple) -> str:
+    return json.dumps(key, default=str)
+
+
+def _json_default(value):
+    """Tipos numpy (ids, montos) a sus equivalentes de Python"""
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+def prewarm_keys(business_id: int, year: int, month: int) -> dict:
+    """Claves de las peticiones precalculadas; iguales a las que arma main.py para cada endpoint"""
+    return {
+        'analysis': request_key('analysis', business_id=business_id, year=None),
+        'sales_report': request_key(
+            'sales_report', business_id=business_id, start_date=None, end_date=None, include_items=False
+        ),
+        'tax_report': request_key('tax_report', business_id=business_id, year=year, month=month)
+    }
+
+
+def lookup_prewarmed(key: tuple, business_id: int):
+    """
+    Resultado precalculado de la petición o None. Se descarta si venció, si los datos del
+    negocio cambiaron desde que se calculó o si el archivo del reporte ya no existe.
+    """
+    conn = get_state_connection(SCHEMA)
+    try:
+        row = conn.execute(
+            "SELECT fingerprint, payload, created_at FROM prewarmed WHERE request_key = ?", (_key_text(key),)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    fingerprint, payload, created_at = row
+    if time.time() - created_at > PREWARM_MAX_AGE_HOURS * 3600 or fingerprint != get_business_fingerprint(business_id):
+        _stats['descartados'] += 1
+        return None
+    payload = json.loads(payload)
+    if 'filename' in payload and not (REPORTS_DIR / payload['filename']).exists():
+        _stats['descartados'] += 1
+        return None
+    _stats['servidos'] += 1
+    return payload
+
+
+def store_prewarmed(key: tuple, business_id: int, fingerprint: str, payload: dict):
+    conn = get_state_connection(SCHEMA)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO prewarmed VALUES (?, ?, ?, ?, ?, ?)",
+                (_key_text(key), key[0], business_id, fingerprint,
+                 json.dumps(payload, ensure_ascii=False, default=_json_default), time.time())
+            )
+    finally:
+        conn.close()
+
+
+def invalidate_businesses(changes: dict):
+    """Listener del feed de cambios: descarta los resultados precalculados de los negocios afectados"""
+    business_ids = list(changes)
+    conn = get_state_connection(SCHEMA)
+    try:
+        with conn:
+            deleted = conn.execute(
+                f"DELETE FROM prewarmed WHERE business_id IN ({','.join('?' * len(business_ids))})", business_ids
+            ).rowcount
+    finally:
+        conn.close()
+    _stats['invalidados'] += deleted
+
+
+register_listener(invalidate_businesses)
+
+
+def _fresh_today(keys: dict, fingerprint: str) -> bool:
+    """Si el negocio ya se precalentó hoy con los mismos datos (una segunda corrida no repite el trabajo)"""
+    start_of_day = datetime.combine(datetime.now().date(), datetime.min.time()).timestamp()
+    conn = get_state_connection(SCHEMA)
+    try:
+        fresh = conn.execute(
+            f"SELECT COUNT(*) FROM prewarmed WHERE request_key IN ({','.join('?' * len(keys))}) "
+            "AND fingerprint = ? AND created_at >= ?",
+            (*[_key_text(key) for key in keys.values()], fingerprint, start_of_day)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    return fresh == len(keys)
+
+
+def _purge_expired():
+    conn = get_state_connection(SCHEMA)
+    try:
+        with conn:
+            conn.execute("DELETE FROM prewarmed WHERE created_at < ?", (time.time() - PREWARM_MAX_AGE_HOURS * 3600,))
+    finally:
+        conn.close()
+
+
+def prewarm_business(business_id: int, year: int, month: int, ai_enabled: bool) -> bool:
+    """
+    Calcula y guarda los tres resultados del negocio. La huella se toma antes de calcular:
+    si los datos cambian mientras tanto, el resultado queda inválido en vez de desactualizado.
+    Retorna False si la IA está configurada pero no respondió (no se guarda un análisis básico).
+    """
+    fingerprint = get_business_fingerprint(business_id)
+    keys = prewarm_keys(business_id, year, month)
+    if _fresh_today(keys, fingerprint):
+        _stats['vigentes'] += 1
+        return True
+
+    analysis = build_analysis(business_id)
+    if analysis is None:
+        return True
+    if ai_enabled and not analysis['sales_analysis'].get('ai_powered'):
+        return False
+    store_prewarmed(keys['analysis'], business_id, fingerprint, analysis)
+
+    # Nombres fijos por negocio: cada corrida reemplaza el archivo de la anterior
+    sales = build_sales_report(
+        business_id, ai_analysis=analysis['sales_analysis'],
+        filename=f"reporte_ventas_negocio_{business_id}.xlsx"
+    )
+    store_prewarmed(keys['sales_report'], business_id, fingerprint, sales)
+
+    tax = build_tax_report(
+        business_id, year, month, filename=f"reporte_tributario_negocio_{business_id}_{year}_{month:02d}.xlsx"
+    )
+    store_prewarmed(keys['tax_report'], business_id, fingerprint, tax)
+    _stats['precalentados'] += 1
+    return True
+
+
+def prewarm_active_businesses(max_minutes: float = PREWARM_MAX_MINUTES, max_llm_calls: int = PREWARM_MAX_LLM_CALLS,
+                              active_days: int = PREWARM_ACTIVE_DAYS, today: datetime = None) -> dict:
+    """
+    Precalienta los negocios con documentos en los últimos `active_days` días, del más activo
+    al menos activo, hasta agotar el presupuesto de tiempo o de llamadas a la IA.
+    Los shards se recorren en paralelo (un hilo por shard) con el presupuesto compartido.
+    Las llamadas a la IA esperan cupo en vez de caer al modo básico.
+    """
+    today = today or datetime.now()
+    previous_month = today.replace(day=1) - timedelta(days=1)
+    active = get_active_businesses((today - timedelta(days=active_days)).strftime('%Y-%m-%d'))
+    by_shard = {}
+    for business_id in active['business_id'].tolist():
+        by_shard.setdefault(shard_for(business_id).name, []).append(business_id)
+    ai_enabled = get_ai_client() is not None
+    started = time.monotonic()
+    deadline = started + max_minutes * 60
+    calls_before = AI_STATS['llamadas']
+    summary = Counter(activos=len(active))
+    stopped_by = []
+    lock = threading.Lock()
+    reserved = Counter()
+
+    def reserve() -> bool:
+        """Aparta las llamadas del próximo negocio; False si se agotó algún presupuesto"""
+        with lock:
+            if not stopped_by and time.monotonic() >= deadline:
+                stopped_by.append('tiempo')
+            if not stopped_by and ai_enabled and (
+                AI_STATS['llamadas'] - calls_before + reserved['llamadas'] + LLM_CALLS_PER_BUSINESS > max_llm_calls
+            ):
+                stopped_by.append('llamadas_ia')
+            if stopped_by:
+                return False
+            reserved['llamadas'] += LLM_CALLS_PER_BUSINESS
+            return True
+
+    def run_shard():
+        for business_id in by_shard.get(active_shard().name, []):
+            if not reserve():
+                break
+            business_token = current_business.set(business_id)
+            try:
+                ok = prewarm_business(business_id, previous_month.year, previous_month.month, ai_enabled)
+                outcome = 'procesados' if ok else None
+            except Exception as e:
+                print(f"Error precalentando negocio {business_id}: {e}")
+                outcome = 'errores'
+            finally:
+                current_business.reset(business_token)
+            with lock:
+                reserved['llamadas'] -= LLM_CALLS_PER_BUSINESS
+                if outcome is None:
+                    stopped_by.append('ia_no_disponible')
+                    break
+                summary[outcome] += 1
+
+    _purge_expired()
+    wait_token = llm_quota_wait.set(AI_DEADLINE_SECONDS)
+    try:
+        fan_out(run_shard)
+    finally:
+        llm_quota_wait.reset(wait_token)
+
+    result = {
+        **summary,
+        'llamadas_ia': AI_STATS['llamadas'] - calls_before,
+        'segundos': round(time.monotonic() - started, 1),
+        'detenido_por': stopped_by[0] if stopped_by else None,
+        'fecha': today.isoformat(timespec='seconds')
+    }
+    _last_run.clear()
+    _last_run.update(result)
+    return result
+
+
+def start_prewarm_scheduler(hour: int = PREWARM_HOUR) -> threading.Thread:
+    """Hilo que corre el precalentado todos los días a la hora `hour` (None: deshabilitado)"""
+    if hour is None:
+        return None
+
+    def run():
+        while True:
+            now = datetime.now()
+            next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+            if next_run <= now:
+                next_run += timedelta(days=1)
+            time.sleep((next_run - now).total_seconds())
+            try:
+                result = prewarm_active_businesses()
+                print(f"Precalentado: {result}")
+            except Exception as e:
+                print(f"Error en el precalentado: {e}")
+
+    thread = threading.Thread(target=run, name="prewarm-scheduler", daemon=True)
+    thread.start()
+    return thread
+
+
+def prewarm_stats() -> dict:
+    return {**_stats, 'ultima_corrida': dict(_last_run) or None}
@@ -0,0 +1,291 @@
+"""
+Rollup de ventas por (negocio, producto, mes) en la base de estado
+Los productos del catálogo se identifican por product_id (un cambio de descripción no los
+divide) y los ítems libres por su descripción normalizada. Top de productos, tendencia y
+precio realizado frente al de lista se calculan sobre el rollup, sin recorrer los ítems:
+se recalculan solo los meses que marca el feed de cambios o cuya huella cambió (también
+los cambios cuyo aviso se perdió).
+"""
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+
+import pandas as pd
+
+from config import IGV_RATE, PRODUCT_TREND_MONTHS
+from database import get_period_fingerprints, get_product_month_totals, get_products
+from state_store import get_state_connection
+from change_feed import register_listener
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS product_rollup (
+    business_id INTEGER NOT NULL,
+    product_key TEXT NOT NULL,
+    periodo TEXT NOT NULL,
+    product_id INTEGER,
+    descripcion TEXT NOT NULL,
+    cantidad REAL NOT NULL,
+    valor_venta REAL NOT NULL,
+    monto_total REAL NOT NULL,
+    documentos INTEGER NOT NULL,
+    PRIMARY KEY (business_id, product_key, periodo)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS product_rollup_state (
+    business_id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    built_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS product_rollup_dirty (
+    business_id INTEGER NOT NULL,
+    periodo TEXT NOT NULL,
+    PRIMARY KEY (business_id, periodo)
+) WITHOUT ROWID;
+"""
+
+ROLLUP_COLUMNS = [
+    'product_key', 'periodo', 'product_id', 'descripcion', 'cantidad', 'valor_venta', 'monto_total', 'documentos'
+]
+
+TOP_PRODUCTS_COLUMNS = [
+    'descripcion', 'cantidad_vendida', 'monto_total', 'en_documentos', 'participacion',
+    'precio_promedio', 'precio_lista', 'variacion_precio', 'tendencia', 'product_id', 'codigo'
+]
+
+# Un cálculo a la vez por negocio (dos peticiones simultáneas no recorren los ítems dos veces)
+_locks = defaultdict(threading.Lock)
+_locks_guard = threading.Lock()
+_stats = Counter()
+
+
+def _product_rows(totals: pd.DataFrame) -> pd.DataFrame:
+    """Filas del rollup a partir de get_product_month_totals (los ítems libres ya vienen unidos por `clave`)"""
+    if totals.empty:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    product_ids = totals['product_id'].astype('Int64')
+    rows = totals.assign(
+        product_id=product_ids,
+        descripcion=totals['descripcion'].fillna('').astype(str),
+        product_key=('p:' + product_ids.astype(str)).where(product_ids.notna(), 'd:' + totals['clave'].fillna(''))
+    )
+    return rows.round({'valor_venta': 2, 'monto_total': 2})[ROLLUP_COLUMNS]
+
+
+def _store(conn, business_id: int, rows: pd.DataFrame, periods: list = None):
+    """Reemplaza el rollup del negocio (o solo de `periods`) dentro de una transacción"""
+    if periods is None:
+        conn.execute("DELETE FROM product_rollup WHERE business_id = ?", (business_id,))
+    else:
+        conn.execute(
+            f"DELETE FROM product_rollup WHERE business_id = ? AND periodo IN ({','.join('?' * len(periods))})",
+            (business_id, *periods)
+        )
+    conn.executemany(
+        "INSERT INTO product_rollup VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (business_id, key, periodo, None if pd.isna(product_id) else int(product_id), descripcion,
+             float(cantidad), float(valor_venta), float(monto_total), int(documentos))
+            for key, periodo, product_id, descripcion, cantidad, valor_venta, monto_total, documentos
+            in rows.itertuples(index=False, name=None)
+        )
+    )
+
+
+def _stored_fingerprints(state) -> dict:
+    """Huellas por período guardadas; None si no hay rollup (o es de un formato anterior)"""
+    if state is None:
+        return None
+    try:
+        fingerprints = json.loads(state[0])
+    except ValueError:
+        return None
+    return fingerprints if isinstance(fingerprints, dict) else None
+
+
+def refresh_rollup(business_id: int) -> str:
+    """
+    Pone al día el rollup del negocio. Retorna 'vigente', 'meses' (los meses marcados por el
+    feed de cambios y los de huella distinta a la guardada) o 'completo' (primera vez, o el
+    feed pidió rearmarlo). Las huellas se toman antes de leer: se guardan solo las de meses
+    que quedaron recalculados, así un cambio sin aviso se recoge en la próxima lectura.
+    """
+    fingerprints = get_period_fingerprints(business_id)
+    fingerprints.pop('clientes')
+    with _locks_guard:
+        lock = _locks[business_id]
+    with lock:
+        conn = get_state_connection(SCHEMA)
+        try:
+            stored = _stored_fingerprints(conn.execute(
+                "SELECT fingerprint FROM product_rollup_state WHERE business_id = ?", (business_id,)
+            ).fetchone())
+            dirty = [row[0] for row in conn.execute(
+                "SELECT periodo FROM product_rollup_dirty WHERE business_id = ?", (business_id,)
+            )]
+            if stored is None:
+                mode, periods = 'completo', None
+            else:
+                changed = {
+                    periodo for periodo in set(fingerprints) | set(stored)
+                    if fingerprints.get(periodo) != stored.get(periodo)
+                }
+                periods = sorted(changed | set(dirty))
+                if not periods:
+                    _stats['vigentes'] += 1
+                    return 'vigente'
+                mode = 'meses'
+            rows = _product_rows(get_product_month_totals(business_id, periods))
+            with conn:
+                _store(conn, business_id, rows, periods)
+                conn.execute(
+                    "INSERT OR REPLACE INTO product_rollup_state VALUES (?, ?, ?)",
+                    (business_id, json.dumps(fingerprints, sort_keys=True), time.time())
+                )
+                # Solo los meses leídos: una marca que llegó durante el cálculo queda para la próxima vez
+                conn.executemany(
+                    "DELETE FROM product_rollup_dirty WHERE business_id = ? AND periodo = ?",
+                    [(business_id, periodo) for periodo in dirty]
+                )
+            _stats[f'recalculos_{mode}'] += 1
+            return mode
+        finally:
+            conn.close()
+
+
+def mark_changed(changes: dict):
+    """
+    Listener del feed de cambios: marca los meses afectados de cada negocio. Sin meses
+    conocidos, el rollup del negocio se descarta y se rearma entero en la próxima lectura.
+    """
+    conn = get_state_connection(SCHEMA)
+    try:
+        with conn:
+            for business_id, periods in changes.items():
+                if periods:
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO product_rollup_dirty VALUES (?, ?)",
+                        [(business_id, periodo) for periodo in periods]
+                    )
+                else:
+                    conn.execute("DELETE FROM product_rollup_state WHERE business_id = ?", (business_id,))
+    finally:
+        conn.close()
+
+
+register_listener(mark_changed)
+
+
+def get_product_rollup(business_id: int) -> pd.DataFrame:
+    """Rollup vigente del negocio: una fila por (producto, mes). Columnas: ROLLUP_COLUMNS"""
+    refresh_rollup(business_id)
+    conn = get_state_connection(SCHEMA)
+    try:
+        return pd.read_sql_query(
+            f"SELECT {', '.join(ROLLUP_COLUMNS)} FROM product_rollup WHERE business_id = ? ORDER BY periodo",
+            conn, params=(business_id,)
+        )
+    finally:
+        conn.close()
+
+
+def _shift_period(periodo: str, months: int) -> str:
+    year, month = map(int, periodo.split('-'))
+    index = year * 12 + month - 1 + months
+    return f"{index // 12}-{index % 12 + 1:02d}"
+
+
+def _list_prices(business_id: int) -> pd.DataFrame:
+    """Catálogo con el precio de lista sin IGV (el valor de venta unitario que correspondería)"""
+    products = get_products(business_id)
+    net = products['precio'].astype(float).where(
+        products['igv_incluido'].fillna(1).astype(int) == 0, products['precio'].astype(float) / (1 + IGV_RATE)
+    )
+    return pd.DataFrame({
+        'product_id': products['id'].astype('Int64'),
+        'codigo': products['codigo'],
+        'descripcion_catalogo': products['descripcion'],
+        'precio_lista': net.round(2)
+    })
+
+
+def get_top_products(business_id: int, limit: int = 10) -> pd.DataFrame:
+    """
+    Productos más vendidos desde el rollup, con:
+    - participacion: % del monto total del negocio
+    - precio_promedio: valor de venta unitario realizado (sin IGV, en soles)
+    - precio_lista / variacion_precio: precio del catálogo sin IGV y % del realizado frente a él
+      (negativo: se vendió con descuento); vacío en ítems libres
+    - tendencia: % de variación de los últimos PRODUCT_TREND_MONTHS meses frente a los anteriores,
+      tomando como referencia el último mes con ventas del negocio
+    Columnas: TOP_PRODUCTS_COLUMNS (descripcion, cantidad_vendida, monto_total y en_documentos
+    como el resumen anterior por descripción)
+    """
+    rollup = get_product_rollup(business_id)
+    if rollup.empty:
+        return pd.DataFrame(columns=TOP_PRODUCTS_COLUMNS)
+
+    last = rollup['periodo'].max()
+    recent_start = _shift_period(last, 1 - PRODUCT_TREND_MONTHS)
+    previous_start = _shift_period(last, 1 - 2 * PRODUCT_TREND_MONTHS)
+    rollup = rollup.assign(
+        reciente=rollup['monto_total'].where(rollup['periodo'] >= recent_start, 0.0),
+        anterior=rollup['monto_total'].where(
+            (rollup['periodo'] >= previous_start) & (rollup['periodo'] < recent_start), 0.0
+        )
+    )
+    products = rollup.sort_values('periodo', ascending=False, kind='stable').groupby('product_key', sort=False).agg(
+        product_id=('product_id', 'first'),
+        descripcion=('descripcion', 'first'),
+        cantidad_vendida=('cantidad', 'sum'),
+        valor_venta=('valor_venta', 'sum'),
+        monto_total=('monto_total', 'sum'),
+        en_documentos=('documentos', 'sum'),
+        reciente=('reciente', 'sum'),
+        anterior=('anterior', 'sum')
+    )
+    grand_total = products['monto_total'].sum()
+    top = products.nlargest(limit, 'monto_total').reset_index(drop=True)
+    top['product_id'] = top['product_id'].astype('Int64')
+    top = top.merge(_list_prices(business_id), on='product_id', how='left')
+
+    # El nombre vigente del catálogo: un producto renombrado sigue siendo una sola fila
+    top['descripcion'] = top['descripcion_catalogo'].where(top['descripcion_catalogo'].notna(), top['descripcion'])
+    top['participacion'] = (top['monto_total'] / grand_total * 100).round(1) if grand_total else 0.0
+    top['precio_promedio'] = (top['valor_venta'] / top['cantidad_vendida'].where(top['cantidad_vendida'] != 0)).round(2)
+    top['variacion_precio'] = ((top['precio_promedio'] / top['precio_lista'].where(top['precio_lista'] > 0) - 1) * 100).round(1)
+    top['tendencia'] = ((top['reciente'] / top['anterior'].where(top['anterior'] > 0) - 1) * 100).round(1)
+    top['monto_total'] = top['monto_total'].round(2)
+    top = top[TOP_PRODUCTS_COLUMNS]
+    # None en vez de NaN: el resultado va a JSON (análisis) y a Excel
+    return top.astype(object).where(top.notna(), None)
+
+
+def get_product_trends(business_id: int, months: int = 12, limit: int = 10) -> pd.DataFrame:
+    """
+    Monto vendido por mes (columnas 'YYYY-MM', últimos `months` meses con referencia en el
+    último mes con ventas) de los `limit` productos con más ventas en ese lapso
+    """
+    rollup = get_product_rollup(business_id)
+    if rollup.empty:
+        return pd.DataFrame(columns=['descripcion'])
+    last = rollup['periodo'].max()
+    periods = [_shift_period(last, offset) for offset in range(1 - months, 1)]
+    window = rollup[rollup['periodo'] >= periods[0]]
+    monthly = window.pivot_table(
+        index='product_key', columns='periodo', values='monto_total', aggfunc='sum', fill_value=0.0
+    ).reindex(columns=periods, fill_value=0.0)
+    monthly = monthly.loc[monthly.sum(axis=1).nlargest(limit).index]
+
+    names = rollup.sort_values('periodo', kind='stable').groupby('product_key')[['product_id', 'descripcion']].last()
+    catalog = _list_prices(business_id).set_index('product_id')['descripcion_catalogo']
+    descripcion = names['descripcion'].where(
+        names['product_id'].isna(), names['product_id'].astype('Int64').map(catalog).fillna(names['descripcion'])
+    )
+    monthly.insert(0, 'descripcion', descripcion.reindex(monthly.index))
+    monthly.columns.name = None
+    return monthly.reset_index(drop=True).round(2)
+
+
+def product_rollup_stats() -> dict:
+    return dict(_stats)
@@ -0,0 +1,106 @@
+"""
+Serialización compacta de datos para prompts de IA
+Mantiene acotado el tamaño del prompt sin importar la antigüedad del negocio
+"""
+import json
+import math
+from typing import Callable
+
+import pandas as pd
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken es opcional
+    _ENCODING = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Estima los tokens de un texto (exacto con tiktoken, ~4 caracteres por token sin él)"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def compact_json(data) -> str:
+    """JSON sin espacios innecesarios"""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def monthly_series(sales_data: pd.DataFrame, max_months: int = None) -> dict:
+    """
+    Resumen mensual en formato columnar, en orden cronológico:
+    {"periodo": [...], "boleta": [...], "factura": [...], "docs": [...], "total": [...]}
+    Los meses anteriores a los últimos `max_months` se agregan en "anteriores".
+    """
+    if sales_data is None or sales_data.empty:
+        return {}
+
+    periods = sales_data['año'].astype(str) + '-' + sales_data['mes'].astype(str)
+    pivot = (
+        sales_data.assign(periodo=periods)
+        .pivot_table(index='periodo', columns='tipo', values='total', aggfunc='sum', fill_value=0)
+        .sort_index()
+    )
+    docs = sales_data.groupby(periods)['cantidad_documentos'].sum().reindex(pivot.index)
+    totals = pivot.sum(axis=1)
+
+    series = {'periodo': list(pivot.index)}
+    for tipo in pivot.columns:
+        series[str(tipo)] = pivot[tipo].round(2).tolist()
+    series['docs'] = docs.astype(int).tolist()
+    series['total'] = totals.round(2).tolist()
+
+    if max_months and len(pivot) > max_months:
+        cut = len(pivot) - max_months
+        older = {
+            'meses': cut,
+            'docs': int(docs.iloc[:cut].sum()),
+            'total': round(float(totals.iloc[:cut].sum()), 2)
+        }
+        series = {key: values[cut:] for key, values in series.items()}
+        series['anteriores'] = older
+
+    return series
+
+
+def table_to_csv(df: pd.DataFrame, columns: list = None, max_rows: int = None) -> str:
+    """Tabla como CSV compacto (montos con 2 decimales)"""
+    if df is None or df.empty:
+        return 'Sin datos'
+    if columns:
+        df = df[[c for c in columns if c in df.columns]]
+    if max_rows:
+        df = df.head(max_rows)
+    return df.to_csv(index=False, float_format='%.2f', lineterminator='\n').strip()
+
+
+def strip_indentation(text: str) -> str:
+    """Quita la sangría de cada línea del prompt (son tokens que no aportan)"""
+    return '\n'.join(line.strip() for line in text.strip().splitlines())
+
+
+def build_bounded_prompt(render: Callable[[int, list], str], max_months: int, max_tokens: int,
+                         items: list = None) -> str:
+    """
+    Construye el prompt con `render(meses, items)` reduciendo a la mitad los meses
+    incluidos hasta que el prompt quepa en `max_tokens`. Si con un mes aún no cabe,
+    descarta los `items` de menor prioridad (los del final de la lista). Si ni así
+    cabe, lo avisa y retorna el prompt más corto posible.
+    """
+    items = list(items or [])
+    months = max(1, max_months)
+    prompt = strip_indentation(render(months, items))
+    while estimate_tokens(prompt) > max_tokens and months > 1:
+        months //= 2
+        prompt = strip_indentation(render(months, items))
+    kept = len(items)
+    while estimate_tokens(prompt) > max_tokens and kept > 0:
+        kept //= 2
+        prompt = strip_indentation(render(months, items[:kept]))
+    tokens = estimate_tokens(prompt)
+    if tokens > max_tokens:
+        print(f"Prompt de {tokens} tokens excede el límite de {max_tokens} aun con el mínimo de datos")
+    return prompt
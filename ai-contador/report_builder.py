@@ -0,0 +1,120 @@
+"""
+Construcción de análisis y reportes Excel de un negocio
+La usan los endpoints de la API y el precalentado nocturno (prewarm.py), para que
+un resultado precalculado sea idéntico al que se generaría en la petición
+"""
+import calendar
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from database import (
+    get_business_info,
+    get_documents,
+    get_sales_summary,
+    get_top_clients,
+    get_client_counts,
+    get_client_activity,
+    iter_item_detail_rows
+)
+from ai_analyzer import analyze_sales_trends, analyze_clients
+from product_rollup import get_top_products, get_product_trends
+from excel_generator import generate_sales_report, generate_tax_report, generate_annual_tax_report
+from segmentation import rfm_scores, segment_summary
+from integrity import scan_integrity, integrity_alerts
+from anomalies import business_anomaly_alerts
+
+
+def build_analysis(business_id: int, year: Optional[int] = None) -> Optional[dict]:
+    """Análisis completo de ventas y clientes; None si el negocio no existe"""
+    business = get_business_info(business_id)
+    if not business:
+        return None
+
+    sales_summary = get_sales_summary(business_id, year)
+    top_products = get_top_products(business_id)
+    integrity = scan_integrity(business_id)
+
+    sales_analysis = analyze_sales_trends(
+        sales_summary, business.get('razon_social', ''),
+        integrity_alerts(integrity) + business_anomaly_alerts(business_id)
+    )
+    segments = segment_summary(rfm_scores(get_client_activity(business_id)))
+    clients_analysis = analyze_clients(get_client_counts(business_id), segments)
+
+    return {
+        "business": business,
+        "sales_analysis": sales_analysis,
+        "clients_analysis": clients_analysis,
+        "integrity": integrity['totales'],
+        "top_products": top_products.to_dict('records'),
+        "generated_at": datetime.now().isoformat()
+    }
+
+
+def build_sales_report(business_id: int, start_date: str = None, end_date: str = None,
+                       include_items: bool = False, ai_analysis: dict = None,
+                       filename: str = None) -> Optional[dict]:
+    """
+    Genera el Excel de ventas. `ai_analysis` reutiliza el análisis de ventas de toda la
+    historia (build_analysis sin año) en vez de volver a llamar a la IA.
+    Retorna {'filename', 'ai_powered'} o None si el negocio no existe.
+    """
+    business = get_business_info(business_id)
+    if not business:
+        return None
+
+    documents = get_documents(business_id, start_date, end_date)
+    sales_summary = get_sales_summary(business_id)
+    top_clients = get_top_clients(business_id)
+    top_products = get_top_products(business_id)
+    integrity = scan_integrity(business_id)
+
+    if ai_analysis is None:
+        ai_analysis = analyze_sales_trends(
+            sales_summary, business.get('razon_social', ''),
+            integrity_alerts(integrity) + business_anomaly_alerts(business_id)
+        )
+
+    filepath = generate_sales_report(
+        business_info=business,
+        documents=documents,
+        sales_summary=sales_summary,
+        top_clients=top_clients,
+        top_products=top_products,
+        ai_analysis=ai_analysis,
+        item_rows=iter_item_detail_rows(business_id, start_date, end_date) if include_items else None,
+        integrity=integrity,
+        product_trends=get_product_trends(business_id),
+        filename=filename
+    )
+    return {'filename': Path(filepath).name, 'ai_powered': ai_analysis.get('ai_powered', False)}
+
+
+def build_tax_report(business_id: int, year: int, month: Optional[int] = None,
+                     filename: str = None) -> Optional[dict]:
+    """Reporte tributario mensual, o anual sin mes. Retorna {'filename'} o None si el negocio no existe"""
+    business = get_business_info(business_id)
+    if not business:
+        return None
+
+    if month is None:
+        documents = get_documents(business_id, f"{year}-01-01", f"{year}-12-31")
+        filepath = generate_annual_tax_report(
+            business_info=business,
+            documents=documents,
+            year=year,
+            filename=filename
+        )
+    else:
+        # El reporte mensual solo usa su período: no hace falta leer toda la historia
+        last_day = calendar.monthrange(year, month)[1]
+        documents = get_documents(business_id, f"{year}-{month:02d}-01", f"{year}-{month:02d}-{last_day:02d}")
+        filepath = generate_tax_report(
+            business_info=business,
+            documents=documents,
+            year=year,
+            month=month,
+            filename=filename
+        )
+    return {'filename': Path(filepath).name}
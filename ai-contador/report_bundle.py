@@ -0,0 +1,273 @@
+"""
+Paquete ZIP con los reportes de un año de un negocio (/reports/bundle)
+Cada reporte del paquete se reutiliza si ya existe y la huella de su período no cambió desde
+que se generó; si falta o quedó desactualizado se genera en la petición. El ZIP se escribe a
+disco miembro por miembro (nunca entero en memoria) con un nombre que depende de su ETag: la
+misma descarga responde 304 y una descarga cortada se retoma con Range sobre los mismos bytes.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import zipfile
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from config import REPORTS_DIR, REPORT_BUNDLES_DIR, REPORT_BUNDLES_KEEP
+from database import get_business_info, get_business_fingerprint, get_period_fingerprints
+from report_builder import build_sales_report, build_tax_report
+from ple_exporter import generate_ple_sales
+from admission import ADMISSION
+from singleflight import FLIGHTS, request_key
+from state_store import get_state_connection
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bundle_members (
+    member_key TEXT PRIMARY KEY,
+    business_id INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+# Versión del formato del paquete: cambiarla invalida los ETag ya entregados
+FORMAT_VERSION = '1'
+
+# tributario: un Excel por mes; anual: Excel del año; ple: TXT 14.1 por mes; ventas: Excel del año (usa la IA)
+BUNDLE_KINDS = ('tributario', 'anual', 'ple', 'ventas')
+DEFAULT_KINDS = ('tributario', 'anual', 'ple')
+
+# El xlsx ya viene comprimido; el TXT del PLE se comprime bien
+COMPRESSION = {'.xlsx': zipfile.ZIP_STORED, '.txt': zipfile.ZIP_DEFLATED}
+
+_stats = Counter()
+
+
+def _member_record(member_key: str):
+    conn = get_state_connection(SCHEMA)
+    try:
+        return conn.execute(
+            "SELECT filename, fingerprint FROM bundle_members WHERE member_key = ?", (member_key,)
+        ).fetchone()
+    finally:
+        conn.close()
+
+
+def _store_member(member_key: str, business_id: int, filename: str, fingerprint: str):
+    conn = get_state_connection(SCHEMA)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO bundle_members VALUES (?, ?, ?, ?, ?)",
+                (member_key, business_id, filename, fingerprint, time.time())
+            )
+    finally:
+        conn.close()
+
+
+def _publish(filename: str, build) -> str:
+    """
+    Genera el reporte `filename` con `build(nombre temporal)` y lo publica con os.replace: quien
+    esté descargando la versión anterior (/reports/download u otro paquete) sigue con sus bytes
+    """
+    tmp_name = f".{os.getpid()}.{threading.get_ident()}.{filename}"
+    try:
+        build(tmp_name)
+        os.replace(REPORTS_DIR / tmp_name, REPORTS_DIR / filename)
+    except BaseException:
+        (REPORTS_DIR / tmp_name).unlink(missing_ok=True)
+        raise
+    return filename
+
+
+def _plan_members(business_id: int, business: dict, year: int, months: list, kinds: list) -> list:
+    """
+    Miembros del paquete: (clave, carpeta del ZIP, huella de sus datos, función que lo genera y
+    retorna el nombre del archivo en REPORTS_DIR, publicado con _publish). La huella se toma antes
+    de generar: si los datos cambian mientras tanto, el archivo queda marcado como desactualizado.
+    """
+    fingerprints = get_period_fingerprints(business_id, year)
+    clients = fingerprints['clientes']
+
+    def month_fingerprint(month: int) -> str:
+        return f"{fingerprints.get(f'{year}-{month:02d}', 'sin_documentos')}|{clients}"
+
+    year_fingerprint = json.dumps(fingerprints, sort_keys=True)
+    members = []
+    if 'tributario' in kinds:
+        for month in months:
+            members.append((
+                f"tributario:{business_id}:{year}:{month}", 'tributario', month_fingerprint(month),
+                lambda month=month: _publish(
+                    f"reporte_tributario_negocio_{business_id}_{year}_{month:02d}.xlsx",
+                    lambda tmp_name: build_tax_report(business_id, year, month, filename=tmp_name)
+                )
+            ))
+    if 'anual' in kinds:
+        members.append((
+            f"anual:{business_id}:{year}", 'tributario', year_fingerprint,
+            lambda: _publish(
+                f"reporte_tributario_negocio_{business_id}_{year}_anual.xlsx",
+                lambda tmp_name: build_tax_report(business_id, year, filename=tmp_name)
+            )
+        ))
+    if 'ple' in kinds:
+        for month in months:
+            members.append((
+                f"ple:{business_id}:{year}:{month}", 'ple', month_fingerprint(month),
+                lambda month=month: Path(generate_ple_sales(
+                    business_info=business, business_id=business_id, year=year, month=month
+                )).name
+            ))
+    if 'ventas' in kinds:
+        # Incluye el resumen de toda la historia: depende de la huella del negocio completo
+        members.append((
+            f"ventas:{business_id}:{year}", 'ventas',
+            f"{get_business_fingerprint(business_id)}|{year_fingerprint}",
+            lambda: _publish(
+                f"reporte_ventas_negocio_{business_id}_{year}.xlsx",
+                lambda tmp_name: build_sales_report(business_id, f"{year}-01-01", f"{year}-12-31", filename=tmp_name)
+            )
+        ))
+    return members
+
+
+def _current_file(member_key: str, fingerprint: str):
+    """Archivo vigente del miembro o None si falta o sus datos cambiaron"""
+    record = _member_record(member_key)
+    if record is None or record[1] != fingerprint:
+        return None
+    path = REPORTS_DIR / record[0]
+    return path if path.is_file() else None
+
+
+def _generate_member(member_key: str, business_id: int, fingerprint: str, generate) -> str:
+    """Genera el miembro (salvo que otra petición lo haya dejado vigente mientras tanto) y lo registra"""
+    path = _current_file(member_key, fingerprint)
+    if path is not None:
+        return path.name
+    filename = generate()
+    _store_member(member_key, business_id, filename, fingerprint)
+    return filename
+
+
+def _bundle_etag(entries: list) -> str:
+    """ETag de los bytes del ZIP: nombres, tamaños y fechas de modificación de los miembros"""
+    digest = hashlib.sha1(FORMAT_VERSION.encode())
+    for arcname, path in entries:
+        stat = path.stat()
+        digest.update(f"{arcname}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:32]
+
+
+def _write_bundle(path: Path, entries: list):
+    """
+    Escribe el ZIP copiando cada miembro por bloques (temporal + rename: quien lo esté
+    descargando sigue con el anterior). Con los mismos miembros los bytes son idénticos.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with zipfile.ZipFile(tmp_path, 'w', allowZip64=True) as archive:
+            for arcname, member in entries:
+                archive.write(member, arcname, compress_type=COMPRESSION.get(member.suffix, zipfile.ZIP_DEFLATED))
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def _mtime(path: Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+def _remove_previous(prefix: str, keep: Path):
+    """
+    Borra los ZIP anteriores de la misma selección salvo los más recientes: junto con el
+    vigente quedan REPORT_BUNDLES_KEEP, para no borrar uno que aún se está descargando
+    """
+    previous = sorted(
+        (path for path in REPORT_BUNDLES_DIR.glob(f"{prefix}*.zip") if path != keep), key=_mtime, reverse=True
+    )
+    for old in previous[REPORT_BUNDLES_KEEP - 1:]:
+        old.unlink(missing_ok=True)
+        _stats['eliminados'] += 1
+
+
+def prepare_bundle(business_id: int, year: int, months: list = None, kinds: list = DEFAULT_KINDS):
+    """
+    Deja listo en disco el ZIP de los reportes del año y retorna {'path', 'etag', 'filename',
+    'generados', 'reutilizados'}, o None si el negocio no existe. Sin meses: los del año ya
+    iniciados. Los reportes que faltan y el ZIP se arman dentro de un lugar de ADMISSION['reports'].
+    """
+    business = get_business_info(business_id)
+    if not business:
+        return None
+    if months is None:
+        today = datetime.now()
+        months = list(range(1, (today.month if year == today.year else 12) + 1))
+    kinds = [kind for kind in BUNDLE_KINDS if kind in kinds]
+
+    members = _plan_members(business_id, business, year, sorted(set(months)), kinds)
+    current = {key: _current_file(key, fingerprint) for key, _, fingerprint, _ in members}
+    missing = [member for member in members if current[member[0]] is None]
+
+    selection = hashlib.sha1(json.dumps([kinds, sorted(set(months))]).encode()).hexdigest()[:8]
+    prefix = f"reportes_negocio_{business_id}_{year}_{selection}_"
+    result = {
+        'filename': f"reportes_{business.get('ruc') or business_id}_{year}.zip",
+        'generados': len(missing),
+        'reutilizados': len(members) - len(missing)
+    }
+
+    def entries() -> list:
+        return [(f"{folder}/{current[key].name}", current[key]) for key, folder, _, _ in members]
+
+    if not missing:
+        etag = _bundle_etag(entries())
+        path = REPORT_BUNDLES_DIR / f"{prefix}{etag}.zip"
+        if path.is_file():
+            _stats['paquetes_reutilizados'] += 1
+            return {**result, 'path': path, 'etag': f'"{etag}"'}
+
+    with ADMISSION['reports'].slot(business_id):
+        for key, _, fingerprint, generate in missing:
+            current[key] = REPORTS_DIR / FLIGHTS['bundle_member'].do(
+                request_key('bundle_member', key=key, fingerprint=fingerprint),
+                lambda key=key, fingerprint=fingerprint, generate=generate: _generate_member(
+                    key, business_id, fingerprint, generate
+                )
+            )
+        etag = _bundle_etag(entries())
+        path = REPORT_BUNDLES_DIR / f"{prefix}{etag}.zip"
+        if not path.is_file():
+            _write_bundle(path, entries())
+            _stats['paquetes_armados'] += 1
+    _remove_previous(prefix, path)
+    _stats['reportes_generados'] += len(missing)
+    return {**result, 'path': path, 'etag': f'"{etag}"'}
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match con la lista de ETag del cliente (comparación débil, como pide la norma para GET)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(','))
+    return etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags)
+
+
+def record(event: str):
+    _stats[event] += 1
+
+
+def bundle_stats() -> dict:
+    return dict(_stats)
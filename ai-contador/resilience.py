@@ -0,0 +1,115 @@
+"""
+Resiliencia para llamadas a servicios externos (proveedor de IA)
+Plazo máximo por llamada, reintentos con backoff y circuit breaker
+"""
+import random
+import threading
+import time
+from typing import Callable
+
+
+class CircuitOpenError(Exception):
+    """El circuito está abierto: no se intenta la llamada"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker clásico: tras `failure_threshold` fallos consecutivos se abre
+    y rechaza llamadas durante `reset_timeout` segundos; luego deja pasar una
+    sola llamada de prueba (semiabierto) que lo cierra o lo vuelve a abrir.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = 'cerrado'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._rejected = 0
+
+    @property
+    def is_open(self) -> bool:
+        """True si el circuito está abierto y aún no toca probar (no consume la llamada de prueba)"""
+        with self._lock:
+            return self._state == 'abierto' and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def allow(self) -> bool:
+        """Indica si se puede intentar la llamada"""
+        with self._lock:
+            if self._state == 'abierto' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = 'semiabierto'
+                self._probe_in_flight = False
+            if self._state == 'cerrado':
+                return True
+            if self._state == 'semiabierto' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self._rejected += 1
+            return False
+
+    def release(self):
+        """La llamada admitida por allow() no se intentó: libera la llamada de prueba sin contar resultado"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._state = 'cerrado'
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == 'semiabierto' or self._failures >= self.failure_threshold:
+                self._state = 'abierto'
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        """Estado actual para /health"""
+        with self._lock:
+            retry_in = None
+            if self._state == 'abierto':
+                retry_in = max(0.0, round(self.reset_timeout - (time.monotonic() - self._opened_at), 1))
+            return {
+                'estado': self._state,
+                'fallos_consecutivos': self._failures,
+                'rechazadas': self._rejected,
+                'reintento_en_segundos': retry_in
+            }
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Errores que vale la pena reintentar: timeouts, conexión, 408/409/429 y 5xx"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in ('APITimeoutError', 'APIConnectionError'):
+        return True
+    status = getattr(error, 'status_code', None)
+    return status in (408, 409, 429) or (status is not None and status >= 500)
+
+
+def call_with_retry(fn: Callable[[float], object], deadline: float, max_retries: int,
+                    attempt_timeout: float, base_delay: float = 0.5, max_delay: float = 8.0):
+    """
+    Llama a `fn(timeout)` reintentando errores transitorios con backoff
+    exponencial y jitter completo, sin exceder `deadline` segundos en total.
+    Cada intento recibe como timeout el menor entre `attempt_timeout` y el tiempo restante.
+    """
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        remaining = deadline - (time.monotonic() - started)
+        try:
+            return fn(max(0.1, min(attempt_timeout, remaining)))
+        except Exception as e:
+            if attempt >= max_retries or not is_transient_error(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            if time.monotonic() - started + delay >= deadline:
+                raise
+            time.sleep(delay)
+            attempt += 1
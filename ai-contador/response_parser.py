@@ -0,0 +1,90 @@
+"""
+Lectura tolerante de respuestas JSON de la IA
+Recupera el objeto JSON aunque venga con bloques markdown, texto previo o comas sobrantes
+"""
+import json
+import re
+
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_DECODER = json.JSONDecoder()
+
+
+def _balanced_objects(text: str):
+    """Genera cada objeto {...} de nivel superior respetando strings y escapes"""
+    depth = 0
+    start = None
+    in_string = False
+    escaped = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            if depth == 0:
+                start = i
+            depth += 1
+        elif char == '}' and depth > 0:
+            depth -= 1
+            if depth == 0:
+                yield text[start:i + 1]
+
+
+def _candidates(text: str):
+    """Textos candidatos a JSON, del más directo al más permisivo"""
+    text = text.strip()
+    yield text
+    for block in _FENCE_RE.findall(text):
+        yield block.strip()
+    yield from _balanced_objects(text)
+
+
+def extract_json(text: str) -> dict:
+    """
+    Extrae el primer objeto JSON válido de la respuesta.
+    Reintenta solo el parseo (nunca la llamada) con estrategias cada vez más permisivas.
+    """
+    if not text or not text.strip():
+        raise ValueError("Respuesta vacía de la IA")
+
+    for candidate in _candidates(text):
+        for attempt in (candidate, _TRAILING_COMMA_RE.sub(r"\1", candidate)):
+            try:
+                data = json.loads(attempt)
+            except ValueError:
+                continue
+            if isinstance(data, dict):
+                return data
+
+    raise ValueError("La respuesta de la IA no contiene un objeto JSON válido")
+
+
+def partial_list_items(buffer: str, key: str) -> list:
+    """
+    Elementos string ya completos de la lista `key` dentro de un JSON
+    que todavía se está recibiendo (streaming)
+    """
+    match = re.search(r'"%s"\s*:\s*\[' % re.escape(key), buffer)
+    if not match:
+        return []
+
+    items = []
+    pos = match.end()
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= len(buffer) or buffer[pos] != '"':
+            break
+        try:
+            value, pos = _DECODER.raw_decode(buffer, pos)
+        except ValueError:
+            break  # el string aún no termina de llegar
+        items.append(value)
+    return items
@@ -0,0 +1,83 @@
+"""
+Segmentación RFM de clientes (Recencia, Frecuencia, Monto)
+Puntajes por quintiles y segmento por cliente en operaciones vectorizadas de pandas/NumPy
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+# Orden de presentación de los segmentos (del más valioso al menos activo)
+SEGMENTS = [
+    'Campeones', 'Leales', 'Nuevos', 'Potenciales',
+    'No se pueden perder', 'En riesgo', 'Hibernando', 'Perdidos'
+]
+
+SEGMENT_SUMMARY_COLUMNS = [
+    'segmento', 'clientes', 'monto', 'participacion', 'monto_promedio',
+    'frecuencia_media', 'recencia_media'
+]
+
+
+def _quintile(values: pd.Series, higher_is_better: bool = True) -> np.ndarray:
+    """Puntaje 1-5 por percentil; los empates reciben el mismo puntaje"""
+    if higher_is_better:
+        pct = values.rank(method='max', pct=True).to_numpy()
+        return np.clip(np.ceil(pct * 5), 1, 5).astype(np.int8)
+    pct = values.rank(method='min', pct=True).to_numpy()
+    return np.clip(6 - np.ceil(pct * 5), 1, 5).astype(np.int8)
+
+
+def rfm_scores(activity: pd.DataFrame, reference_date: datetime = None) -> pd.DataFrame:
+    """
+    Agrega a la actividad por cliente (client_id, frecuencia, monto, ultima_compra)
+    la recencia en días, los puntajes r, f, m (1-5) y el segmento de cada cliente
+    """
+    if activity.empty:
+        return activity.assign(recencia_dias=pd.Series(dtype='int64'), r=pd.Series(dtype='int8'),
+                               f=pd.Series(dtype='int8'), m=pd.Series(dtype='int8'),
+                               segmento=pd.Series(dtype='object'))
+
+    reference = pd.Timestamp(reference_date or datetime.now()).normalize()
+    last_purchase = pd.to_datetime(activity['ultima_compra'].astype(str).str[:10], format='%Y-%m-%d', errors='coerce')
+    recency = (reference - last_purchase).dt.days.fillna(10 ** 5).clip(lower=0).astype('int64')
+
+    r = _quintile(recency, higher_is_better=False)
+    f = _quintile(activity['frecuencia'])
+    m = _quintile(activity['monto'])
+    fm = (f + m) / 2
+
+    segment = np.select(
+        [
+            (r >= 4) & (fm >= 4),
+            (r >= 3) & (fm >= 3),
+            (r >= 4) & (f <= 2),
+            r >= 3,
+            (r <= 2) & (fm >= 4),
+            (r <= 2) & (fm >= 3),
+            r == 2
+        ],
+        SEGMENTS[:-1],
+        default=SEGMENTS[-1]
+    )
+    return activity.assign(recencia_dias=recency.to_numpy(), r=r, f=f, m=m, segmento=segment)
+
+
+def segment_summary(scored: pd.DataFrame) -> pd.DataFrame:
+    """Resumen por segmento: clientes, monto, participación en ventas y promedios"""
+    if scored.empty:
+        return pd.DataFrame(columns=SEGMENT_SUMMARY_COLUMNS)
+
+    summary = scored.groupby('segmento').agg(
+        clientes=('client_id', 'size'),
+        monto=('monto', 'sum'),
+        frecuencia_media=('frecuencia', 'mean'),
+        recencia_media=('recencia_dias', 'mean')
+    )
+    summary = summary.reindex([s for s in SEGMENTS if s in summary.index])
+    summary['participacion'] = (summary['monto'] / summary['monto'].sum() * 100).round(1)
+    summary['monto_promedio'] = summary['monto'] / summary['clientes']
+    summary['frecuencia_media'] = summary['frecuencia_media'].round(1)
+    summary['recencia_media'] = summary['recencia_media'].round(0).astype(int)
+    return summary.reset_index()[SEGMENT_SUMMARY_COLUMNS]
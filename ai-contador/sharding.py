@@ -0,0 +1,254 @@
+"""
+Shards de la base de FacturaFácil: cada negocio vive en una sola base
+El shard "principal" es DATABASE_PATH; DATABASE_SHARDS agrega otros (p. ej. tenants grandes
+separados en su propia base, o bases de otros nodos). Cada shard tiene su propia réplica
+analítica. database.get_connection abre la base del shard activo: las funciones por negocio
+lo fijan con @routed y las de todos los negocios consultan cada shard en paralelo con fan_out.
+Los business_id deben ser únicos entre shards (los shards salen de dividir una base).
+"""
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import wraps
+from inspect import isgenerator
+from pathlib import Path
+
+from config import (
+    DATABASE_PATH,
+    DATABASE_SHARDS,
+    SHARD_MAP_PATH,
+    SHARD_FANOUT_WORKERS,
+    SNAPSHOT_ENABLED,
+    SNAPSHOT_PATH,
+    SNAPSHOT_MAX_AGE_SECONDS
+)
+from snapshot import SNAPSHOT, SnapshotManager, start_snapshot_refresher
+
+
+PRIMARY = 'principal'
+DATABASE_FILENAME = 'facturafacil.db'
+
+class Shard:
+    """Una base de FacturaFácil y su réplica analítica (None si la réplica está deshabilitada)"""
+
+    def __init__(self, name: str, database_path: Path, snapshot: SnapshotManager = None):
+        self.name = name
+        self.database_path = Path(database_path)
+        self.snapshot = snapshot
+
+    def path_for_reading(self) -> Path:
+        return self.snapshot.path_for_reading() if self.snapshot is not None else self.database_path
+
+    def status(self) -> dict:
+        return {
+            'base': str(self.database_path),
+            'replica': self.snapshot.status() if self.snapshot is not None else {'habilitada': False}
+        }
+
+
+def _parse_shards(spec: str) -> dict:
+    shards = {PRIMARY: Shard(PRIMARY, Path(DATABASE_PATH), SNAPSHOT)}
+    for entry in filter(None, (item.strip() for item in spec.split(','))):
+        name, separator, path = entry.partition('=')
+        name, path = name.strip(), Path(path.strip())
+        if not separator or not name or name in shards:
+            raise ValueError(f"DATABASE_SHARDS: se esperaba 'nombre=ruta' con nombre único, no '{entry}'")
+        if path.is_dir() or not path.suffix:
+            path = path / DATABASE_FILENAME
+        replica = SNAPSHOT_PATH.with_name(f"{SNAPSHOT_PATH.stem}_{name}{SNAPSHOT_PATH.suffix}")
+        snapshot = SnapshotManager(path, replica, SNAPSHOT_MAX_AGE_SECONDS) if SNAPSHOT_ENABLED else None
+        shards[name] = Shard(name, path, snapshot)
+    return shards
+
+
+def _load_assignments(path: str, shards: dict) -> dict:
+    if not path:
+        return {}
+    with open(path, encoding='utf-8') as f:
+        assignments = {int(business_id): name for business_id, name in json.load(f).items()}
+    unknown = set(assignments.values()) - set(shards)
+    if unknown:
+        raise ValueError(f"SHARD_MAP_PATH asigna negocios a shards no configurados: {sorted(unknown)}")
+    return assignments
+
+
+class ShardRouter:
+    """
+    Resuelve el shard de cada negocio: primero las asignaciones fijas (SHARD_MAP_PATH), después
+    un mapa armado leyendo `businesses` de cada shard. Un negocio que no está en el mapa (recién
+    creado) se busca por id en la base de cada shard; si no aparece en ninguna, va al principal.
+    """
+
+    def __init__(self, shards: dict, assignments: dict):
+        self.shards = shards
+        self.assignments = assignments
+        self._lock = threading.Lock()
+        self._owners = {}
+        self._discovered_at = None
+        self._discoveries = 0
+        self._located = 0
+
+    def _discover(self):
+        owners = {}
+        for shard in self.shards.values():
+            try:
+                conn = sqlite3.connect(f"file:{shard.path_for_reading()}?mode=ro", uri=True)
+                try:
+                    ids = [row[0] for row in conn.execute("SELECT id FROM businesses")]
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print(f"Error leyendo negocios del shard {shard.name}: {e}")
+                continue
+            for business_id in ids:
+                if business_id in owners and business_id not in self.assignments:
+                    print(f"Negocio {business_id} en los shards {owners[business_id]} y {shard.name}: "
+                          f"se usa {owners[business_id]} (fíjalo en SHARD_MAP_PATH)")
+                owners.setdefault(business_id, shard.name)
+        self._owners = owners
+        self._discovered_at = time.monotonic()
+        self._discoveries += 1
+
+    def _locate(self, business_id: int):
+        """
+        Shard cuya base (la del servidor, no la réplica, que puede no tenerlo aún) contiene el
+        negocio; None si no está en ninguna. Es una búsqueda por clave primaria en cada shard.
+        """
+        for shard in self.shards.values():
+            try:
+                conn = sqlite3.connect(f"file:{shard.database_path}?mode=ro", uri=True)
+                try:
+                    found = conn.execute("SELECT 1 FROM businesses WHERE id = ?", (business_id,)).fetchone()
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                print(f"Error buscando el negocio {business_id} en el shard {shard.name}: {e}")
+                continue
+            if found:
+                return shard.name
+        return None
+
+    def shard_for(self, business_id: int) -> Shard:
+        if len(self.shards) == 1:
+            return self.shards[PRIMARY]
+        business_id = int(business_id)
+        name = self.assignments.get(business_id) or self._owners.get(business_id)
+        if name is None:
+            with self._lock:
+                if self._discovered_at is None:
+                    self._discover()
+                name = self._owners.get(business_id)
+                if name is None:
+                    name = self._locate(business_id)
+                    if name is not None:
+                        self._owners[business_id] = name
+                        self._located += 1
+        return self.shards[name or PRIMARY]
+
+    def stats(self) -> dict:
+        counts = {name: 0 for name in self.shards}
+        for name in self._owners.values():
+            counts[name] += 1
+        return {
+            'shards': {
+                name: {**shard.status(), 'negocios_conocidos': counts[name]}
+                for name, shard in self.shards.items()
+            },
+            'asignaciones_fijas': len(self.assignments),
+            'descubrimientos': self._discoveries,
+            'ubicados_por_id': self._located
+        }
+
+
+SHARDS = _parse_shards(DATABASE_SHARDS)
+ROUTER = ShardRouter(SHARDS, _load_assignments(SHARD_MAP_PATH, SHARDS))
+
+_current_shard = ContextVar('current_shard', default=None)
+
+
+def active_shard() -> Shard:
+    """Shard de las consultas en curso (el principal fuera de @routed y fan_out)"""
+    return _current_shard.get() or SHARDS[PRIMARY]
+
+
+def shard_for(business_id: int) -> Shard:
+    return ROUTER.shard_for(business_id)
+
+
+@contextmanager
+def use_shard(shard: Shard):
+    token = _current_shard.set(shard)
+    try:
+        yield shard
+    finally:
+        _current_shard.reset(token)
+
+
+def _iterate_in(shard: Shard, iterator):
+    """Consume un generador con el shard fijado en cada paso (su cuerpo corre recién al consumirlo)"""
+    try:
+        while True:
+            with use_shard(shard):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        with use_shard(shard):
+            iterator.close()
+
+
+def routed(fn):
+    """
+    Decorador de las funciones de database.py cuyo primer argumento es business_id: las
+    consultas de la función van al shard del negocio, también las de un generador retornado
+    """
+    @wraps(fn)
+    def wrapper(business_id, *args, **kwargs):
+        shard = shard_for(business_id)
+        with use_shard(shard):
+            result = fn(business_id, *args, **kwargs)
+        return _iterate_in(shard, result) if isgenerator(result) else result
+    return wrapper
+
+
+def fan_out(fn, *args, **kwargs) -> list:
+    """
+    Ejecuta fn(*args, **kwargs) en cada shard, en paralelo (hasta SHARD_FANOUT_WORKERS hilos).
+    Cada hilo hereda el contexto del llamador. Retorna los resultados en el orden de SHARDS.
+    """
+    shards = list(SHARDS.values())
+
+    def run(shard):
+        with use_shard(shard):
+            return fn(*args, **kwargs)
+
+    if len(shards) == 1:
+        return [run(shards[0])]
+    with ThreadPoolExecutor(max_workers=max(1, min(len(shards), SHARD_FANOUT_WORKERS)),
+                            thread_name_prefix='shard') as executor:
+        futures = [executor.submit(copy_context().run, run, shard) for shard in shards]
+        return [future.result() for future in futures]
+
+
+def chain_shards(fn, *args, **kwargs):
+    """Concatena un generador ejecutado en cada shard, uno tras otro (para respuestas en streaming)"""
+    for shard in SHARDS.values():
+        yield from _iterate_in(shard, fn(*args, **kwargs))
+
+
+def start_shard_refreshers() -> list:
+    """Un hilo de refresco por réplica de shard"""
+    return [
+        start_snapshot_refresher(manager=shard.snapshot)
+        for shard in SHARDS.values() if shard.snapshot is not None
+    ]
+
+
+def sharding_stats() -> dict:
+    return ROUTER.stats()
@@ -0,0 +1,92 @@
+"""
+Coalescencia de peticiones idénticas en curso (single-flight)
+Si llegan varias peticiones iguales a la vez (pestañas del dashboard, varios usuarios),
+solo la primera ejecuta las consultas y la llamada a la IA; las demás esperan y comparten
+su resultado. No es un caché: al terminar la ejecución, la siguiente petición vuelve a calcular.
+"""
+import threading
+from typing import Callable, Hashable
+
+
+class _Call:
+    """Ejecución en curso: las peticiones duplicadas esperan `done`"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Agrupa las llamadas concurrentes con la misma clave en una sola ejecución"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._executions = 0
+        self._coalesced = 0
+        self._max_waiters = 0
+
+    def do(self, key: Hashable, fn: Callable[[], object]):
+        """
+        Ejecuta `fn()` o, si ya hay una ejecución con la misma clave, espera su resultado.
+        Si la ejecución falla, todas las peticiones agrupadas reciben la misma excepción.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._executions += 1
+            else:
+                call.waiters += 1
+                self._coalesced += 1
+                self._max_waiters = max(self._max_waiters, call.waiters)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._executions + self._coalesced
+            return {
+                'ejecuciones': self._executions,
+                'coalescidas': self._coalesced,
+                'en_curso': len(self._calls),
+                'max_en_espera': self._max_waiters,
+                'tasa_coalescencia': round(self._coalesced / total, 3) if total else None
+            }
+
+
+# Un grupo por tipo de petición, para ver los contadores por endpoint en /health
+FLIGHTS = {
+    'analysis': SingleFlight(),
+    'sales_report': SingleFlight(),
+    'report_bundle': SingleFlight(),
+    # Cada reporte del paquete: selecciones distintas que comparten un miembro lo generan una vez
+    'bundle_member': SingleFlight()
+}
+
+
+def request_key(kind: str, **params) -> tuple:
+    """Clave normalizada de la petición: tipo y parámetros ordenados por nombre"""
+    return (kind, *sorted(params.items()))
+
+
+def singleflight_stats() -> dict:
+    return {name: flight.stats() for name, flight in FLIGHTS.items()}
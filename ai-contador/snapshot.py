@@ -0,0 +1,205 @@
+"""
+Réplica analítica de la base de datos de FacturaFácil
+Copia consistente de facturafacil.db con la API de backup de SQLite, para que
+los reportes pesados lean la réplica y nunca compitan con la emisión de comprobantes
+"""
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from config import (
+    DATABASE_PATH,
+    SNAPSHOT_ENABLED,
+    SNAPSHOT_PATH,
+    SNAPSHOT_MAX_AGE_SECONDS,
+    SNAPSHOT_REFRESH_SECONDS
+)
+
+
+# Índices solo de la réplica: el servidor Node reescribe su archivo completo, así que no se tocan
+ANALYTICS_INDEXES = [
+    # Cubre los resúmenes por (negocio, período, tipo) y los totales diarios sin leer la tabla
+    # (moneda incluida para la conversión a soles)
+    "CREATE INDEX IF NOT EXISTS ix_documents_business_fecha ON documents("
+    "business_id, fecha_emision, tipo, estado, subtotal, igv, total, client_id, moneda)",
+    "CREATE INDEX IF NOT EXISTS ix_documents_client ON documents(client_id)",
+    # Cubre la actividad por cliente del análisis RFM
+    "CREATE INDEX IF NOT EXISTS ix_documents_business_client ON documents("
+    "business_id, client_id, estado, total, fecha_emision, moneda)",
+    # Recorrido ordenado de correlativos por serie (control de integridad)
+    "CREATE INDEX IF NOT EXISTS ix_documents_business_serie ON documents("
+    "business_id, tipo, serie, numero, fecha_emision)",
+    # Cursor del feed de cambios (documentos anulados o modificados desde la última lectura)
+    "CREATE INDEX IF NOT EXISTS ix_documents_updated ON documents(updated_at)",
+    # Incrementos del caché Arrow de documentos (document_cache.py) por negocio
+    "CREATE INDEX IF NOT EXISTS ix_documents_business_updated ON documents(business_id, updated_at)",
+    "CREATE INDEX IF NOT EXISTS ix_items_document ON document_items(document_id)",
+    "CREATE INDEX IF NOT EXISTS ix_items_product ON document_items(product_id)",
+    "CREATE INDEX IF NOT EXISTS ix_clients_business ON clients(business_id)",
+]
+
+COPY_ATTEMPTS = 3
+
+
+class SnapshotManager:
+    """
+    Mantiene la réplica: la refresca cuando supera `max_age` segundos y la base
+    original cambió. La copia se valida (PRAGMA quick_check) y se publica con un
+    rename atómico; las conexiones abiertas siguen leyendo la versión anterior.
+    Con el hilo de refresco en marcha las lecturas nunca esperan una copia: solo lo despiertan.
+    """
+
+    def __init__(self, source: Path, replica: Path, max_age: float):
+        self.source = Path(source)
+        self.replica = Path(replica)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._source_signature = None
+        self._last_error = None
+        self._refreshes = 0
+        self._last_duration = None
+        self._wake = threading.Event()
+        self._background = False
+
+    def _signature(self) -> tuple:
+        stat = self.source.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def _copy(self, target: Path):
+        """Backup online de la base original hacia `target` y creación de índices"""
+        source = sqlite3.connect(f"file:{self.source}?mode=ro", uri=True)
+        try:
+            dest = sqlite3.connect(target)
+            try:
+                source.backup(dest)
+                if dest.execute("PRAGMA quick_check").fetchone()[0] != 'ok':
+                    raise sqlite3.DatabaseError("La copia no pasó PRAGMA quick_check")
+                for statement in ANALYTICS_INDEXES:
+                    dest.execute(statement)
+                dest.execute("ANALYZE")
+                dest.commit()
+            finally:
+                dest.close()
+        finally:
+            source.close()
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Copia la base original si cambió desde la última réplica (o si `force`).
+        El servidor Node reemplaza el archivo sin bloqueos de SQLite: si la firma
+        del archivo cambia durante la copia se descarta y se reintenta.
+        """
+        with self._lock:
+            started = time.monotonic()
+            signature = self._signature()
+            if not force and self.replica.exists() and signature == self._source_signature:
+                self._checked_at = started
+                return False
+
+            self.replica.parent.mkdir(parents=True, exist_ok=True)
+            # Propio de cada proceso e hilo: varios workers de uvicorn pueden copiar a la vez
+            tmp_path = self.replica.with_name(f".{self.replica.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            for _ in range(COPY_ATTEMPTS):
+                tmp_path.unlink(missing_ok=True)
+                try:
+                    self._copy(tmp_path)
+                except sqlite3.DatabaseError as e:
+                    self._last_error = str(e)
+                    signature = self._signature()
+                    continue
+                after = self._signature()
+                if after == signature:
+                    break
+                signature = after
+            else:
+                tmp_path.unlink(missing_ok=True)
+                raise sqlite3.DatabaseError(
+                    f"No se pudo obtener una copia consistente: {self._last_error or 'la base cambió durante la copia'}"
+                )
+
+            os.replace(tmp_path, self.replica)
+            self._source_signature = signature
+            self._checked_at = time.monotonic()
+            self._last_duration = round(self._checked_at - started, 3)
+            self._last_error = None
+            self._refreshes += 1
+            return True
+
+    def mark_stale(self):
+        """Verifica pronto la base original (p. ej. el servidor avisó un cambio)"""
+        self._checked_at = 0.0
+        self._wake.set()
+
+    def is_stale(self) -> bool:
+        return not self.replica.exists() or time.monotonic() - self._checked_at > self.max_age
+
+    def path_for_reading(self) -> Path:
+        """
+        Ruta a usar en las consultas: la réplica si está vigente. Si venció y hay hilo de
+        refresco, se lo despierta y se usa la réplica actual (o la base original si aún no
+        hay copia). Sin hilo (CLI) se refresca aquí, salvo que otro hilo ya lo esté haciendo;
+        si no se puede copiar, se lee la base original.
+        """
+        if not self.is_stale():
+            return self.replica
+        if self._background:
+            self._wake.set()
+            return self.replica if self.replica.exists() else self.source
+        if self.replica.exists() and self._lock.locked():
+            return self.replica
+        try:
+            self.refresh()
+        except (OSError, sqlite3.DatabaseError) as e:
+            self._last_error = str(e)
+            print(f"Error actualizando réplica analítica: {e}")
+            return self.replica if self.replica.exists() else self.source
+        return self.replica
+
+    def status(self) -> dict:
+        """Estado de la réplica para /health"""
+        age = round(time.monotonic() - self._checked_at, 1) if self._checked_at else None
+        return {
+            'habilitada': True,
+            'ruta': str(self.replica),
+            'segundos_desde_verificacion': age,
+            'max_antiguedad_segundos': self.max_age,
+            'actualizaciones': self._refreshes,
+            'duracion_ultima_copia': self._last_duration,
+            'ultimo_error': self._last_error
+        }
+
+
+SNAPSHOT = SnapshotManager(Path(DATABASE_PATH), SNAPSHOT_PATH, SNAPSHOT_MAX_AGE_SECONDS) if SNAPSHOT_ENABLED else None
+
+
+def snapshot_status() -> dict:
+    return SNAPSHOT.status() if SNAPSHOT else {'habilitada': False}
+
+
+def start_snapshot_refresher(interval: float = None, manager: SnapshotManager = None) -> threading.Thread:
+    """
+    Hilo en segundo plano que mantiene la réplica (por defecto la principal) al día: refresca
+    cada `interval` segundos o antes si una lectura la encontró vencida o llegó un aviso de cambio
+    """
+    manager = manager or SNAPSHOT
+    if manager is None:
+        return None
+    interval = interval or SNAPSHOT_REFRESH_SECONDS
+
+    def run():
+        while True:
+            manager._wake.clear()
+            try:
+                manager.refresh()
+            except (OSError, sqlite3.DatabaseError) as e:
+                manager._last_error = str(e)
+                print(f"Error actualizando réplica analítica: {e}")
+            manager._wake.wait(interval)
+
+    manager._background = True
+    thread = threading.Thread(target=run, name="snapshot-refresher", daemon=True)
+    thread.start()
+    return thread
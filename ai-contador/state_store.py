@@ -0,0 +1,29 @@
+"""
+Base de estado propia del servicio (SQLite en STATE_DB_PATH)
+Guarda lo que el servicio calcula y debe sobrevivir a un reinicio. La base de FacturaFácil
+y su réplica siguen siendo de solo lectura
+"""
+import sqlite3
+import threading
+
+from config import STATE_DB_PATH
+
+
+_lock = threading.Lock()
+_initialized = set()
+
+
+def get_state_connection(schema: str) -> sqlite3.Connection:
+    """
+    Conexión a la base de estado. `schema` es el DDL (CREATE ... IF NOT EXISTS) del módulo
+    que la usa; se aplica una sola vez por proceso.
+    """
+    STATE_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(STATE_DB_PATH, timeout=30)
+    with _lock:
+        if schema not in _initialized:
+            # WAL: el servidor lee mientras el CLI (o el hilo programado) escribe
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(schema)
+            _initialized.add(schema)
+    return conn
@@ -0,0 +1,247 @@
+"""
+Calendario tributario SUNAT según último dígito de RUC
+Precalcula el cronograma anual de vencimientos para búsquedas O(1)
+"""
+import json
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from config import TAX_SCHEDULE_PATH
+
+
+# Grupos de último dígito de RUC en el orden en que vencen (cronograma SUNAT)
+DIGIT_GROUPS = ((0,), (1,), (2, 3), (4, 5), (6, 7), (8, 9))
+
+# Obligaciones mensuales: el primer grupo vence en el día hábil `dia_habil`
+# del mes siguiente al período y cada grupo posterior un día hábil después
+OBLIGATIONS = {
+    'pdt621': {
+        'obligacion': 'Declaración mensual PDT 621 (IGV-Renta)',
+        'descripcion': 'Declaración y pago de IGV y pago a cuenta del Impuesto a la Renta',
+        'dia_habil': 10
+    },
+    'ple_ventas': {
+        'obligacion': 'Libros Electrónicos',
+        'descripcion': 'Envío de Registro de Ventas y Compras electrónico',
+        'dia_habil': 9
+    }
+}
+
+# Feriados nacionales de fecha fija (mes, día)
+FIXED_HOLIDAYS = (
+    (1, 1), (5, 1), (6, 7), (6, 29), (7, 23), (7, 28), (7, 29),
+    (8, 6), (8, 30), (10, 8), (11, 1), (12, 8), (12, 9), (12, 25)
+)
+
+
+def _easter(year: int) -> date:
+    """Domingo de Pascua (algoritmo de Meeus/Jones/Butcher)"""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    # Días desde la luna llena pascual hasta el domingo siguiente
+    hasta_domingo = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * hasta_domingo) // 451
+    month, day = divmod(h + hasta_domingo - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+@lru_cache(maxsize=None)
+def _holidays(year: int) -> frozenset:
+    """Feriados del año, incluidos Jueves y Viernes Santo"""
+    easter = _easter(year)
+    days = {date(year, month, day) for month, day in FIXED_HOLIDAYS}
+    days.update({easter - timedelta(days=3), easter - timedelta(days=2)})
+    return frozenset(days)
+
+
+def _business_days(year: int, month: int) -> list:
+    """Días hábiles (lunes a viernes, sin feriados) de un mes"""
+    holidays = _holidays(year)
+    day = date(year, month, 1)
+    days = []
+    while day.month == month:
+        if day.weekday() < 5 and day not in holidays:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def _load_overrides() -> dict:
+    """
+    Carga el cronograma oficial publicado por SUNAT si está configurado.
+    Formato: {"pdt621": {"2026-01": {"0": "2026-02-13", ...}}, "ple_ventas": {...}}
+    """
+    path = Path(TAX_SCHEDULE_PATH) if TAX_SCHEDULE_PATH else None
+    if not path or not path.exists():
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=None)
+def get_year_schedule(year: int) -> dict:
+    """
+    Tabla de vencimientos de los 12 períodos del año indexada por
+    (año, mes del período, último dígito de RUC) -> {obligación: fecha}
+    """
+    overrides = _load_overrides()
+    schedule = {}
+    for month in range(1, 13):
+        due_year, due_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        business_days = _business_days(due_year, due_month)
+        periodo = f"{year}-{month:02d}"
+        for obligation, spec in OBLIGATIONS.items():
+            period_overrides = overrides.get(obligation, {}).get(periodo, {})
+            for offset, digits in enumerate(DIGIT_GROUPS):
+                idx = min(spec['dia_habil'] - 1 + offset, len(business_days) - 1)
+                for digit in digits:
+                    due = business_days[idx]
+                    if str(digit) in period_overrides:
+                        due = date.fromisoformat(period_overrides[str(digit)])
+                    schedule.setdefault((year, month, digit), {})[obligation] = due
+    return schedule
+
+
+def ruc_last_digit(ruc) -> Optional[int]:
+    """Último dígito del RUC o None si el RUC no es válido"""
+    ruc = str(ruc or '').strip()
+    if len(ruc) != 11 or not ruc.isdigit():
+        return None
+    return int(ruc[-1])
+
+
+def get_due_date(digit: int, year: int, month: int, obligation: str = 'pdt621') -> date:
+    """Fecha de vencimiento de un período para un último dígito de RUC"""
+    return get_year_schedule(year)[(year, month, digit)][obligation]
+
+
+def _previous_period(year: int, month: int) -> tuple:
+    return (year - 1, 12) if month == 1 else (year, month - 1)
+
+
+def _next_period(year: int, month: int) -> tuple:
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def due_dates_between(digit: int, today: date, limit: date) -> list:
+    """
+    Todos los vencimientos de cada obligación entre `today` y `limit` (inclusive): recorre
+    los períodos desde el anterior al actual hasta que el vencimiento pasa el límite
+    """
+    dues = []
+    for obligation in OBLIGATIONS:
+        year, month = _previous_period(today.year, today.month)
+        while True:
+            due = get_due_date(digit, year, month, obligation)
+            if due > limit:
+                break
+            if due >= today:
+                dues.append({
+                    'obligacion_id': obligation,
+                    'periodo': f"{year}-{month:02d}",
+                    'fecha_vencimiento': due
+                })
+            year, month = _next_period(year, month)
+    return dues
+
+
+def upcoming_due_dates(digit: int, today: date) -> list:
+    """
+    Próximo vencimiento pendiente de cada obligación: el del período anterior
+    si aún no vence, o el del período en curso en caso contrario
+    """
+    year, month = _previous_period(today.year, today.month)
+    upcoming = []
+    for obligation in OBLIGATIONS:
+        due = get_due_date(digit, year, month, obligation)
+        periodo = (year, month)
+        if due < today:
+            periodo = (today.year, today.month)
+            due = get_due_date(digit, *periodo, obligation)
+        upcoming.append({
+            'obligacion_id': obligation,
+            'periodo': f"{periodo[0]}-{periodo[1]:02d}",
+            'fecha_vencimiento': due
+        })
+    return upcoming
+
+
+def build_calendar(ruc: str = None, current_date: datetime = None) -> list:
+    """Calendario de obligaciones para un RUC (o rango general si no hay RUC)"""
+    if current_date is None:
+        current_date = datetime.now()
+    today = current_date.date() if isinstance(current_date, datetime) else current_date
+    digit = ruc_last_digit(ruc)
+
+    calendar = []
+    if digit is not None:
+        for item in upcoming_due_dates(digit, today):
+            spec = OBLIGATIONS[item['obligacion_id']]
+            calendar.append({
+                'fecha': f"Hasta el {item['fecha_vencimiento'].strftime('%d-%m-%Y')}",
+                'periodo': item['periodo'],
+                'obligacion': spec['obligacion'],
+                'descripcion': spec['descripcion']
+            })
+    else:
+        year, month = _previous_period(today.year, today.month)
+        for obligation, spec in OBLIGATIONS.items():
+            dates = [get_due_date(d, year, month, obligation) for d in range(10)]
+            calendar.append({
+                'fecha': f"Del {min(dates).strftime('%d-%m-%Y')} al {max(dates).strftime('%d-%m-%Y')} "
+                         f"según último dígito de RUC",
+                'periodo': f"{year}-{month:02d}",
+                'obligacion': spec['obligacion'],
+                'descripcion': spec['descripcion']
+            })
+
+    calendar.append({
+        'fecha': 'Continuo',
+        'obligacion': 'Emisión de Comprobantes',
+        'descripcion': 'Emitir boletas/facturas electrónicas por cada venta'
+    })
+    return calendar
+
+
+def businesses_due_within(businesses: pd.DataFrame, days: int, today: date = None) -> pd.DataFrame:
+    """
+    Negocios con vencimientos en los próximos `days` días (todos los períodos que caen en
+    la ventana). Calcula los vencimientos una vez por dígito y los cruza con los negocios
+    en un solo merge, sin iterar por negocio.
+    """
+    if today is None:
+        today = date.today()
+    columns = ['business_id', 'ruc', 'razon_social', 'obligacion', 'periodo',
+               'fecha_vencimiento', 'dias_restantes']
+    if businesses.empty:
+        return pd.DataFrame(columns=columns)
+
+    limit = today + timedelta(days=days)
+    due_rows = []
+    for digit in range(10):
+        for item in due_dates_between(digit, today, limit):
+            due_rows.append({
+                'digito': digit,
+                'obligacion': OBLIGATIONS[item['obligacion_id']]['obligacion'],
+                'periodo': item['periodo'],
+                'fecha_vencimiento': item['fecha_vencimiento'].isoformat(),
+                'dias_restantes': (item['fecha_vencimiento'] - today).days
+            })
+    if not due_rows:
+        return pd.DataFrame(columns=columns)
+
+    df = businesses.rename(columns={'id': 'business_id'})
+    ruc = df['ruc'].astype(str).str.strip()
+    valid = ruc.str.fullmatch(r'\d{11}')
+    df = df[valid].assign(digito=ruc[valid].str[-1].astype(int))
+    result = df.merge(pd.DataFrame(due_rows), on='digito', how='inner')
+    return result[columns].sort_values(['dias_restantes', 'business_id']).reset_index(drop=True)
@@ -0,0 +1,5 @@
+"""Los módulos de ai-contador se importan por nombre, como desde main.py"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,144 @@
+import json
+
+import pandas as pd
+import pytest
+
+import ai_analyzer
+from ai_analyzer import (
+    AIUnavailableError, _batch_entry, _create_completion, _rejects_json_mode, _resilient_completion, _token_chunks
+)
+from resilience import CircuitBreaker
+from prompt_serializer import estimate_tokens
+
+
+class BadRequestError(Exception):
+    def __init__(self, message, body=None):
+        super().__init__(message)
+        self.status_code = 400
+        self.body = body
+
+
+class FakeCompletions:
+    def __init__(self, error):
+        self.error = error
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if 'response_format' in kwargs and self.error:
+            raise self.error
+        return 'respuesta'
+
+
+def make_config(error):
+    completions = FakeCompletions(error)
+    client = type('Client', (), {})()
+    client.chat = type('Chat', (), {'completions': completions})()
+    return {'type': 'prueba', 'client': client}, completions
+
+
+@pytest.fixture(autouse=True)
+def clean_downgrades(monkeypatch):
+    monkeypatch.setattr(ai_analyzer, '_json_mode_unsupported', set())
+
+
+def test_rejects_json_mode_only_for_json_errors():
+    assert _rejects_json_mode(BadRequestError("'response_format' is not supported"))
+    assert _rejects_json_mode(BadRequestError('error', body={'message': 'JSON mode not available'}))
+    assert not _rejects_json_mode(BadRequestError('maximum context length exceeded'))
+    assert not _rejects_json_mode(ValueError('response_format'))
+
+
+def test_json_mode_error_falls_back_to_text():
+    config, completions = make_config(BadRequestError('response_format json_object is not supported'))
+    kwargs = {'model': 'm', 'response_format': {'type': 'json_object'}}
+    assert _create_completion(config, kwargs) == 'respuesta'
+    assert 'response_format' not in completions.calls[-1]
+    assert 'prueba' in ai_analyzer._json_mode_unsupported
+
+
+def test_other_bad_request_is_raised_without_downgrade():
+    error = BadRequestError('maximum context length exceeded')
+    config, completions = make_config(error)
+    with pytest.raises(BadRequestError):
+        _create_completion(config, {'model': 'm', 'response_format': {'type': 'json_object'}})
+    assert len(completions.calls) == 1
+    assert not ai_analyzer._json_mode_unsupported
+
+
+def make_item(business_id, months=36, alerts=0, name='Bodega'):
+    periods = pd.period_range('2023-01', periods=months, freq='M')
+    sales = pd.DataFrame({
+        'año': [p.year for p in periods],
+        'mes': [f"{p.month:02d}" for p in periods],
+        'tipo': 'boleta',
+        'total': [1000.0 + i for i in range(months)],
+        'cantidad_documentos': 10
+    })
+    return {
+        'business_id': business_id,
+        'business_name': name,
+        'sales_data': sales,
+        'summary': {'total_ventas': 1234.5678, 'tendencia': 'estable'},
+        'alerts': [f"Hueco de correlativos en la serie B{i:03d} del mes" for i in range(alerts)]
+    }
+
+
+def test_batch_entry_is_bounded(monkeypatch):
+    monkeypatch.setattr(ai_analyzer, 'PROMPT_MAX_TOKENS', 200)
+    item = make_item(1, alerts=200, name='N' * 1000)
+    entry = _batch_entry(item)
+    assert estimate_tokens(entry) <= 200
+    data = json.loads(entry)
+    assert len(data['nombre']) == ai_analyzer.PROMPT_MAX_NAME_CHARS
+    assert data['alertas_omitidas'] == 200 - len(data.get('alertas', []))
+    assert data['total_ventas'] == 1234.57
+
+
+def test_batch_entry_keeps_everything_within_budget():
+    data = json.loads(_batch_entry(make_item(1, months=6, alerts=2)))
+    assert len(data['meses']['periodo']) == 6
+    assert len(data['alertas']) == 2 and 'alertas_omitidas' not in data
+
+
+def test_token_chunks_split_by_size_and_tokens():
+    items = [make_item(i) for i in range(5)]
+    entries = ['x' * 400, 'x' * 400, 'x' * 400, 'x' * 2000, 'x' * 40]
+    chunks = _token_chunks(items, entries, batch_size=2, max_tokens=250)
+    assert [[item['business_id'] for item in chunk] for chunk, _ in chunks] == [[0, 1], [2], [3], [4]]
+    assert all(len(chunk) == len(chunk_entries) for chunk, chunk_entries in chunks)
+
+
+class FailingCompletions:
+    def __init__(self, error):
+        self.error = error
+
+    def create(self, **kwargs):
+        raise self.error
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    monkeypatch.setattr(ai_analyzer, 'AI_BREAKER', breaker)
+    monkeypatch.setattr(ai_analyzer, 'AI_MAX_RETRIES', 0)
+    return breaker
+
+
+def failing_config(error):
+    client = type('Client', (), {})()
+    client.chat = type('Chat', (), {'completions': FailingCompletions(error)})()
+    return {'type': 'prueba', 'client': client}
+
+
+def test_permanent_errors_do_not_open_the_breaker(breaker):
+    with pytest.raises(BadRequestError):
+        _resilient_completion(failing_config(BadRequestError('maximum context length exceeded')), {'model': 'm'})
+    assert breaker.snapshot()['estado'] == 'cerrado'
+    assert breaker.snapshot()['fallos_consecutivos'] == 0
+
+
+def test_transient_errors_open_the_breaker(breaker):
+    with pytest.raises(AIUnavailableError):
+        _resilient_completion(failing_config(TimeoutError('timeout')), {'model': 'm'})
+    assert breaker.snapshot()['estado'] == 'abierto'
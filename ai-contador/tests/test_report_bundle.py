@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+import report_bundle
+from report_bundle import _publish, _remove_previous, etag_matches
+
+ETAG = '"9274795c6d2ce061eae268be9ac56c72"'
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, False),
+    ('', False),
+    (ETAG, True),
+    (f'W/{ETAG}', True),
+    ('*', True),
+    (' * ', True),
+    (f'"otro", {ETAG}', True),
+    (f'"otro",W/{ETAG}', True),
+    ('"otro"', False),
+    (ETAG.strip('"'), False),
+])
+def test_etag_matches(header, expected):
+    assert etag_matches(header, ETAG) is expected
+
+
+def test_remove_previous_keeps_most_recent(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_bundle, 'REPORT_BUNDLES_DIR', tmp_path)
+    monkeypatch.setattr(report_bundle, 'REPORT_BUNDLES_KEEP', 3)
+    bundles = []
+    for i in range(5):
+        path = tmp_path / f"reportes_negocio_1_2025_abc_{i}.zip"
+        path.write_bytes(b'zip')
+        os.utime(path, (1000 + i, 1000 + i))
+        bundles.append(path)
+    other = tmp_path / "reportes_negocio_2_2025_abc_0.zip"
+    other.write_bytes(b'zip')
+
+    _remove_previous("reportes_negocio_1_2025_abc_", bundles[0])
+
+    remaining = sorted(path.name for path in tmp_path.glob('*.zip'))
+    # El vigente más los dos anteriores más recientes; la otra selección no se toca
+    assert remaining == sorted([bundles[0].name, bundles[4].name, bundles[3].name, other.name])
+
+
+def test_publish_replaces_atomically(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_bundle, 'REPORTS_DIR', tmp_path)
+    target = tmp_path / 'reporte.xlsx'
+    target.write_bytes(b'anterior')
+    with open(target, 'rb') as downloading:
+        assert _publish('reporte.xlsx', lambda tmp_name: (tmp_path / tmp_name).write_bytes(b'nuevo')) == 'reporte.xlsx'
+        # Quien ya tenía abierto el archivo sigue leyendo la versión anterior
+        assert downloading.read() == b'anterior'
+    assert target.read_bytes() == b'nuevo'
+    assert [path.name for path in tmp_path.iterdir()] == ['reporte.xlsx']
+
+
+def test_publish_cleans_up_on_failure(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_bundle, 'REPORTS_DIR', tmp_path)
+
+    def build(tmp_name):
+        (tmp_path / tmp_name).write_bytes(b'a medias')
+        raise RuntimeError('falló')
+
+    with pytest.raises(RuntimeError):
+        _publish('reporte.xlsx', build)
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,132 @@
+import pytest
+
+from resilience import CircuitBreaker, call_with_retry, is_transient_error
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class APITimeoutError(Exception):
+    """Mismo nombre que la excepción del SDK de OpenAI"""
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.allow()
+    snapshot = breaker.snapshot()
+    assert snapshot['estado'] == 'abierto'
+    assert snapshot['rechazadas'] == 1
+    assert 0 < snapshot['reintento_en_segundos'] <= 60
+
+
+def test_success_resets_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.allow()
+    assert breaker.snapshot()['fallos_consecutivos'] == 1
+
+
+def test_half_open_lets_a_single_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert not breaker.is_open
+    assert breaker.allow()
+    assert breaker.snapshot()['estado'] == 'semiabierto'
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.snapshot()['estado'] == 'cerrado'
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0)
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.snapshot()['estado'] == 'abierto'
+
+
+def test_release_frees_the_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+    assert breaker.snapshot()['estado'] == 'semiabierto'
+
+
+@pytest.mark.parametrize('error, expected', [
+    (TimeoutError(), True),
+    (ConnectionError(), True),
+    (APITimeoutError(), True),
+    (StatusError(429), True),
+    (StatusError(408), True),
+    (StatusError(503), True),
+    (StatusError(400), False),
+    (StatusError(401), False),
+    (ValueError('json'), False),
+])
+def test_is_transient_error(error, expected):
+    assert is_transient_error(error) is expected
+
+
+def test_retry_until_success():
+    calls = []
+
+    def fn(timeout):
+        calls.append(timeout)
+        if len(calls) < 3:
+            raise StatusError(503)
+        return 'ok'
+
+    assert call_with_retry(fn, deadline=10, max_retries=3, attempt_timeout=2, base_delay=0) == 'ok'
+    assert len(calls) == 3
+    assert all(0.1 <= timeout <= 2 for timeout in calls)
+
+
+def test_retry_gives_up_after_max_retries():
+    calls = []
+
+    def fn(timeout):
+        calls.append(timeout)
+        raise TimeoutError()
+
+    with pytest.raises(TimeoutError):
+        call_with_retry(fn, deadline=10, max_retries=2, attempt_timeout=1, base_delay=0)
+    assert len(calls) == 3
+
+
+def test_permanent_errors_are_not_retried():
+    calls = []
+
+    def fn(timeout):
+        calls.append(timeout)
+        raise StatusError(400)
+
+    with pytest.raises(StatusError):
+        call_with_retry(fn, deadline=10, max_retries=3, attempt_timeout=1)
+    assert len(calls) == 1
+
+
+def test_retry_respects_deadline(monkeypatch):
+    # Un backoff que pasaría el plazo total corta los reintentos sin dormir
+    monkeypatch.setattr('resilience.random.uniform', lambda low, high: high)
+    calls = []
+
+    def fn(timeout):
+        calls.append(timeout)
+        raise ConnectionError()
+
+    with pytest.raises(ConnectionError):
+        call_with_retry(fn, deadline=1, max_retries=5, attempt_timeout=5, base_delay=2)
+    assert len(calls) == 1 and calls[0] <= 1
@@ -0,0 +1,44 @@
+import pytest
+
+from response_parser import extract_json, partial_list_items
+
+
+@pytest.mark.parametrize('text', [
+    '{"resumen": "ok", "alertas": []}',
+    '```json\n{"resumen": "ok", "alertas": []}\n```',
+    'Aquí está el análisis:\n```\n{"resumen": "ok", "alertas": []}\n```\nSaludos',
+    'Análisis: {"resumen": "ok", "alertas": []} fin',
+    '{"resumen": "ok", "alertas": [],}',
+])
+def test_extract_json_recovers_object(text):
+    assert extract_json(text) == {'resumen': 'ok', 'alertas': []}
+
+
+def test_extract_json_respects_braces_inside_strings():
+    text = 'Nota {previa} {"resumen": "usa {llaves} y \\"comillas\\"", "n": 1}'
+    assert extract_json(text) == {'resumen': 'usa {llaves} y "comillas"', 'n': 1}
+
+
+def test_extract_json_keeps_commas_inside_strings():
+    assert extract_json('{"texto": ",]"}') == {'texto': ',]'}
+
+
+@pytest.mark.parametrize('text', ['', '   ', 'sin json', '[1, 2]', '{"incompleto": '])
+def test_extract_json_rejects_invalid(text):
+    with pytest.raises(ValueError):
+        extract_json(text)
+
+
+def test_partial_list_items_returns_only_complete_strings():
+    buffer = '{"resumen": "x", "recomendaciones": ["Cobrar a tiempo", "Revisar \\"IGV\\"", "Sub'
+    assert partial_list_items(buffer, 'recomendaciones') == ['Cobrar a tiempo', 'Revisar "IGV"']
+
+
+def test_partial_list_items_complete_list():
+    buffer = '{"alertas": [\n  "a",\n  "b"\n], "otra": ["c"]}'
+    assert partial_list_items(buffer, 'alertas') == ['a', 'b']
+
+
+def test_partial_list_items_missing_key():
+    assert partial_list_items('{"resumen": "x"', 'alertas') == []
+    assert partial_list_items('{"alertas": ', 'alertas') == []
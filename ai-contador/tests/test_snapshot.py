@@ -0,0 +1,67 @@
+import sqlite3
+import time
+
+from snapshot import SnapshotManager, start_snapshot_refresher
+
+SCHEMA = """
+CREATE TABLE documents (
+    id INTEGER PRIMARY KEY, business_id INTEGER, client_id INTEGER, tipo TEXT, serie TEXT, numero INTEGER,
+    fecha_emision TEXT, estado TEXT, subtotal REAL, igv REAL, total REAL, moneda TEXT, updated_at TEXT
+);
+CREATE TABLE document_items (id INTEGER PRIMARY KEY, document_id INTEGER, product_id INTEGER);
+CREATE TABLE clients (id INTEGER PRIMARY KEY, business_id INTEGER);
+"""
+
+
+def make_source(path, documents=1):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.executemany("INSERT INTO documents (id, business_id) VALUES (?, 1)", [(i,) for i in range(documents)])
+    conn.commit()
+    conn.close()
+
+
+def count(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_without_refresher_stale_replica_is_refreshed_before_reading(tmp_path):
+    source = tmp_path / 'facturafacil.db'
+    make_source(source)
+    manager = SnapshotManager(source, tmp_path / 'replica.db', max_age=0)
+    assert manager.path_for_reading() == tmp_path / 'replica.db'
+    assert count(manager.replica) == 1
+    assert not list(tmp_path.glob('.*.tmp'))
+
+
+def test_with_refresher_reads_never_wait_for_a_copy(tmp_path):
+    source = tmp_path / 'facturafacil.db'
+    make_source(source)
+    manager = SnapshotManager(source, tmp_path / 'replica.db', max_age=3600)
+    manager.refresh()
+    start_snapshot_refresher(interval=3600, manager=manager)
+
+    conn = sqlite3.connect(source)
+    conn.execute("INSERT INTO documents (id, business_id) VALUES (99, 1)")
+    conn.commit()
+    conn.close()
+
+    locked = manager._lock.acquire()
+    try:
+        # Con una copia en curso la lectura sigue con la réplica actual y solo avisa al hilo
+        manager.mark_stale()
+        started = time.monotonic()
+        assert manager.path_for_reading() == manager.replica
+        assert time.monotonic() - started < 0.5
+    finally:
+        if locked:
+            manager._lock.release()
+
+    deadline = time.monotonic() + 5
+    while count(manager.replica) != 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert count(manager.replica) == 2
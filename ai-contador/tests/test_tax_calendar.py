@@ -0,0 +1,125 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import tax_calendar
+from tax_calendar import (
+    _business_days, _easter, _holidays, build_calendar, businesses_due_within,
+    due_dates_between, get_due_date, ruc_last_digit, upcoming_due_dates
+)
+
+
+@pytest.fixture(autouse=True)
+def without_overrides(monkeypatch):
+    """Cronograma calculado, sin el JSON oficial que pueda estar configurado"""
+    monkeypatch.setattr(tax_calendar, 'TAX_SCHEDULE_PATH', '')
+    tax_calendar.get_year_schedule.cache_clear()
+    yield
+    tax_calendar.get_year_schedule.cache_clear()
+
+
+@pytest.mark.parametrize('year, expected', [
+    (2024, date(2024, 3, 31)),
+    (2025, date(2025, 4, 20)),
+    (2026, date(2026, 4, 5)),
+    (2038, date(2038, 4, 25)),
+])
+def test_easter(year, expected):
+    assert _easter(year) == expected
+
+
+def test_holidays_include_holy_week():
+    holidays = _holidays(2026)
+    assert date(2026, 4, 2) in holidays
+    assert date(2026, 4, 3) in holidays
+    assert date(2026, 7, 28) in holidays
+    assert date(2026, 4, 6) not in holidays
+
+
+def test_business_days_skip_weekends_and_holidays():
+    days = _business_days(2026, 4)
+    assert days[0] == date(2026, 4, 1)
+    assert date(2026, 4, 2) not in days
+    assert date(2026, 4, 4) not in days
+    assert all(day.weekday() < 5 for day in days)
+    assert len(days) == 20
+
+
+def test_due_dates_follow_digit_groups():
+    # Febrero 2026: el décimo día hábil es el 13 y cada grupo vence un día hábil después
+    assert get_due_date(0, 2026, 1) == date(2026, 2, 13)
+    assert get_due_date(1, 2026, 1) == date(2026, 2, 16)
+    assert get_due_date(2, 2026, 1) == get_due_date(3, 2026, 1) == date(2026, 2, 17)
+    assert get_due_date(0, 2026, 1, 'ple_ventas') == date(2026, 2, 12)
+
+
+def test_december_period_is_due_next_year():
+    assert get_due_date(0, 2025, 12).year == 2026
+    assert get_due_date(0, 2025, 12).month == 1
+
+
+def test_overrides_replace_computed_dates(tmp_path, monkeypatch):
+    schedule = tmp_path / 'cronograma.json'
+    schedule.write_text('{"pdt621": {"2026-01": {"0": "2026-02-20"}}}', encoding='utf-8')
+    monkeypatch.setattr(tax_calendar, 'TAX_SCHEDULE_PATH', str(schedule))
+    tax_calendar.get_year_schedule.cache_clear()
+    assert get_due_date(0, 2026, 1) == date(2026, 2, 20)
+    assert get_due_date(1, 2026, 1) == date(2026, 2, 16)
+
+
+@pytest.mark.parametrize('ruc, expected', [
+    ('20600000001', 1),
+    (' 10456789128 ', 8),
+    (20600000005, 5),
+    ('2060000000', None),
+    ('2060000000A', None),
+    (None, None),
+])
+def test_ruc_last_digit(ruc, expected):
+    assert ruc_last_digit(ruc) == expected
+
+
+def test_upcoming_moves_to_current_period_once_due():
+    before = upcoming_due_dates(0, date(2026, 2, 12))
+    assert {item['periodo'] for item in before} == {'2026-01'}
+    after = upcoming_due_dates(0, date(2026, 2, 14))
+    pdt = next(item for item in after if item['obligacion_id'] == 'pdt621')
+    assert pdt['periodo'] == '2026-02'
+    assert pdt['fecha_vencimiento'] > date(2026, 2, 14)
+
+
+def test_build_calendar_without_ruc_gives_range():
+    calendar = build_calendar(current_date=date(2026, 2, 1))
+    assert calendar[0]['fecha'].startswith('Del 13-02-2026 al ')
+    assert calendar[-1]['fecha'] == 'Continuo'
+
+
+def test_businesses_due_within():
+    businesses = pd.DataFrame({
+        'id': [1, 2, 3],
+        'ruc': ['20600000000', '20600000009', 'sin ruc'],
+        'razon_social': ['A', 'B', 'C']
+    })
+    due = businesses_due_within(businesses, days=3, today=date(2026, 2, 10))
+    # Solo el dígito 0 vence (PLE el 12, PDT el 13) dentro de los 3 días
+    assert set(due['business_id']) == {1}
+    assert list(due['dias_restantes']) == [2, 3]
+    assert businesses_due_within(businesses.iloc[0:0], days=30).empty
+
+
+def test_due_dates_between_spans_several_periods():
+    dues = due_dates_between(0, date(2026, 10, 1), date(2026, 12, 2))
+    pdt = [item for item in dues if item['obligacion_id'] == 'pdt621']
+    assert [item['periodo'] for item in pdt] == ['2026-09', '2026-10']
+    assert all(date(2026, 10, 1) <= item['fecha_vencimiento'] <= date(2026, 12, 2) for item in dues)
+
+
+def test_businesses_due_within_window_longer_than_a_period():
+    businesses = pd.DataFrame({'id': [1], 'ruc': ['20600000000'], 'razon_social': ['A']})
+    due = businesses_due_within(businesses, days=62, today=date(2026, 10, 1))
+    pdt = due[due['obligacion'] == 'Declaración mensual PDT 621 (IGV-Renta)']
+    assert list(pdt['periodo']) == ['2026-09', '2026-10']
+    assert list(pdt['fecha_vencimiento']) == [
+        get_due_date(0, 2026, 9).isoformat(), get_due_date(0, 2026, 10).isoformat()
+    ]
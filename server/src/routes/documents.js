@@ -5,6 +5,7 @@ const { getDb } = require('../database/init');
 const { authMiddleware, requireBusiness, checkDocumentLimit } = require('../middleware/auth');
 const { generateDocumentPDF } = require('../services/pdfGenerator');
 const { simulateSunatValidation } = require('../services/sunatService');
+const { notifyDocumentChange } = require('../services/aiContadorNotifier');
 const path = require('path');
 const fs = require('fs');
 
@@ -233,7 +234,8 @@ router.post('/', checkDocumentLimit, documentValidation, async (req, res) => {
 
     // Update with SUNAT response
     db.prepare(`
-      UPDATE documents SET sunat_codigo = ?, sunat_respuesta = ?, hash_cpe = ?, estado = ?
+      UPDATE documents SET sunat_codigo = ?, sunat_respuesta = ?, hash_cpe = ?, estado = ?,
+        updated_at = CURRENT_TIMESTAMP
       WHERE id = ?
     `).run(sunatResult.codigo, sunatResult.mensaje, sunatResult.hash, sunatResult.estado, documentId);
 
@@ -258,7 +260,7 @@ router.post('/', checkDocumentLimit, documentValidation, async (req, res) => {
     });
 
     // Update PDF path
-    db.prepare('UPDATE documents SET pdf_path = ? WHERE id = ?').run(pdfPath, documentId);
+    db.prepare('UPDATE documents SET pdf_path = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?').run(pdfPath, documentId);
 
     // Fetch complete document
     const document = db.prepare(`
@@ -270,6 +272,8 @@ router.post('/', checkDocumentLimit, documentValidation, async (req, res) => {
 
     const documentItems = db.prepare('SELECT * FROM document_items WHERE document_id = ?').all(documentId);
 
+    notifyDocumentChange('emitido', document);
+
     res.status(201).json({
       message: `${tipo === 'boleta' ? 'Boleta' : 'Factura'} ${serie.serie}-${String(nuevoNumero).padStart(8, '0')} creada exitosamente`,
       document: { ...document, items: documentItems }
@@ -325,6 +329,8 @@ router.post('/:id/anular', (req, res) => {
       UPDATE documents SET estado = 'anulado', updated_at = CURRENT_TIMESTAMP WHERE id = ?
     `).run(req.params.id);
 
+    notifyDocumentChange('anulado', document);
+
     res.json({ message: 'Documento anulado exitosamente' });
   } catch (error) {
     console.error('Anular document error:', error);
@@ -0,0 +1,40 @@
+/**
+ * Notify ai-contador that a document was issued or annulled (POST /events/documents)
+ * so it invalidates only that business's precomputed analyses and reports.
+ * Optional (AI_CONTADOR_URL plus AI_CONTADOR_TOKEN, which must match ai-contador's
+ * EVENTS_TOKEN); never delays or fails the response to the user.
+ */
+let missingTokenWarned = false;
+
+function notifyDocumentChange(evento, document) {
+  const baseUrl = process.env.AI_CONTADOR_URL;
+  if (!baseUrl || typeof fetch !== 'function') {
+    return;
+  }
+  const token = process.env.AI_CONTADOR_TOKEN;
+  if (!token) {
+    if (!missingTokenWarned) {
+      missingTokenWarned = true;
+      console.error('AI Contador notify disabled: AI_CONTADOR_TOKEN is not set');
+    }
+    return;
+  }
+
+  fetch(`${baseUrl.replace(/\/$/, '')}/events/documents`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', 'X-Events-Token': token },
+    body: JSON.stringify({
+      evento,
+      business_id: document.business_id,
+      document_id: document.id,
+      fecha_emision: document.fecha_emision
+    }),
+    signal: AbortSignal.timeout(2000)
+  }).catch(error => {
+    console.error('AI Contador notify error:', error.message);
+  });
+}
+
+module.exports = {
+  notifyDocumentChange
+};